@@ -8,6 +8,20 @@ from teaching_utils.teaching_lib import (
     test_utils,
     gtest_utils,
     form_data_reader,
+    fingerprint_utils,
+    report_store,
+    containers,
+    staging,
+    output_capture,
+    scheduling,
+    analysis_cache,
+    analysis_engines,
+    work_queue,
+    docker_api,
+    resource_accounting,
+    build_cache,
+    artifact_proxy,
+    grader_images,
 )
 
 __all__ = [
@@ -20,4 +34,18 @@ __all__ = [
     "test_utils",
     "gtest_utils",
     "form_data_reader",
+    "fingerprint_utils",
+    "report_store",
+    "containers",
+    "staging",
+    "output_capture",
+    "scheduling",
+    "analysis_cache",
+    "analysis_engines",
+    "work_queue",
+    "docker_api",
+    "resource_accounting",
+    "build_cache",
+    "artifact_proxy",
+    "grader_images",
 ]
@@ -0,0 +1,151 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .fingerprint_utils import hash_data
+
+logger = logging.getLogger(__name__)
+
+
+def analysis_cache_key(engine: str, model: str, role: str, prompt: str, temperature: Optional[float]) -> str:
+    """
+    Key of an analysis request. Any change on the engine, model, role, prompt or temperature gives a different key.
+    """
+    return hash_data({
+        "engine": engine,
+        "model": model,
+        "role": role,
+        "prompt": prompt,
+        "temperature": temperature,
+    })
+
+
+class AnalysisCache:
+    def __init__(self, path: str, max_bytes: Optional[int] = 512 * 1024 * 1024):
+        """
+        Persistent cache of analysis engine responses backed by SQLite.
+
+        When the stored responses exceed max_bytes, the least recently used ones are evicted. The cache can be
+        shared by threads and processes.
+
+        Args:
+            path (str): Path to the database file.
+            max_bytes (int): Maximum size of the stored responses. None for no limit.
+        """
+        self._path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "  key TEXT PRIMARY KEY,"
+                "  size INTEGER,"
+                "  created REAL,"
+                "  last_used REAL,"
+                "  response BLOB"
+                ")"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        response = None
+        if row is not None:
+            try:
+                response = pickle.loads(row[0])
+            except Exception as e:
+                logger.warning(f"Discarding unreadable analysis response {key}: {e}")
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key: str, response: dict):
+        data = pickle.dumps(response)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, size, created, last_used, response) VALUES (?, ?, ?, ?, ?)",
+                (key, len(data), now, now, data)
+            )
+            if self.max_bytes is not None:
+                self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+        logger.debug(f"Evicted {len(evicted)} analysis responses from {self._path}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': size,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_ANALYSIS_CACHES: dict[str, AnalysisCache] = {}
+_ANALYSIS_CACHES_LOCK = threading.Lock()
+
+
+def get_analysis_cache(path: str, max_bytes: Optional[int] = 512 * 1024 * 1024) -> AnalysisCache:
+    """
+    Cache shared by all the testers of this process that use the same file.
+    """
+    path = os.path.abspath(path)
+    with _ANALYSIS_CACHES_LOCK:
+        cache = _ANALYSIS_CACHES.get(path)
+        if cache is None:
+            cache = _ANALYSIS_CACHES[path] = AnalysisCache(path, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from teaching_utils.config.core import Config
+from .fingerprint_utils import hash_data
+
+logger = logging.getLogger(__name__)
+
+_ENGINE_CLASSES: dict[str, type] = {}
+_ENGINES: dict[tuple, "AnalysisEngine"] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def register_engine(*names: str):
+    """
+    Class decorator to register an analysis engine with the given names.
+    """
+    def decorator(cls):
+        for name in names:
+            _ENGINE_CLASSES[name] = cls
+        return cls
+    return decorator
+
+
+def get_engine_class(name: str) -> type:
+    if name not in _ENGINE_CLASSES:
+        raise NotImplementedError(f"Unknown analysis engine: {name}")
+    return _ENGINE_CLASSES[name]
+
+
+def get_engine(name: str, options: Optional[dict] = None) -> "AnalysisEngine":
+    """
+    Engine instance shared by all the testers of this process that use the same engine and options, so clients and
+    connections are reused.
+    """
+    key = (name, hash_data(options or {}))
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            _ENGINES[key] = get_engine_class(name)(options)
+        return _ENGINES[key]
+
+
+class AnalysisEngine:
+    def __init__(self, options: Optional[dict] = None):
+        """
+        Base class of the engines used to analyze the code of the submissions.
+
+        Args:
+            options (dict): Engine specific options (see the "analysis_engine_options" tester option).
+        """
+        self.options = options or {}
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Client of the engine, created on first use and shared by all the requests.
+        """
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._create_client()
+            return self._client
+
+    def _create_client(self):
+        return None
+
+    def analyze(self, prompt: str, model: str, role: str = 'user', temperature: Optional[float] = None) -> dict:
+        """
+        Send a prompt to the engine.
+
+        Returns:
+            dict: Response with at least "success" and "message" keys.
+        """
+        raise NotImplementedError
+
+
+@register_engine('ollama', 'codellama')
+class OllamaEngine(AnalysisEngine):
+    def _create_client(self):
+        import ollama
+        return ollama.Client(host=self.options.get('host'))
+
+    def analyze(self, prompt: str, model: str, role: str = 'user', temperature: Optional[float] = None) -> dict:
+        req_response = self.client.chat(model=model, messages=[{"role": role, "content": prompt}])
+        return {
+            "success": True,
+            "duration": req_response.total_duration,
+            "message": req_response.message['content'],
+        }
+
+
+@register_engine('openai')
+class OpenAIEngine(AnalysisEngine):
+    def _create_client(self):
+        from openai import OpenAI
+
+        api_key = self.options.get('api_key')
+        if api_key is None:
+            api_key = Config().OPENAI_API_KEY
+        return OpenAI(api_key=api_key)
+
+    def analyze(self, prompt: str, model: str, role: str = 'user', temperature: Optional[float] = None) -> dict:
+        req_response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": role, "content": prompt},
+            ],
+            temperature=temperature
+        )
+        content = json.loads(req_response.choices[0].message.content.replace('```json', '').replace('```', ''))
+        return {
+            "success": len(req_response.choices) > 0,
+            "duration": 0.0,
+            "message": content['feedback'],
+            "extra_info": content,
+        }
+
+
+def replay_key(model: str, role: str, prompt: str) -> str:
+    """
+    Key of a recorded response for the replay engine.
+    """
+    return hash_data({"model": model, "role": role, "prompt": prompt})
+
+
+@register_engine('replay', 'fake')
+class ReplayEngine(AnalysisEngine):
+    def __init__(self, options: Optional[dict] = None):
+        """
+        Offline engine that returns recorded responses, to test and benchmark the analysis without network or GPU.
+
+        Options:
+            - responses (dict): Recorded responses by replay_key
+            - responses_file (str): File with recorded responses (see load_recorded_responses)
+            - latency (float): Seconds waited for each request
+            - latency_jitter (float): Maximum deviation of the latency. It is derived from the prompt, so runs are
+              reproducible.
+            - strict (bool): Fail on prompts without a recorded response, instead of returning a generated one
+        """
+        super().__init__(options)
+        self.responses = dict(self.options.get('responses') or {})
+        if self.options.get('responses_file') is not None:
+            self.responses.update(load_recorded_responses(self.options['responses_file']))
+        self.latency = float(self.options.get('latency', 0.0))
+        self.latency_jitter = float(self.options.get('latency_jitter', 0.0))
+        self.strict = self.options.get('strict', False)
+
+    def analyze(self, prompt: str, model: str, role: str = 'user', temperature: Optional[float] = None) -> dict:
+        key = replay_key(model, role, prompt)
+        latency = self.latency
+        if self.latency_jitter > 0:
+            latency += random.Random(key).uniform(-self.latency_jitter, self.latency_jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+        if key in self.responses:
+            return dict(self.responses[key])
+        if self.strict:
+            raise KeyError(f"No recorded response for prompt {key}")
+        return {
+            "success": True,
+            "duration": latency,
+            "message": f"Replayed analysis {key[:12]} ({len(prompt)} characters)",
+        }
+
+
+def load_recorded_responses(path: str) -> dict:
+    """
+    Responses of a file by replay_key: a JSON object, or JSON lines with "key" and "response" written by
+    RecordingEngine (the last line of a key wins).
+    """
+    with open(path, 'r') as f:
+        if not path.endswith('.jsonl'):
+            return json.load(f)
+        responses = {}
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted recording
+                logger.warning(f"Ignoring an incomplete recorded response in {path}")
+                continue
+            responses[record['key']] = record['response']
+        return responses
+
+
+@register_engine('record')
+class RecordingEngine(AnalysisEngine):
+    def __init__(self, options: Optional[dict] = None):
+        """
+        Engine that sends the requests to another engine and records its responses by replay_key, so they can be
+        replayed later with the replay engine.
+
+        Responses are appended to a JSON lines file with a single write each, so concurrent requests and processes
+        recording to the same file never overwrite each other.
+
+        Options:
+            - engine (str): Name of the recorded engine
+            - engine_options (dict): Options of the recorded engine
+            - responses_file (str): JSON lines file (.jsonl) where the responses are appended
+        """
+        super().__init__(options)
+        if self.options.get('engine') is None or self.options.get('responses_file') is None:
+            raise ValueError("The record engine requires the engine and responses_file options")
+        self.responses_file = self.options['responses_file']
+        if not self.responses_file.endswith('.jsonl'):
+            raise ValueError("The record engine requires a JSON lines responses_file (.jsonl)")
+
+    def analyze(self, prompt: str, model: str, role: str = 'user', temperature: Optional[float] = None) -> dict:
+        # Not resolved in the constructor, which runs while get_engine holds the registry lock
+        engine = get_engine(self.options['engine'], self.options.get('engine_options'))
+        response = engine.analyze(prompt, model, role=role, temperature=temperature)
+        line = json.dumps({"key": replay_key(model, role, prompt), "response": response}, default=str) + "\n"
+        fd = os.open(self.responses_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+        return response
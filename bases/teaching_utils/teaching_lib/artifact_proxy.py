@@ -0,0 +1,338 @@
+import html
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from .staging import stage_tree
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAMS = {
+    "maven": "https://repo.maven.apache.org/maven2",
+    "pypi": "https://pypi.org/simple",
+    "pypi_files": "https://files.pythonhosted.org/packages",
+}
+# Name of the host in the containers, mapped to the Docker host with "--add-host"
+CONTAINER_HOST = "host.docker.internal"
+SETTINGS_FILE = "settings.xml"
+PACKAGE_EXTENSIONS = ('.whl', '.tar.gz', '.zip', '.tar.bz2')
+
+MAVEN_SETTINGS = """<?xml version="1.0" encoding="UTF-8"?>
+<settings xmlns="http://maven.apache.org/SETTINGS/1.0.0">
+  <mirrors>
+    <mirror>
+      <id>teaching-utils-artifact-proxy</id>
+      <mirrorOf>*</mirrorOf>
+      <url>{url}</url>
+    </mirror>
+  </mirrors>
+</settings>
+"""
+
+
+def normalize_project_name(name: str) -> str:
+    """
+    Normalized name of a Python project (PEP 503).
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def package_project_name(filename: str) -> Optional[str]:
+    """
+    Normalized project name of a wheel or source distribution file, or None for other files.
+    """
+    if filename.endswith('.whl'):
+        return normalize_project_name(filename.split('-')[0])
+    for extension in PACKAGE_EXTENSIONS:
+        if filename.endswith(extension):
+            return normalize_project_name(filename[:-len(extension)].rsplit('-', 1)[0])
+    return None
+
+
+def docker_bridge_gateway(network: str = "bridge") -> Optional[str]:
+    """
+    Address of the host on a Docker network (for the default bridge, the address of "host-gateway"), or None if it
+    can not be found.
+    """
+    try:
+        result = subprocess.run(
+            ["docker", "network", "inspect", "--format", "{{range .IPAM.Config}}{{.Gateway}} {{end}}", network],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=30,
+            text=True
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Cannot inspect docker network {network}: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    # IPv4 gateway, as "host-gateway" is
+    gateways = [gateway for gateway in result.stdout.split() if '.' in gateway]
+    return gateways[0] if gateways else None
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    server: "_ProxyServer"
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def _handle(self, send_body: bool):
+        proxy = self.server.proxy
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        parts = [part for part in path.split('/') if part]
+        if '..' in parts or len(parts) < 2:
+            self.send_error(404)
+            return
+        try:
+            if parts[0] == 'maven2':
+                file_path = proxy.get_maven_file('/'.join(parts[1:]))
+            elif parts[0] == 'pypi' and parts[1] == 'simple' and len(parts) == 3:
+                file_path = proxy.get_pypi_index(parts[2])
+            elif parts[0] == 'pypi' and parts[1] == 'packages':
+                file_path = proxy.get_pypi_file('/'.join(parts[2:]))
+            else:
+                file_path = None
+        except OSError as e:
+            logger.warning(f"Artifact proxy error for {path}: {e}")
+            proxy.count('errors')
+            self.send_error(502)
+            return
+        if file_path is None:
+            self.send_error(404)
+            return
+
+        content_type = "text/html" if file_path.endswith('.html') else "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(file_path)))
+        self.end_headers()
+        if send_body:
+            with open(file_path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Artifact proxy: {format % args}")
+
+
+class _ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, proxy: "ArtifactProxy"):
+        super().__init__(address, _ProxyHandler)
+        self.proxy = proxy
+
+
+class ArtifactProxy:
+    def __init__(self, store_path: str, host: Optional[str] = None, port: int = 0, offline: bool = False,
+                 upstreams: Optional[dict] = None, timeout: float = 60):
+        """
+        Local read-through proxy of Maven and PyPI artifacts, so builds in the containers do not depend on the
+        internet. Artifacts are served from an on-disk store, and missing ones are downloaded from the upstream
+        repositories and kept in the store (unless offline).
+
+        Paths:
+            - /maven2/<path>: Maven repository
+            - /pypi/simple/<project>/: PyPI simple index. Upstream pages are stored with relative links to the
+              proxy. Offline, the page is generated from the packages in the store.
+            - /pypi/packages/<path>: Python packages
+
+        Args:
+            store_path (str): Folder of the stored artifacts.
+            host (str): Address where the proxy listens. It must be reachable from the containers. By default, the
+                address of the host on the Docker bridge (where "host-gateway" points), so the proxy is not exposed
+                to other machines. Use "0.0.0.0" to expose it on all the interfaces.
+            port (int): Port of the proxy (0 for any free port).
+            offline (bool): Only serve stored artifacts (air-gapped hosts).
+            upstreams (dict): Upstream URLs, updating DEFAULT_UPSTREAMS ("maven", "pypi" and "pypi_files").
+            timeout (float): Timeout in seconds of the upstream requests.
+        """
+        self.store_path = os.path.abspath(store_path)
+        self.host = host
+        self.port = port
+        self.offline = offline
+        self.upstreams = dict(DEFAULT_UPSTREAMS)
+        self.upstreams.update(upstreams or {})
+        self.timeout = timeout
+        self._stats = {'hits': 0, 'misses': 0, 'not_found': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._server: Optional[_ProxyServer] = None
+        self._thread: Optional[threading.Thread] = None
+        for folder in ("maven", os.path.join("pypi", "simple"), os.path.join("pypi", "packages")):
+            os.makedirs(os.path.join(self.store_path, folder), exist_ok=True)
+
+    def seed(self, kind: str, source: str, mode: str = 'auto'):
+        """
+        Add artifacts to the store: a Maven repository folder (e.g. the local repository after resolving the
+        scaffold project) for "maven", or a folder of Python packages for "pypi".
+
+        The artifacts are not resolved here: the folders are prepared by the caller, e.g. with
+        "mvn dependency:go-offline" or "pip download -r requirements.txt" on the scaffold. Artifacts that are not
+        seeded are downloaded on first use, unless the proxy is offline.
+        """
+        if kind == "maven":
+            target = os.path.join(self.store_path, "maven")
+        elif kind == "pypi":
+            target = os.path.join(self.store_path, "pypi", "packages", "local")
+        else:
+            raise ValueError(f"Unknown artifact kind: {kind}")
+        stats = stage_tree(source, target, mode)
+        logger.info(f"Seeded the artifact proxy with {kind} artifacts from {source}: {stats}")
+
+    def count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total > 0 else None
+        return stats
+
+    def _fetch(self, url: str, path: str, rewrite=None) -> Optional[str]:
+        """
+        Download an upstream file into the store. Returns None if the upstream does not have it.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file and renamed, so concurrent requests never serve partial files
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp_{uuid.uuid4().hex}")
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response, open(tmp_path, 'wb') as f:
+                if rewrite is not None:
+                    f.write(rewrite(response.read()))
+                else:
+                    shutil.copyfileobj(response, f)
+        except BaseException as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if isinstance(e, urllib.error.HTTPError) and e.code in (404, 410):
+                return None
+            raise
+        os.replace(tmp_path, path)
+        return path
+
+    def _read_through(self, path: str, url: Optional[str], rewrite=None) -> Optional[str]:
+        if os.path.isfile(path):
+            self.count('hits')
+            return path
+        if self.offline or url is None or self._fetch(url, path, rewrite) is None:
+            self.count('not_found')
+            return None
+        self.count('misses')
+        return path
+
+    def get_maven_file(self, relative_path: str) -> Optional[str]:
+        return self._read_through(os.path.join(self.store_path, "maven", relative_path),
+                                  f"{self.upstreams['maven'].rstrip('/')}/{relative_path}")
+
+    def get_pypi_file(self, relative_path: str) -> Optional[str]:
+        url = None
+        if not relative_path.startswith("local/"):
+            url = f"{self.upstreams['pypi_files'].rstrip('/')}/{relative_path}"
+        return self._read_through(os.path.join(self.store_path, "pypi", "packages", relative_path), url)
+
+    def get_pypi_index(self, project: str) -> Optional[str]:
+        project = normalize_project_name(project)
+        path = os.path.join(self.store_path, "pypi", "simple", project, "index.html")
+        files_url = self.upstreams['pypi_files'].rstrip('/') + '/'
+
+        def rewrite(data: bytes) -> bytes:
+            # Links relative to /pypi/simple/<project>/, so the page does not depend on the proxy address
+            return data.replace(files_url.encode('utf-8'), b"../../packages/")
+
+        if os.path.isfile(path) or not self.offline:
+            try:
+                index = self._read_through(path, f"{self.upstreams['pypi'].rstrip('/')}/{project}/", rewrite)
+            except OSError as e:
+                logger.warning(f"Cannot fetch the index of {project}, using the stored packages: {e}")
+                self.count('errors')
+                index = None
+            if index is not None:
+                return index
+        return self._local_pypi_index(project)
+
+    def _local_pypi_index(self, project: str) -> Optional[str]:
+        """
+        Simple index page of the stored packages of a project.
+        """
+        packages_path = os.path.join(self.store_path, "pypi", "packages")
+        links = []
+        for root, _, files in os.walk(packages_path):
+            for name in sorted(files):
+                if package_project_name(name) == project:
+                    relative_path = os.path.relpath(os.path.join(root, name), packages_path).replace(os.sep, '/')
+                    links.append(f'<a href="../../packages/{html.escape(relative_path)}">{html.escape(name)}</a><br/>')
+        if not links:
+            return None
+        path = os.path.join(self.store_path, "pypi", "local_simple", project, "index.html")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp_{uuid.uuid4().hex}")
+        with open(tmp_path, 'w') as f:
+            f.write(f"<!DOCTYPE html>\n<html><body>\n{chr(10).join(links)}\n</body></html>\n")
+        os.replace(tmp_path, path)
+        return path
+
+    @property
+    def url(self) -> str:
+        """
+        URL of the proxy from the containers.
+        """
+        return f"http://{CONTAINER_HOST}:{self.port}"
+
+    def start(self):
+        if self.host is None:
+            self.host = docker_bridge_gateway()
+            if self.host is None:
+                # Only reachable from containers with host networking
+                logger.warning("Docker bridge gateway not found, the artifact proxy listens on 127.0.0.1")
+                self.host = "127.0.0.1"
+        self._server = _ProxyServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        with open(os.path.join(self.store_path, SETTINGS_FILE), 'w') as f:
+            f.write(MAVEN_SETTINGS.format(url=f"{self.url}/maven2"))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Artifact proxy listening on {self.host}:{self.port} (store {self.store_path})")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+    def container_settings(self) -> dict:
+        """
+        Tester configuration to use the proxy from the containers (the "artifact_proxy_settings" tester option):
+        mounts, environment variables and extra hosts.
+        """
+        return {
+            'mounts': [f"{os.path.join(self.store_path, SETTINGS_FILE)}:/root/.m2/settings.xml:ro"],
+            'environment': {
+                "PIP_INDEX_URL": f"{self.url}/pypi/simple/",
+                "PIP_TRUSTED_HOST": CONTAINER_HOST,
+            },
+            'extra_hosts': [f"{CONTAINER_HOST}:host-gateway"],
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
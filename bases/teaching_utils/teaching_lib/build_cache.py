@@ -0,0 +1,423 @@
+import fnmatch
+import logging
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .staging import stage_file
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CacheKind:
+    """
+    How a build tool cache is mounted in the containers and merged back into the base cache.
+    """
+    # Writable path of the cache in the container (the job overlay)
+    overlay_mount: str
+    # Read-only path of the base cache in the container
+    base_mount: str
+    environment: dict = field(default_factory=dict)
+    # Environment variables that make the tool read the read-only caches, from their paths in the container (the
+    # base cache first, then the caches included in the image)
+    read_only_environment: Optional[Callable[[list[str]], dict]] = None
+    # Only files matching these patterns are merged (None for all files)
+    merge_patterns: Optional[tuple] = None
+    # Files and folders never merged (temporary files, locks, statistics)
+    skip_patterns: tuple = ()
+    # Merged files are placed in the root of the base cache, instead of keeping their relative path
+    flatten: bool = False
+    # Path in the base cache of a merged file, from its path relative to the overlay (None to skip the file). Used
+    # when the tool reads the base with a different layout than its own cache.
+    base_entry: Optional[Callable[[str], Optional[str]]] = None
+    # File (relative to the overlay) where the tool logs its hits and misses
+    stats_log: Optional[str] = None
+    # Without stats log, new files matching these patterns are counted as misses (None for all files)
+    miss_patterns: Optional[tuple] = None
+    # Without stats log, files of the overlay already in the base (copied by the tool) are counted as hits
+    count_hits: bool = False
+    # Shell command run in the container before the test command, to fill the overlay
+    setup_command: Optional[str] = None
+    # Default maximum size of the base cache. The least recently used files are evicted (None for no limit).
+    max_bytes: Optional[int] = None
+
+
+def _ccache_remote_entry(relative_path: str) -> Optional[str]:
+    """
+    Entry of the flat ccache file storage for a file of the local ccache folder: local entries are stored as
+    <digit>/<digit>/<rest of the key><M|R>, and the flat storage as <key>. Other files (raw files, statistics) are
+    skipped.
+    """
+    parts = relative_path.split(os.sep)
+    if len(parts) < 3 or any(len(part) != 1 for part in parts[:-1]) or parts[-1][-1:] not in ('M', 'R'):
+        return None
+    return ''.join(parts[:-1]) + parts[-1][:-1]
+
+
+def _maven_environment(paths: list[str]) -> dict:
+    return {"MAVEN_OPTS": f"-Dmaven.repo.local.tail={','.join(paths)}"}
+
+
+def _ccache_environment(paths: list[str]) -> dict:
+    return {"CCACHE_REMOTE_STORAGE": " ".join(f"file:{path}|read-only|layout=flat" for path in paths)}
+
+
+def _pip_environment(paths: list[str]) -> dict:
+    return {"PIP_FIND_LINKS": " ".join(paths + ["/root/.cache/pip/downloads"])}
+
+
+CACHE_KINDS = {
+    # Maven 3.9+ resolves artifacts from the read-only tail repositories before downloading them
+    'maven': CacheKind(
+        overlay_mount="/root/.m2/repository",
+        base_mount="/mnt/cache/maven",
+        read_only_environment=_maven_environment,
+        skip_patterns=("*.lastUpdated", "resolver-status.properties", "*.part", "*.lock"),
+        miss_patterns=("*.jar", "*.pom"),
+    ),
+    # ccache 4.8+ reads the base as read-only remote storage with the flat file layout, and writes the new results
+    # to the empty local cache of the job, which are merged into the base with that layout
+    'ccache': CacheKind(
+        overlay_mount="/root/.ccache",
+        base_mount="/mnt/cache/ccache",
+        environment={
+            "CCACHE_DIR": "/root/.ccache",
+            "CCACHE_BASEDIR": "/mnt/code",
+            "CCACHE_NOHASHDIR": "1",
+            "CCACHE_STATSLOG": "/root/.ccache/stats.log",
+            "CMAKE_C_COMPILER_LAUNCHER": "ccache",
+            "CMAKE_CXX_COMPILER_LAUNCHER": "ccache",
+        },
+        read_only_environment=_ccache_environment,
+        skip_patterns=("stats", "stats.log", "*.lock", "*.tmp*", "tmp", "lock"),
+        base_entry=_ccache_remote_entry,
+        stats_log="stats.log",
+        max_bytes=5 * 1024 ** 3,
+    ),
+    # pip keeps the downloaded packages in its HTTP cache, with hashed names, so the requirements of the code are
+    # downloaded (or copied from the base, a flat folder of links) into the overlay before the test command. Its pip
+    # installs find them there without downloading them again.
+    'pip': CacheKind(
+        overlay_mount="/root/.cache/pip",
+        base_mount="/mnt/cache/pip",
+        environment={"PIP_CACHE_DIR": "/root/.cache/pip"},
+        read_only_environment=_pip_environment,
+        merge_patterns=("*.whl", "*.tar.gz", "*.zip"),
+        skip_patterns=("http", "http-v2", "wheels", "selfcheck"),
+        flatten=True,
+        count_hits=True,
+        setup_command=(
+            "if [ -f requirements.txt ]; then "
+            "pip download -q --disable-pip-version-check -r requirements.txt -d /root/.cache/pip/downloads "
+            "> /root/.cache/pip/download.log 2>&1 || true; fi"
+        ),
+    ),
+}
+
+# Statistics of the ccache stats log counted as hits and misses
+CCACHE_HITS = ('direct_cache_hit', 'preprocessed_cache_hit')
+CCACHE_MISSES = ('cache_miss',)
+# Size of a base cache after an eviction, relative to its maximum size
+EVICTION_TARGET = 0.9
+
+
+def _matches(name: str, patterns: Optional[tuple]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns or ())
+
+
+def _base_files(base_path: str) -> list[tuple[float, int, str]]:
+    """
+    Modification time, size and path of the files of a base cache, without the files being merged.
+    """
+    files = []
+    for root, _, names in os.walk(base_path):
+        for name in names:
+            if name.startswith(".tmp_"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+class BuildCacheSession:
+    def __init__(self, manager: "BuildCacheManager", job_id: str, kinds: list[str]):
+        """
+        Writable overlays of the build caches for a single job. Created with BuildCacheManager.open.
+        """
+        self.manager = manager
+        self.job_id = job_id
+        self.kinds = list(kinds)
+        self._closed = False
+        for kind in self.kinds:
+            os.makedirs(self.overlay_path(kind), exist_ok=True)
+
+    def overlay_path(self, kind: str) -> str:
+        return os.path.join(self.manager.root, "overlays", self.job_id, kind)
+
+    def mounts(self) -> list[str]:
+        """
+        Volumes of the caches, in "docker run -v" format.
+        """
+        mounts = []
+        for kind in self.kinds:
+            cache_kind = CACHE_KINDS[kind]
+            mounts.append(f"{self.overlay_path(kind)}:{cache_kind.overlay_mount}")
+            mounts.append(f"{self.manager.base_path(kind)}:{cache_kind.base_mount}:ro")
+        return mounts
+
+    def environment(self, image_caches: Optional[dict[str, list[str]]] = None) -> dict:
+        """
+        Environment variables of the caches.
+
+        Args:
+            image_caches (dict[str, list[str]]): Read-only caches included in the image, by kind. They are read after
+                the base cache, as the environment replaces the one of the image.
+        """
+        environment = {}
+        for kind in self.kinds:
+            cache_kind = CACHE_KINDS[kind]
+            environment.update(cache_kind.environment)
+            if cache_kind.read_only_environment is not None:
+                paths = [cache_kind.base_mount] + list((image_caches or {}).get(kind) or [])
+                environment.update(cache_kind.read_only_environment(paths))
+        return environment
+
+    def setup_command(self) -> Optional[str]:
+        """
+        Shell command to run in the container before the test command, or None if no cache needs it.
+        """
+        commands = [CACHE_KINDS[kind].setup_command for kind in self.kinds if CACHE_KINDS[kind].setup_command]
+        return "; ".join(commands) if commands else None
+
+    def close(self) -> dict:
+        """
+        Merge the new files of the overlays into the base caches and remove the overlays.
+
+        Returns:
+            dict: Statistics of each cache: hits and misses (None if the tool does not report them), and the number
+                of files and bytes merged.
+        """
+        if self._closed:
+            return {}
+        self._closed = True
+        stats = {}
+        for kind in self.kinds:
+            try:
+                stats[kind] = self.manager.merge(kind, self.overlay_path(kind))
+            except OSError as e:
+                logger.warning(f"Cannot merge the {kind} cache of job {self.job_id}: {e}")
+        shutil.rmtree(os.path.join(self.manager.root, "overlays", self.job_id), ignore_errors=True)
+        return stats
+
+
+class BuildCacheManager:
+    def __init__(self, root: str, seeds: Optional[dict[str, str]] = None,
+                 max_bytes: Optional[dict[str, Optional[int]]] = None):
+        """
+        Build dependency caches (Maven repository, ccache, pip wheels) shared by concurrent test containers.
+
+        Each kind of cache has a base folder that containers only read, and each job gets writable overlays. When the
+        job finishes, the new files of its overlays are merged into the base with atomic renames, so concurrent jobs
+        never see partial files, and the next jobs find them in the base. When a base grows over its maximum size, the
+        least recently merged or used files are evicted.
+
+        Args:
+            root (str): Folder of the caches. Base caches are in root/base/<kind> and overlays in root/overlays.
+            seeds (dict[str, str]): Folders used to seed empty base caches, by kind (e.g. an existing
+                ~/.m2/repository for "maven").
+            max_bytes (dict[str, int]): Maximum size of the base caches, by kind, updating the CacheKind defaults
+                (None for no limit).
+        """
+        self.root = os.path.abspath(root)
+        self.max_bytes = {kind: cache_kind.max_bytes for kind, cache_kind in CACHE_KINDS.items()}
+        self.max_bytes.update(max_bytes or {})
+        self._stats: dict[str, dict] = {}
+        self._sizes: dict[str, int] = {}
+        self._evicting: set[str] = set()
+        self._lock = threading.Lock()
+        for kind, seed_path in (seeds or {}).items():
+            self.seed(kind, seed_path)
+
+    def base_path(self, kind: str) -> str:
+        if kind not in CACHE_KINDS:
+            raise ValueError(f"Unknown build cache: {kind}")
+        path = os.path.join(self.root, "base", kind)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def seed(self, kind: str, source: str, mode: str = 'auto'):
+        """
+        Stage the content of a folder into an empty base cache. The folder has the layout of the tool cache (e.g. an
+        existing ccache folder), as the overlays.
+        """
+        if os.listdir(self.base_path(kind)):
+            return
+        merged_files, merged_bytes, _, _ = self._merge_tree(kind, source, mode)
+        logger.info(f"Seeded the {kind} build cache from {source}: {merged_files} files, {merged_bytes} bytes")
+
+    def open(self, job_id: str, kinds: list[str]) -> BuildCacheSession:
+        return BuildCacheSession(self, job_id, kinds)
+
+    def merge(self, kind: str, overlay_path: str) -> dict:
+        """
+        Merge the new files of an overlay into the base cache of a kind.
+        """
+        cache_kind = CACHE_KINDS[kind]
+        merged_files, merged_bytes, new_files, existing_files = self._merge_tree(kind, overlay_path, 'hardlink')
+
+        hits = misses = None
+        if cache_kind.stats_log is not None:
+            hits, misses = self._read_stats_log(os.path.join(overlay_path, cache_kind.stats_log))
+        elif cache_kind.count_hits:
+            hits, misses = existing_files, new_files - existing_files
+        else:
+            # Files are only written to the overlay when they were not found in the base
+            misses = new_files
+        stats = {'hits': hits, 'misses': misses, 'merged_files': merged_files, 'merged_bytes': merged_bytes}
+        with self._lock:
+            totals = self._totals(kind)
+            totals['jobs'] += 1
+            for key, value in stats.items():
+                totals[key] += value or 0
+        self._limit_size(kind, merged_bytes)
+        return stats
+
+    def _merge_tree(self, kind: str, source: str, mode: str) -> tuple[int, int, int, int]:
+        """
+        Stage the files of a folder, with the layout of the tool cache, that are not in the base cache of a kind.
+
+        Returns:
+            tuple[int, int, int, int]: Number of files and bytes merged, number of files counted as misses, and number
+                of those files that were already in the base.
+        """
+        cache_kind = CACHE_KINDS[kind]
+        base_path = self.base_path(kind)
+        merged_files = merged_bytes = new_files = existing_files = 0
+        for root, dirs, files in os.walk(source):
+            dirs[:] = [folder for folder in dirs if not _matches(folder, cache_kind.skip_patterns)]
+            for name in files:
+                if _matches(name, cache_kind.skip_patterns) or (cache_kind.merge_patterns is not None and
+                                                                not _matches(name, cache_kind.merge_patterns)):
+                    continue
+                path = os.path.join(root, name)
+                relative_path = name if cache_kind.flatten else os.path.relpath(path, source)
+                if cache_kind.base_entry is not None:
+                    relative_path = cache_kind.base_entry(relative_path)
+                    if relative_path is None:
+                        continue
+                if cache_kind.miss_patterns is None or _matches(name, cache_kind.miss_patterns):
+                    new_files += 1
+                target = os.path.join(base_path, relative_path)
+                if os.path.exists(target):
+                    # Copied from the base by the tool, so it is marked as recently used
+                    os.utime(target)
+                    existing_files += 1
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Placed with a temporary name and renamed, so readers never see partial files
+                tmp_path = os.path.join(os.path.dirname(target), f".tmp_{uuid.uuid4().hex}")
+                stage_file(path, tmp_path, mode)
+                os.replace(tmp_path, target)
+                merged_files += 1
+                merged_bytes += os.path.getsize(target)
+        return merged_files, merged_bytes, new_files, existing_files
+
+    def _totals(self, kind: str) -> dict:
+        return self._stats.setdefault(kind, {'jobs': 0, 'hits': 0, 'misses': 0, 'merged_files': 0, 'merged_bytes': 0,
+                                             'evicted_files': 0, 'evicted_bytes': 0})
+
+    def _limit_size(self, kind: str, added_bytes: int):
+        """
+        Evict files from the base cache of a kind when it is over its maximum size. The size of the base is only
+        computed once, and then updated with the merged and evicted bytes.
+        """
+        max_bytes = self.max_bytes.get(kind)
+        if max_bytes is None:
+            return
+        with self._lock:
+            if kind in self._sizes:
+                self._sizes[kind] += added_bytes
+            else:
+                self._sizes[kind] = sum(size for _, size, _ in _base_files(self.base_path(kind)))
+            if self._sizes[kind] <= max_bytes or kind in self._evicting:
+                return
+            self._evicting.add(kind)
+        evicted_files = evicted_bytes = 0
+        try:
+            evicted_files, evicted_bytes = self.evict(kind, int(max_bytes * EVICTION_TARGET))
+        finally:
+            with self._lock:
+                self._sizes[kind] -= evicted_bytes
+                self._evicting.discard(kind)
+                totals = self._totals(kind)
+                totals['evicted_files'] += evicted_files
+                totals['evicted_bytes'] += evicted_bytes
+
+    def evict(self, kind: str, target_bytes: int) -> tuple[int, int]:
+        """
+        Remove the least recently merged or used files of a base cache until it is not larger than target_bytes.
+        Running containers only miss the removed files.
+
+        Returns:
+            tuple[int, int]: Number of files and bytes removed.
+        """
+        files = sorted(_base_files(self.base_path(kind)))
+        total = sum(size for _, size, _ in files)
+        evicted_files = evicted_bytes = 0
+        for _, size, path in files:
+            if total - evicted_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            evicted_files += 1
+            evicted_bytes += size
+        if evicted_files > 0:
+            logger.info(f"Evicted {evicted_files} files ({evicted_bytes} bytes) from the {kind} build cache")
+        return evicted_files, evicted_bytes
+
+    @staticmethod
+    def _read_stats_log(path: str) -> tuple[Optional[int], Optional[int]]:
+        if not os.path.exists(path):
+            return None, None
+        hits = misses = 0
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line in CCACHE_HITS:
+                    hits += 1
+                elif line in CCACHE_MISSES:
+                    misses += 1
+        return hits, misses
+
+    def stats(self) -> dict:
+        """
+        Statistics of the jobs merged by this manager, by kind of cache.
+        """
+        with self._lock:
+            return {kind: dict(totals) for kind, totals in self._stats.items()}
+
+
+_BUILD_CACHES: dict[str, BuildCacheManager] = {}
+_BUILD_CACHES_LOCK = threading.Lock()
+
+
+def get_build_cache(root: str, seeds: Optional[dict[str, str]] = None,
+                    max_bytes: Optional[dict[str, Optional[int]]] = None) -> BuildCacheManager:
+    """
+    Build cache manager shared by all the testers of this process that use the same root folder.
+    """
+    root = os.path.abspath(root)
+    with _BUILD_CACHES_LOCK:
+        if root not in _BUILD_CACHES:
+            _BUILD_CACHES[root] = BuildCacheManager(root, seeds, max_bytes)
+        return _BUILD_CACHES[root]
@@ -1,29 +1,82 @@
+import asyncio
+import http.client
 import logging
 import os
-import pickle
 import shutil
 import subprocess
+import threading
+import time
 import uuid
 import json
 import re
+import multiprocessing
+import socket
+import difflib
 import valparse
 
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import xml.etree.ElementTree as ET
 import teaching_utils.teaching_lib.text_utils
 
 from typing import Optional, Any, TextIO
 from .test_utils import TestResultNode, ExecutionReport
-from teaching_utils.config.core import Config
 
 
 from .submissions import SubmissionSet, Submission
 from .gtest_utils import load_gtest_results
+from .fingerprint_utils import hash_data, hash_tree, get_image_digest
+from .report_store import ReportStore
+from .containers import (ContainerPool, ContainerLifecycleManager, inspect_container_state, label_args,
+                         remove_container)
+from .staging import stage_tree, detach_file, FileIndex, FileEntry
+from .output_capture import BoundedOutput
+from .work_queue import WorkQueue
+from .docker_api import DockerClient, DockerAPIError, get_docker_client, STDERR_STREAM
+from .scheduling import ResourceBudget, parse_memory, get_engine_limiter
+from .analysis_cache import get_analysis_cache, analysis_cache_key
+from .analysis_engines import get_engine
+from .resource_accounting import CgroupSampler, ResourceUsage, usage_from_api_stats
+from .build_cache import BuildCacheManager, BuildCacheSession, get_build_cache
+from .artifact_proxy import ArtifactProxy
+from .grader_images import build_grader_image, MAVEN_TEST_GOALS
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for the output streams of a finished process to be closed
+OUTPUT_CLOSE_TIMEOUT = 10
+
+# Average characters per token, to estimate the size of the prompts
+CHARS_PER_TOKEN = 4
+
+# Folders and file names of test sources, which are ranked after the main sources
+TEST_SOURCE_DIRS = {'test', 'tests'}
+TEST_SOURCE_REGEX = re.compile(r'^(test_.+|.+_test|.+Tests?|test)$')
+
+# Upper bound of the bytes used by a character in UTF-8
+MAX_CHAR_BYTES = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough number of tokens of a prompt, without depending on the tokenizer of the engine.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
 
 class RunSubmissionTest:
+    # Increase when changes in the tester invalidate previously cached reports
+    TESTER_VERSION = "2"
+    # Resources of each container (overridden with the "resources" option). None values mean no limit.
+    DEFAULT_RESOURCES = {"cpus": 1, "memory": "1g", "pids_limit": 256}
+    # Build caches (see build_cache.CACHE_KINDS) used by the tester when the "build_cache" option is set
+    BUILD_CACHE_KINDS: tuple = ()
+    # Kind of the assignment specific images built by grader_images.build_grader_image (None if not available)
+    GRADER_IMAGE_KIND: Optional[str] = None
+
     def __init__(self, submission_path: str, config: dict):
         """
         Test runner using Docker and hierarchical test results.
@@ -36,6 +89,55 @@ class RunSubmissionTest:
                 - run_cmd (str): Command inside container
                 - result_path (str): Folder where results.json is generated (inside container)
                 - grading_file (str): JSON file containing test results
+                - container_pool (ContainerPool): Optional pool of warm containers where the tests are executed
+                - container_lifecycle (ContainerLifecycleManager): Optional manager that tracks the started containers
+                - resources (dict): Limits of the container ("cpus", "memory", "pids_limit"), updating the tester
+                  DEFAULT_RESOURCES. They are also used to schedule parallel runs.
+                - output_log_path (str): Folder where the full container output is written. Disabled by default, as
+                  the logs are kept after the run: only the output excerpts are kept in the report.
+                - output_log_max_bytes (int): Maximum size of each output log file
+                - output_head_bytes, output_tail_bytes (int): Output kept in the report (beginning and end)
+                - staging_mode (str): How the code is staged in host_tmp: "copy" (default), "reflink" (copy-on-write
+                  clones), "hardlink" (shared inodes, only safe if run_cmd does not modify files in place) or "auto"
+                - index_ignore_dirs (list[str]): Folder names skipped when indexing the staged code
+                - docker_backend (str): "cli" (default) runs the docker command line, "api" uses the Docker Engine
+                  API on docker_socket, falling back to the command line if it is not available. Pooled containers
+                  always use the command line.
+                - docker_socket (str): Path of the Docker daemon socket (default /var/run/docker.sock)
+                - resource_accounting (bool): Collect the CPU time, peak memory, I/O bytes and OOM kills of each
+                  container in the "resources" metadata of the report (from its cgroup with the command line, and
+                  from the stats with the API). Not available for pooled containers.
+                - resource_sample_interval (float): Seconds between resource usage samples of the cgroup
+                - environment (dict): Environment variables of the container
+                - build_cache (str | BuildCacheManager): Folder of the build dependency caches shared by the
+                  containers (None to disable). Each container gets writable overlays, merged into the shared cache
+                  when it finishes. Not available for pooled containers.
+                - build_cache_kinds (list[str]): Caches used, by default the tester BUILD_CACHE_KINDS
+                - build_cache_seeds (dict): Folders used to seed the empty caches, by kind
+                - build_cache_max_bytes (dict): Maximum size of the shared caches, by kind (see CacheKind.max_bytes)
+                - image_build_caches (dict): Read-only build caches included in the image, by kind, used after the
+                  shared caches (set by CodeActivityTester.prepare_grader_image)
+                - docker_network (str): Network of the containers (e.g. an internal network without internet access)
+                - artifact_proxy_settings (dict): Mounts, environment and extra hosts to use a local artifact proxy
+                  (see ArtifactProxy.container_settings). Set by CodeActivityTester with the "artifact_proxy" option.
+                - analysis_engine (str): Engine registered in analysis_engines ("ollama", "codellama", "openai",
+                  "replay", "record")
+                - analysis_engine_options (dict): Options of the analysis engine (e.g. host, latency)
+                - analysis_concurrency (int): Maximum concurrent requests to the analysis engine (shared by all the
+                  testers using the same engine)
+                - analysis_rate_limit (float): Maximum requests per second to the analysis engine (None for no limit)
+                - analysis_temperature (float): Sampling temperature of the analysis requests
+                - analysis_cache_file (str): File where the analysis responses are cached (None to disable)
+                - analysis_cache_max_bytes (int): Maximum size of the cached responses. The least recently used
+                  responses are evicted.
+                - analysis_scaffold_path (str): Folder with the code given to the students. Unchanged scaffold files
+                  are not sent to the analysis, and modified ones are sent as diffs.
+                - analysis_scaffold_max_diff_ratio (float): Maximum size of a diff, relative to the file, to send it
+                  instead of the full file
+                - analysis_executor (Executor): Pool where the analysis runs while the tests are executed. A thread
+                  is started for each submission if not given.
+                - fingerprint_memo (dict): Values of the fingerprint shared by the testers of a run (image digests
+                  and folder hashes), so they are computed once per run. Set by CodeActivityTester.
         """
         self.submission_path = submission_path
         self.image = config.get("image")
@@ -44,18 +146,60 @@ class RunSubmissionTest:
         self.run_cmd = config.get("run_cmd")
         self.docker_pull_policy = config.get("docker_pull_policy", "never")
         self.additional_mounts = config.get("additional_mounts", [])
+        self.environment = dict(config.get("environment") or {})
+        self.build_cache = config.get("build_cache")
+        self.build_cache_kinds = list(config.get("build_cache_kinds", self.BUILD_CACHE_KINDS))
+        self.build_cache_seeds = config.get("build_cache_seeds")
+        self.build_cache_max_bytes = config.get("build_cache_max_bytes")
+        self.image_build_caches = config.get("image_build_caches")
+        self._build_cache_session: Optional[BuildCacheSession] = None
+        self.docker_network = config.get("docker_network")
+        self.artifact_proxy_settings = config.get("artifact_proxy_settings") or {}
 
         self.data_path = config.get("data_path")
         self.data_mount = config.get("data_mount", "/mnt/data")
         self.result_path = config.get("result_path")
         self.grading_file = config.get("grading_file")
         self.remove_tmp = config.get("remove_tmp", True)
+        self.staging_mode = config.get("staging_mode", "copy")
+        self.index_ignore_dirs = config.get("index_ignore_dirs", list(FileIndex.DEFAULT_IGNORE_DIRS))
+        self._file_index: Optional[FileIndex] = None
+        self._fingerprint_memo: Optional[dict] = config.get("fingerprint_memo")
+        self._scaffold_files: Optional[set] = None
+        self._source_extraction = {'files': [], 'omitted': [], 'scaffold_unchanged': [], 'scaffold_diffs': [],
+                                   'chars': 0}
 
         self.execution_id = config.get("execution_id", uuid.uuid4().hex)
         self.host_tmp_basepath = config.get("host_tmp_basepath", "/tmp")
         self.host_tmp_prefix = config.get("host_tmp_prefix", "submission_")
         self.host_tmp = config.get("host_tmp", os.path.join(self.host_tmp_basepath, f"{self.host_tmp_prefix}{self.execution_id}", ''))
         self.container_mount = config.get("container_mount", "/mnt/code")
+        self.resources = dict(self.DEFAULT_RESOURCES)
+        self.resources.update(config.get("resources") or {})
+        self.container_pool = config.get("container_pool")
+        self._container = None
+        self.container_lifecycle = config.get("container_lifecycle")
+        self.container_name = config.get("container_name", f"{config.get('container_name_prefix', 'tu_')}{self.execution_id}")
+        self.docker_backend = config.get("docker_backend", "cli")
+        if self.docker_backend not in ("cli", "api"):
+            raise ValueError(f"Unknown docker backend: {self.docker_backend}")
+        self.docker_socket = config.get("docker_socket")
+        self._docker_client: Optional[DockerClient] = None
+        self.resource_accounting = config.get("resource_accounting", True)
+        self.resource_sample_interval = config.get("resource_sample_interval", 0.5)
+        self._resource_usage: Optional[ResourceUsage] = None
+        self._host_code_path: Optional[str] = None
+        self._work_path: Optional[str] = None
+        self._timings: dict[str, float] = {}
+
+        self.output_log_path = config.get("output_log_path")
+        self.output_log_max_bytes = config.get("output_log_max_bytes", 50 * 1024 * 1024)
+        self.output_head_bytes = config.get("output_head_bytes", 10000)
+        self.output_tail_bytes = config.get("output_tail_bytes", 10000)
+        self._stdout: Optional[BoundedOutput] = None
+        self._stderr: Optional[BoundedOutput] = None
+        self._host_results_path: Optional[str] = None
+        self._results_file_path: Optional[str] = None
 
         self.file_code_extensions = config.get("file_code_extensions", ['.py', '.java', '.c', '.h', '.cpp', '.hpp', '.hcc'])
         self.line_comment_symbol = config.get("line_comment_symbol", "#")
@@ -65,6 +209,19 @@ class RunSubmissionTest:
         self.code_extraction_max_char = config.get("code_extraction_max_char", 12000)
         self.analysis_model = config.get("analysis_model", "codellama")
         self.analysis_engine = config.get("analysis_engine", "ollama")
+        self.analysis_engine_options = config.get("analysis_engine_options")
+        self.analysis_scaffold_path = config.get("analysis_scaffold_path")
+        self.analysis_scaffold_max_diff_ratio = config.get("analysis_scaffold_max_diff_ratio", 0.5)
+        self._scaffold_baseline: Optional[dict] = None
+        self.analysis_concurrency = config.get("analysis_concurrency", 4)
+        self.analysis_rate_limit = config.get("analysis_rate_limit")
+        self.analysis_temperature = config.get("analysis_temperature", 0.5)
+        self.analysis_cache_file = config.get("analysis_cache_file")
+        self.analysis_cache_max_bytes = config.get("analysis_cache_max_bytes", 512 * 1024 * 1024)
+        self._analysis_cache_stats = {'hits': 0, 'misses': 0}
+        self._analysis_cache_lock = threading.Lock()
+        self.analysis_executor: Optional[Executor] = config.get("analysis_executor")
+        self._analysis_future: Optional[Future] = None
 
         self.multi_project = config.get("multi_project", False)
         self.multi_project_structure = config.get("multi_project_structure", "directory")
@@ -73,19 +230,168 @@ class RunSubmissionTest:
 
         self.total_tests = 0
 
+    def _fingerprint_config(self) -> dict:
+        """
+        Configuration values that affect the generated report. Any change on them invalidates cached reports.
+        """
+        return {
+            "image": self.image,
+            "image_digest": self._memoized("image_digest", self.image, get_image_digest) if self.run_tests else None,
+            "run_tests": self.run_tests,
+            "run_cmd": self.run_cmd,
+            "additional_mounts": self.additional_mounts,
+            "environment": self.environment,
+            "resources": self.get_resources() if self.run_tests else None,
+            "data_path": self._memoized("tree", self.data_path, hash_tree),
+            "data_mount": self.data_mount,
+            "result_path": self.result_path,
+            "grading_file": self.grading_file,
+            "container_mount": self.container_mount,
+            "file_code_extensions": self.file_code_extensions,
+            "perform_analysis": self.perform_analysis,
+            "analysis_custom_prompt": self.analysis_custom_prompt if self.perform_analysis else None,
+            "analysis_model": self.analysis_model if self.perform_analysis else None,
+            "analysis_engine": self.analysis_engine if self.perform_analysis else None,
+            "analysis_engine_options": self.analysis_engine_options if self.perform_analysis else None,
+            "analysis_temperature": self.analysis_temperature if self.perform_analysis else None,
+            "code_extraction_max_char": self.code_extraction_max_char if self.perform_analysis else None,
+            "analysis_scaffold_path": (self._memoized("tree", self.analysis_scaffold_path, hash_tree)
+                                       if self.perform_analysis else None),
+            "analysis_scaffold_max_diff_ratio": self.analysis_scaffold_max_diff_ratio if self.perform_analysis else None,
+            "multi_project": self.multi_project,
+            "multi_project_structure": self.multi_project_structure,
+            "multi_project_module_regex": self.multi_project_module_regex,
+        }
+
+    def _memoized(self, kind: str, value, compute):
+        """
+        Value computed from an input shared by the testers of a run, computed once per run when the testers have a
+        fingerprint memo.
+        """
+        if self._fingerprint_memo is None:
+            return compute(value)
+        key = (kind, value)
+        if key not in self._fingerprint_memo:
+            self._fingerprint_memo[key] = compute(value)
+        return self._fingerprint_memo[key]
+
+    def get_fingerprint(self) -> str:
+        """
+        Compute a content based key for the report of this submission. It depends on the content of the submission,
+        the tester class and version and the relevant configuration, so identical inputs produce the same key.
+
+        Returns:
+            str: Hexadecimal hash identifying the inputs of this test.
+        """
+        return hash_data({
+            "tester": f"{type(self).__module__}.{type(self).__qualname__}",
+            "tester_version": self.TESTER_VERSION,
+            "config": self._fingerprint_config(),
+            "submission": hash_tree(self.submission_path),
+        })
+
     def _prepare_environment(self):
         os.makedirs(self.host_tmp, exist_ok=True)
-        shutil.copytree(self.submission_path, os.path.join(self.host_tmp, "code"), dirs_exist_ok=True)
+        stats = stage_tree(self.submission_path, os.path.join(self.host_tmp, "code"), self.staging_mode)
+        logger.debug(f"Staged {self.submission_path} into {self.host_tmp}: {stats}")
+        self._invalidate_file_index()
 
         # Apply any extra action to the code before execution
         self._prepare_code_execution()
+        self._open_build_cache()
+
+        # The code is ready, so the analysis can run while the tests are executed
+        self._start_analysis()
 
     def _prepare_code_execution(self):
         pass
 
+    def stage_grader_scaffold(self, host_tmp: str) -> Optional[str]:
+        """
+        Stage the scaffold (data_path) into host_tmp as the code of a submission, with the same preparation, so a
+        grader image warms up the build that the tests run (see grader_images.build_grader_image).
+
+        Returns:
+            str: Working directory of the tests relative to the staged code, or None for its root.
+        """
+        self.host_tmp = host_tmp
+        code_path = os.path.join(host_tmp, "code")
+        stage_tree(self.data_path, code_path, 'copy')
+        self._invalidate_file_index()
+        self._prepare_code_execution()
+        work_path = self._compute_working_directory()
+        if not work_path:
+            return None
+        return os.path.relpath(os.path.abspath(work_path), os.path.abspath(code_path))
+
+    def _get_build_cache(self) -> Optional[BuildCacheManager]:
+        if self.build_cache is None or isinstance(self.build_cache, BuildCacheManager):
+            return self.build_cache
+        return get_build_cache(self.build_cache, self.build_cache_seeds, self.build_cache_max_bytes)
+
+    def _open_build_cache(self):
+        """
+        Create the overlays of the build caches for this execution.
+        """
+        manager = self._get_build_cache()
+        if manager is None or not self.build_cache_kinds or self._container is not None or not self.run_tests:
+            return
+        self._build_cache_session = manager.open(self.execution_id, self.build_cache_kinds)
+
+    def _close_build_cache(self) -> Optional[dict]:
+        """
+        Merge the overlays of the build caches into the shared caches.
+
+        Returns:
+            dict: Cache statistics by kind, or None if no build cache is used.
+        """
+        if self._build_cache_session is None:
+            return None
+        session, self._build_cache_session = self._build_cache_session, None
+        with self._timed("build_cache"):
+            return session.close()
+
+    def _container_command(self) -> str:
+        """
+        Shell command of the container: the test command, after the setup of the build caches.
+        """
+        setup_command = None
+        if self._build_cache_session is not None:
+            setup_command = self._build_cache_session.setup_command()
+        if setup_command is None:
+            return self.run_cmd
+        return f"{setup_command}; {self.run_cmd}"
+
+    def _container_environment(self) -> dict:
+        environment = dict(self.artifact_proxy_settings.get('environment') or {})
+        if self._build_cache_session is not None:
+            environment.update(self._build_cache_session.environment(self.image_build_caches))
+        environment.update(self.environment)
+        return environment
+
     def _compute_working_directory(self):
         return None
 
+    def _get_file_index(self, path: Optional[str] = None) -> FileIndex:
+        """
+        Index of the staged code, built on first use and kept until the staged files change. Paths outside the
+        staged code get a new index.
+        """
+        code_root = os.path.abspath(os.path.join(self.host_tmp, "code"))
+        if path is not None:
+            path = os.path.abspath(path)
+            if path != code_root and not path.startswith(os.path.join(code_root, '')):
+                return FileIndex(path, self.index_ignore_dirs)
+        if self._file_index is None or self._file_index.root != code_root:
+            self._file_index = FileIndex(code_root, self.index_ignore_dirs)
+        return self._file_index
+
+    def _invalidate_file_index(self):
+        """
+        Discard the index of the staged code. Must be called when files are added or removed from it.
+        """
+        self._file_index = None
+
     def _load_result_tree(self, result_file_path: str) -> Optional[TestResultNode]:
         if not os.path.exists(result_file_path):
             return None
@@ -118,195 +424,785 @@ class RunSubmissionTest:
                 path = '/' + path[0] + path[2:]
         return path
 
-    def _execute_in_container(self) -> ExecutionReport:
-        host_code_path = os.path.abspath(os.path.join(self.host_tmp, "code"))
-        host_results_path = os.path.join(host_code_path, os.path.basename(self.result_path))
-        if self.grading_file is not None:
-            results_file_path = os.path.join(host_results_path, self.grading_file)
-        else:
-            results_file_path = host_results_path
+    def _container_mounts(self) -> list[str]:
+        """
+        Volumes mounted on the container in addition to the code folder.
+        """
+        mounts = []
+        if self.data_path is not None:
+            mounts.append(f"{self._fix_path(os.path.abspath(self.data_path))}:{self.data_mount}")
+        mounts.extend(self.additional_mounts)
+        mounts.extend(self.artifact_proxy_settings.get('mounts') or [])
+        if self._build_cache_session is not None:
+            mounts.extend(self._build_cache_session.mounts())
+        return mounts
+
+    def get_resources(self) -> dict:
+        """
+        Resources declared for the container of this submission.
+        """
+        return {
+            "cpus": self.resources.get("cpus"),
+            "memory": parse_memory(self.resources.get("memory")),
+            "pids_limit": self.resources.get("pids_limit"),
+        }
 
-        work_path = self._compute_working_directory()
-        if work_path is None or len(work_path) == 0:
-            work_path = self.container_mount
+    def _resource_args(self) -> list[str]:
+        resources = self.get_resources()
+        args = []
+        if resources["cpus"] is not None:
+            args.extend(["--cpus", str(resources["cpus"])])
+        if resources["memory"] is not None:
+            # Same value for memory and swap, so the container can not use swap
+            args.extend(["--memory", str(resources["memory"]), "--memory-swap", str(resources["memory"])])
+        if resources["pids_limit"] is not None:
+            args.extend(["--pids-limit", str(resources["pids_limit"])])
+        return args
+
+    def _run_args(self) -> list[str]:
+        """
+        Options of "docker run" for the resources and the network of the container.
+        """
+        args = self._resource_args()
+        if self.docker_network is not None:
+            args.extend(["--network", self.docker_network])
+        for extra_host in self.artifact_proxy_settings.get('extra_hosts') or []:
+            args.extend(["--add-host", extra_host])
+        return args
+
+    def _container_labels(self) -> dict:
+        if self.container_lifecycle is not None:
+            return self.container_lifecycle.labels
+        return ContainerLifecycleManager(self.execution_id).labels
+
+    def _stop_container(self):
+        """
+        Stop the container after a timeout or an error. Killing the docker client does not stop the container.
+        """
+        if self._container is not None:
+            # The command may still be running inside the container, so it can not be reused
+            self._container.healthy = False
+            return
+        if self._docker_client is not None:
+            try:
+                self._docker_client.remove_container(self.container_name)
+                if self.container_lifecycle is not None:
+                    self.container_lifecycle.unregister(self.container_name)
+                return
+            except DockerAPIError as e:
+                if e.status == 404:
+                    if self.container_lifecycle is not None:
+                        self.container_lifecycle.unregister(self.container_name)
+                    return
+                logger.warning(f"Cannot remove container {self.container_name} with the Docker API: {e}")
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning(f"Cannot remove container {self.container_name} with the Docker API: {e}")
+        if self.container_lifecycle is not None:
+            self.container_lifecycle.stop(self.container_name)
         else:
-            work_path = os.path.join(self.container_mount, os.path.relpath(os.path.abspath(work_path), host_code_path))
-
-
-        docker_cmd = [
-            "docker", "run", "--rm",
-            "-w", self._fix_path(work_path),
+            remove_container(self.container_name)
+
+    def _build_docker_cmd(self, host_code_path: str, work_path: str) -> list[str]:
+        if self._container is not None:
+            return self.container_pool.exec_cmd(self._container, work_path, self.run_cmd,
+                                                self._container_environment())
+
+        docker_cmd = ["docker", "run"]
+        if self.resource_accounting:
+            # Not removed on exit: the final usage and state are read before removing it (see _finish_container)
+            # Docker does not overwrite the cidfile, and a previous run may have left it
+            if os.path.exists(self._cidfile()):
+                os.remove(self._cidfile())
+            docker_cmd.extend(["--cidfile", self._cidfile()])
+        else:
+            docker_cmd.append("--rm")
+        docker_cmd.extend([
+            "--name", self.container_name,
+            "-w", work_path,
             "-v", f"{self._fix_path(host_code_path)}:{self.container_mount}",
-        ]
+        ])
+        docker_cmd.extend(label_args(self._container_labels()))
+        docker_cmd.extend(self._run_args())
 
         if self.docker_pull_policy is not None:
             docker_cmd.extend(["--pull", self.docker_pull_policy])
 
-        if self.data_path is not None:
-            docker_cmd.extend(["-v", f"{self._fix_path(os.path.abspath(self.data_path))}:{self.data_mount}"])
-
-        for additional_mount in self.additional_mounts:
-            docker_cmd.extend(["-v", additional_mount])
+        for mount in self._container_mounts():
+            docker_cmd.extend(["-v", mount])
+        for name, value in self._container_environment().items():
+            docker_cmd.extend(["-e", f"{name}={value}"])
         docker_cmd.extend([
             self.image,
-            "bash", "-c", self.run_cmd
+            "bash", "-c", self._container_command()
         ])
+        return docker_cmd
 
-        try:
-            # Run the command in the Docker container
-            if self.run_tests:
-                result = subprocess.run(
-                    docker_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=self.max_time,
-                    text=True
-                )
+    def _prepare_container_command(self) -> list[str]:
+        host_code_path = os.path.abspath(os.path.join(self.host_tmp, "code"))
+        self._host_results_path = os.path.join(host_code_path, os.path.basename(self.result_path))
+        if self.grading_file is not None:
+            self._results_file_path = os.path.join(self._host_results_path, self.grading_file)
+        else:
+            self._results_file_path = self._host_results_path
 
+        work_path = self._compute_working_directory()
+        if work_path is None or len(work_path) == 0:
+            work_path = self.container_mount
+        else:
+            work_path = os.path.join(self.container_mount, os.path.relpath(os.path.abspath(work_path), host_code_path))
+
+        self._host_code_path = host_code_path
+        self._work_path = self._fix_path(work_path)
+        return self._build_docker_cmd(host_code_path, self._work_path)
+
+    def _execute_in_container(self) -> ExecutionReport:
+        docker_cmd = self._prepare_container_command()
+
+        return_code = None
+        if self.run_tests:
+            client = self._get_docker_client()
+            try:
+                # Run the command in the Docker container
+                with self._timed("container"):
+                    if client is not None:
+                        return_code = self._run_container_api(client)
+                    else:
+                        return_code = self._run_process(docker_cmd)
+            except subprocess.TimeoutExpired:
+                return self._timeout_report()
+
+        return self._complete_report(return_code)
+
+    def _complete_report(self, return_code: Optional[int]) -> ExecutionReport:
+        """
+        Build the report of a finished execution: parse the results, analyze the code and collect the metrics.
+        """
+        # The container may have created or removed files
+        self._invalidate_file_index()
+        if self.run_tests:
+            with self._timed("parsing"):
                 try:
-                    tree = self._load_result_tree(results_file_path)
+                    tree = self._load_result_tree(self._results_file_path)
                 except FileNotFoundError:
                     # If there are errors doing the tests, the final testing path is not created
                     tree = None
                 final_score = tree.calculate_score() if tree else 0.0
 
-                report = ExecutionReport(
-                    success=result.returncode == 0,
-                    stdout=result.stdout,
-                    stderr=result.stderr,
-                    return_code=result.returncode,
-                    timeout=False,
-                    results_path=host_results_path,
-                    test_tree=tree,
-                    final_score=final_score,
-                    total_tests=self.total_tests,
-                    analysis=None,
-                )
-            else:
-                report = ExecutionReport(
-                    success=True,
-                    stdout='',
-                    stderr='',
-                    return_code=None,
-                    timeout=False,
-                    results_path=host_results_path,
-                    test_tree=None,
-                    final_score=None,
-                    total_tests=0,
-                    analysis=None,
-                )
+            report = ExecutionReport(
+                success=return_code == 0,
+                stdout=self._stdout.excerpt(),
+                stderr=self._stderr.excerpt(),
+                return_code=return_code,
+                timeout=False,
+                results_path=self._host_results_path,
+                test_tree=tree,
+                final_score=final_score,
+                total_tests=self.total_tests,
+                analysis=None,
+            )
+            report.metadata['output'] = self._output_info()
+            resources = self._resources_info(return_code)
+            if resources is not None:
+                report.metadata['resources'] = resources
+            build_cache = self._close_build_cache()
+            if build_cache is not None:
+                report.metadata['build_cache'] = build_cache
+        else:
+            report = ExecutionReport(
+                success=True,
+                stdout='',
+                stderr='',
+                return_code=None,
+                timeout=False,
+                results_path=self._host_results_path,
+                test_tree=None,
+                final_score=None,
+                total_tests=0,
+                analysis=None,
+            )
 
-            if self.perform_analysis:
-                source_code = self._extract_source_code(self.code_extraction_max_char)
-                analysis = self.analyze_code(source_code, self.analysis_model)
-                report.analysis = analysis['message']
-                report.metadata['analysis'] = {
-                    'message': analysis['message'],
-                    'info': analysis['info'],
-                    'model': self.analysis_model,
-                    'engine': self.analysis_engine,
-                }
+        if self.perform_analysis:
+            if self._analysis_future is None:
+                self._start_analysis()
+            with self._timed("analysis_wait"):
+                analysis = self._analysis_future.result()
+            self._analysis_future = None
+            report.analysis = analysis['message']
+            report.metadata['analysis'] = {
+                'message': analysis['message'],
+                'info': analysis['info'],
+                'model': self.analysis_model,
+                'engine': self.analysis_engine,
+                'extraction': self._get_source_extraction(),
+                'cache': dict(self._analysis_cache_stats),
+                'prompt_tokens': analysis.get('prompt_tokens'),
+            }
 
-            self._collect_additional_metrics(results_file_path, report)
+        with self._timed("metrics"):
+            self._collect_additional_metrics(self._results_file_path, report)
 
-            return report
+        return report
 
-        except subprocess.TimeoutExpired as e:
-            return ExecutionReport(
-                success=False,
-                stdout=e.stdout or "",
-                stderr=e.stderr or f"Execution timed out after {self.max_time}s",
-                return_code=None,
-                timeout=True,
-                results_path=host_results_path,
-                final_score=0.0,
-                total_tests=0,
-            )
+    def _start_analysis(self):
+        """
+        Extract the source code and submit its analysis to the analysis executor. The result is collected when the
+        report is completed.
+        """
+        if not self.perform_analysis:
+            return
+        self._reset_source_extraction()
+        source_code = self._extract_source_code(self.code_extraction_max_char)
+        if self.analysis_executor is not None:
+            self._analysis_future = self.analysis_executor.submit(self._run_analysis, source_code)
+        else:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis")
+            self._analysis_future = executor.submit(self._run_analysis, source_code)
+            # The submitted analysis still runs, and the thread ends after it
+            executor.shutdown(wait=False)
+
+    def _run_analysis(self, source_code: str | dict) -> dict:
+        with self._timed("analysis"):
+            return self.analyze_code(source_code, self.analysis_model)
+
+    def _discard_analysis(self):
+        if self._analysis_future is not None:
+            self._analysis_future.cancel()
+            self._analysis_future = None
+
+    def _timeout_report(self) -> ExecutionReport:
+        self._discard_analysis()
+        stderr = self._stderr.excerpt() if self._stderr is not None else ""
+        report = ExecutionReport(
+            success=False,
+            stdout=self._stdout.excerpt() if self._stdout is not None else "",
+            stderr=stderr or f"Execution timed out after {self.max_time}s",
+            return_code=None,
+            timeout=True,
+            results_path=self._host_results_path,
+            final_score=0.0,
+            total_tests=0,
+        )
+        report.metadata['output'] = self._output_info()
+        resources = self._resources_info()
+        if resources is not None:
+            report.metadata['resources'] = resources
+        build_cache = self._close_build_cache()
+        if build_cache is not None:
+            report.metadata['build_cache'] = build_cache
+        return report
 
-    def run(self) -> ExecutionReport:
-        self._prepare_environment()
-        report = self._execute_in_container()
+    def _resources_info(self, return_code: Optional[int] = None) -> Optional[dict]:
+        """
+        Resource usage of the container, with the declared limits. None if it was not collected.
+        """
+        if self._resource_usage is None:
+            return None
+        usage = self._resource_usage.result(return_code)
+        if usage is not None:
+            usage['limits'] = self.get_resources()
+        return usage
+
+    def _cidfile(self) -> str:
+        return os.path.join(os.path.abspath(self.host_tmp), "container.cid")
+
+    def _start_resource_sampler(self) -> Optional[CgroupSampler]:
+        """
+        Start sampling the cgroup of the container started by the command line, found with its --cidfile.
+        """
+        self._resource_usage = None
+        if not self.resource_accounting or self._container is not None:
+            return None
+        sampler = CgroupSampler(self._cidfile(), self.get_resources()["memory"], self.resource_sample_interval)
+        self._resource_usage = sampler.usage
+        sampler.start()
+        return sampler
+
+    async def _execute_in_container_async(self) -> ExecutionReport:
+        docker_cmd = await asyncio.to_thread(self._prepare_container_command)
+
+        return_code = None
+        if self.run_tests:
+            client = self._get_docker_client()
+            try:
+                with self._timed("container"):
+                    if client is not None:
+                        try:
+                            return_code = await asyncio.to_thread(self._run_container_api, client)
+                        except asyncio.CancelledError:
+                            # The API call keeps running in its thread until the container is removed
+                            await asyncio.shield(asyncio.to_thread(self._stop_container))
+                            raise
+                    else:
+                        return_code = await self._run_process_async(docker_cmd)
+            except (TimeoutError, subprocess.TimeoutExpired):
+                return self._timeout_report()
+
+        return await asyncio.to_thread(self._complete_report, return_code)
+
+    def _output_log_file(self, stream: str) -> Optional[str]:
+        if self.output_log_path is None:
+            return None
+        name = os.path.basename(os.path.normpath(self.submission_path)) if self.submission_path else "submission"
+        return os.path.join(self.output_log_path, f"{name}_{self.execution_id}.{stream}.log")
+
+    def _create_output_captures(self):
+        self._stdout = BoundedOutput(self._output_log_file("stdout"), self.output_log_max_bytes,
+                                     self.output_head_bytes, self.output_tail_bytes)
+        self._stderr = BoundedOutput(self._output_log_file("stderr"), self.output_log_max_bytes,
+                                     self.output_head_bytes, self.output_tail_bytes)
+
+    def _output_info(self) -> dict:
+        return {
+            'stdout': self._stdout.info() if self._stdout is not None else None,
+            'stderr': self._stderr.info() if self._stderr is not None else None,
+        }
+
+    def _run_process(self, cmd: list[str]) -> int:
+        """
+        Run a command streaming its output to the bounded captures. Raises subprocess.TimeoutExpired after killing
+        the process if it does not finish in max_time seconds.
+        """
+        self._create_output_captures()
+        if self.container_lifecycle is not None and self._container is None:
+            self.container_lifecycle.register(self.container_name)
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._stdout.start(process.stdout)
+        self._stderr.start(process.stderr)
+        sampler = self._start_resource_sampler()
+        try:
+            return_code = process.wait(timeout=self.max_time)
+            self._finish_container(sampler)
+            return return_code
+        except BaseException:
+            # Timeout, interruption or any other error: stop the docker client and the container
+            process.kill()
+            process.wait()
+            self._stop_container()
+            raise
+        finally:
+            if sampler is not None:
+                sampler.stop()
+            self._stdout.close(OUTPUT_CLOSE_TIMEOUT)
+            self._stderr.close(OUTPUT_CLOSE_TIMEOUT)
+
+    def _finish_container(self, sampler: Optional[CgroupSampler]):
+        """
+        Complete the execution of a container started by the command line. Containers with resource accounting are
+        not started with "--rm": their final usage and OOM state are read before removing them, as the API backend
+        does.
+        """
+        if self._container is not None:
+            return
+        if sampler is not None:
+            sampler.stop()
+            state = inspect_container_state(self.container_name)
+            if state is not None and state.get('OOMKilled'):
+                self._resource_usage.oom_killed = True
+            remove_container(self.container_name)
+        if self.container_lifecycle is not None:
+            self.container_lifecycle.unregister(self.container_name)
+
+    def _get_docker_client(self) -> Optional[DockerClient]:
+        """
+        Docker API client if the "api" backend is selected and available. None to use the command line.
+        """
+        if self.docker_backend != "api" or self._container is not None:
+            return None
+        return get_docker_client(self.docker_socket)
+
+    def _container_config(self) -> dict:
+        """
+        Docker Engine API configuration of the container, equivalent to the "docker run" command.
+        """
+        resources = self.get_resources()
+        host_config = {
+            "Binds": [f"{self._fix_path(self._host_code_path)}:{self.container_mount}"] + self._container_mounts(),
+        }
+        if resources["cpus"] is not None:
+            host_config["NanoCpus"] = int(float(resources["cpus"]) * 1e9)
+        if resources["memory"] is not None:
+            host_config["Memory"] = resources["memory"]
+            host_config["MemorySwap"] = resources["memory"]
+        if resources["pids_limit"] is not None:
+            host_config["PidsLimit"] = resources["pids_limit"]
+        if self.docker_network is not None:
+            host_config["NetworkMode"] = self.docker_network
+        if self.artifact_proxy_settings.get('extra_hosts'):
+            host_config["ExtraHosts"] = list(self.artifact_proxy_settings['extra_hosts'])
+        return {
+            "Image": self.image,
+            "Cmd": ["bash", "-c", self._container_command()],
+            "WorkingDir": self._work_path,
+            "Env": [f"{name}={value}" for name, value in self._container_environment().items()],
+            "Labels": self._container_labels(),
+            "Tty": False,
+            "HostConfig": host_config,
+        }
+
+    def _run_container_api(self, client: DockerClient) -> int:
+        """
+        Run the container with the Docker Engine API, streaming its output to the bounded captures and sampling its
+        resource usage. Raises subprocess.TimeoutExpired after stopping the container if it does not finish in
+        max_time seconds.
+        """
+        self._create_output_captures()
+        self._resource_usage = ResourceUsage("api", self.get_resources()["memory"]) if self.resource_accounting else None
+        self._docker_client = client
+        if self.docker_pull_policy == "always":
+            client.pull_image(self.image)
+        try:
+            container_id = client.create_container(self.container_name, self._container_config())
+        except DockerAPIError as e:
+            if e.status != 404 or self.docker_pull_policy not in (None, "missing"):
+                raise
+            client.pull_image(self.image)
+            container_id = client.create_container(self.container_name, self._container_config())
+        if self.container_lifecycle is not None:
+            self.container_lifecycle.register(self.container_name)
+
+        streams = []
+        try:
+            client.start_container(container_id)
+            streams = [threading.Thread(target=self._stream_logs_api, args=(client, container_id), daemon=True)]
+            if self._resource_usage is not None:
+                streams.append(threading.Thread(target=self._stream_stats_api, args=(client, container_id),
+                                                daemon=True))
+            for stream in streams:
+                stream.start()
+            try:
+                return_code = client.wait_container(container_id, self.max_time)
+            except TimeoutError as e:
+                raise subprocess.TimeoutExpired(self.run_cmd, self.max_time) from e
+            if self._resource_usage is not None:
+                # Only known until the container is removed
+                try:
+                    state = client.inspect_container(container_id).get('State', {})
+                    self._resource_usage.oom_killed = bool(state.get('OOMKilled'))
+                except (OSError, http.client.HTTPException, DockerAPIError) as e:
+                    logger.debug(f"Cannot inspect container {self.container_name}: {e}")
+            return return_code
+        except BaseException:
+            self._stop_container()
+            raise
+        finally:
+            for stream in streams:
+                stream.join(OUTPUT_CLOSE_TIMEOUT)
+            self._stdout.close()
+            self._stderr.close()
+            # Removed after reading the output and the state, as the command line does (see _finish_container)
+            self._stop_container()
+
+    def _stream_logs_api(self, client: DockerClient, container_id: str):
+        try:
+            for stream, data in client.logs(container_id):
+                (self._stderr if stream == STDERR_STREAM else self._stdout).feed(data)
+        except (OSError, http.client.HTTPException, DockerAPIError) as e:
+            logger.debug(f"Log stream of container {self.container_name} closed: {e}")
+
+    def _stream_stats_api(self, client: DockerClient, container_id: str):
+        try:
+            for sample in client.stats(container_id):
+                self._resource_usage.add(usage_from_api_stats(sample))
+        except (OSError, http.client.HTTPException, DockerAPIError, ValueError) as e:
+            logger.debug(f"Stats stream of container {self.container_name} closed: {e}")
+
+    async def _run_process_async(self, cmd: list[str]) -> int:
+        """
+        Asynchronous version of _run_process. Raises TimeoutError if the process does not finish in max_time seconds.
+        On timeout or cancellation, the process and its container are stopped.
+        """
+        self._create_output_captures()
+        if self.container_lifecycle is not None and self._container is None:
+            self.container_lifecycle.register(self.container_name)
+        process = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                                       stderr=subprocess.PIPE)
+        readers = asyncio.gather(self._stdout.drain_async(process.stdout), self._stderr.drain_async(process.stderr))
+        sampler = self._start_resource_sampler()
+        try:
+            return_code = await asyncio.wait_for(process.wait(), self.max_time)
+            try:
+                await asyncio.wait_for(asyncio.shield(readers), OUTPUT_CLOSE_TIMEOUT)
+            except TimeoutError:
+                logger.warning(f"Output streams still open after {OUTPUT_CLOSE_TIMEOUT}s, capture stopped")
+            await asyncio.shield(asyncio.to_thread(self._finish_container, sampler))
+            return return_code
+        except BaseException:
+            # Timeout, cancellation or any other error: stop the docker client and the container
+            if process.returncode is None:
+                process.kill()
+            await asyncio.shield(asyncio.to_thread(self._stop_container))
+            raise
+        finally:
+            if sampler is not None:
+                await asyncio.to_thread(sampler.stop)
+            readers.cancel()
+            self._stdout.close()
+            self._stderr.close()
+
+    @contextmanager
+    def _timed(self, phase: str):
+        """
+        Accumulate the (monotonic) time spent in a phase of the run.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._timings[phase] = self._timings.get(phase, 0.0) + time.monotonic() - start
+
+    def _cleanup_environment(self):
+        self._discard_analysis()
+        self._invalidate_file_index()
+        self._close_build_cache()
         if self.remove_tmp:
             # Remove the temporary directory after execution
             logger.debug(f"Removing temporary directory {self.host_tmp}")
             shutil.rmtree(self.host_tmp, ignore_errors=True)
+
+    def _use_container(self, container):
+        self._container = container
+        # The workspace of the pooled container is reset by the pool after each job
+        self.host_tmp = os.path.join(container.host_path, '')
+
+    def _finish_run(self, report: ExecutionReport, start: float) -> ExecutionReport:
+        self._timings["total"] = time.monotonic() - start
+        report.metadata['timings'] = dict(self._timings)
         return report
 
+    def run(self) -> ExecutionReport:
+        self._timings = {}
+        start = time.monotonic()
+        if self.container_pool is not None:
+            container = self.container_pool.get(self.image, self._container_mounts(), self._run_args())
+            self._timings["container_start"] = time.monotonic() - start
+            try:
+                self._use_container(container)
+                with self._timed("staging"):
+                    self._prepare_environment()
+                report = self._execute_in_container()
+            finally:
+                self._container = None
+                self._discard_analysis()
+                with self._timed("cleanup"):
+                    self.container_pool.release(container)
+        else:
+            try:
+                with self._timed("staging"):
+                    self._prepare_environment()
+                report = self._execute_in_container()
+            finally:
+                with self._timed("cleanup"):
+                    self._cleanup_environment()
+
+        return self._finish_run(report, start)
+
+    async def run_async(self) -> ExecutionReport:
+        """
+        Asynchronous version of run. The container is run with asyncio subprocesses, and the blocking steps (staging,
+        result parsing, analysis and cleanup) are executed in worker threads. Cancelling the task stops the container.
+        """
+        self._timings = {}
+        start = time.monotonic()
+        if self.container_pool is not None:
+            container = await asyncio.to_thread(self.container_pool.get, self.image, self._container_mounts(),
+                                                self._run_args())
+            self._timings["container_start"] = time.monotonic() - start
+            try:
+                self._use_container(container)
+                with self._timed("staging"):
+                    await asyncio.to_thread(self._prepare_environment)
+                report = await self._execute_in_container_async()
+            finally:
+                self._container = None
+                self._discard_analysis()
+                with self._timed("cleanup"):
+                    await asyncio.shield(asyncio.to_thread(self.container_pool.release, container))
+        else:
+            try:
+                with self._timed("staging"):
+                    await asyncio.to_thread(self._prepare_environment)
+                report = await self._execute_in_container_async()
+            finally:
+                with self._timed("cleanup"):
+                    await asyncio.shield(asyncio.to_thread(self._cleanup_environment))
+
+        return self._finish_run(report, start)
+
     def _extract_source_code(self, max_chars: int = 10000, source_path: str = None) -> str | dict:
         """
         Extract source code from the given project directory, limited by total character count.
 
+        Files are ranked before reading them: files that are not part of the scaffold (data_path) first, then main
+        sources before tests, then smaller files. Only the files that fit in the budget are read, and the files
+        left out are recorded in the extraction summary (see _get_source_extraction).
+
+        When analysis_scaffold_path is set, files identical to their scaffold version are left out, and lightly
+        modified ones are extracted as a unified diff against the scaffold.
+
         Args:
-            project_path (str): Root path of the project.
             max_chars (int): Maximum number of characters to extract.
-            extensions (List[str]): List of file extensions to include.
+            source_path (str): Root path of the code. Defaults to the submission path.
 
         Returns:
             str: Combined source code as a single string, annotated with file paths.
         """
         collected_code = []
         total_chars = 0
+        limited = max_chars is not None and max_chars > 0
 
         if source_path is None:
             source_path = self.submission_path
 
-        for root, _, files in os.walk(source_path):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.file_code_extensions):
-                    file_path = os.path.join(root, file)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            code = f.read()
-                            # Limit the total number of characters
-                            if max_chars is not None and max_chars > 0 and total_chars + len(code) > max_chars:
-                                continue
-                            collected_code.append(f"\n{self.line_comment_symbol} --- START FILE: {file_path} ---\n{code}\n{self.line_comment_symbol} --- END FILE: {file_path} ---\n")
-                            total_chars += len(code)
-                    except Exception as e:
-                        print(f"Error reading {file_path}: {e}")
-
-        return "\n".join(collected_code)
-
-    def _perform_analysis(self, prompt, model, role: str = 'user') -> dict:
-
-        if self.analysis_engine == 'codellama':
-            import ollama
-            req_response = ollama.chat(model=model, messages=[{"role": role, "content": prompt}])
-            response = {
-                "success": True,
-                "duration": req_response.total_duration,
-                "message": req_response.message['content'],
-            }
+        entries = self._get_file_index(source_path).files(source_path, self.file_code_extensions)
+        for entry in self._rank_source_files(entries, source_path):
+            file_path = entry.path
+            remaining = max_chars - total_chars if limited else None
+            baseline_path = self._find_scaffold_baseline(entry, source_path)
+            if limited and baseline_path is None and entry.size > remaining * MAX_CHAR_BYTES:
+                # Can not fit, even if all the characters were multibyte
+                self._source_extraction['omitted'].append(file_path)
+                continue
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    # Read one character more than the budget to know if the file fits. Scaffold files are read
+                    # completely, as their diff may fit.
+                    code = f.read(remaining + 1 if limited and baseline_path is None else -1)
+            except Exception as e:
+                logger.warning(f"Could not read {file_path}: {e}")
+                self._source_extraction['omitted'].append(file_path)
+                continue
 
-        elif self.analysis_engine == 'openai':
-            from openai import OpenAI
+            block_type = 'FILE'
+            if baseline_path is not None:
+                diff = self._scaffold_diff(baseline_path, file_path, code)
+                if diff == '':
+                    self._source_extraction['scaffold_unchanged'].append(file_path)
+                    continue
+                if diff is not None:
+                    code = diff
+                    block_type = 'DIFF'
+                    self._source_extraction['scaffold_diffs'].append(file_path)
+
+            # Limit the total number of characters
+            if limited and len(code) > remaining:
+                self._source_extraction['omitted'].append(file_path)
+                continue
+            collected_code.append(f"\n{self.line_comment_symbol} --- START {block_type}: {file_path} ---\n{code}\n{self.line_comment_symbol} --- END {block_type}: {file_path} ---\n")
+            total_chars += len(code)
+            self._source_extraction['files'].append(file_path)
 
-            config = Config()
+        self._source_extraction['chars'] += total_chars
+        return "\n".join(collected_code)
 
-            client = OpenAI(
-                # This is the default and can be omitted
-                api_key=config.OPENAI_API_KEY,
-            )
+    def _get_scaffold_files(self) -> set:
+        """
+        Names and sizes of the files provided in data_path and analysis_scaffold_path, used to detect unmodified
+        scaffold files.
+        """
+        if self._scaffold_files is None:
+            self._scaffold_files = set()
+            for path in (self.data_path, self.analysis_scaffold_path):
+                if path is not None and os.path.isdir(path):
+                    index = FileIndex(path, self.index_ignore_dirs)
+                    self._scaffold_files.update((entry.name, entry.size) for entry in index.files())
+        return self._scaffold_files
+
+    def _find_scaffold_baseline(self, entry: FileEntry, source_path: str) -> Optional[str]:
+        """
+        Scaffold version of a source file, matched by path suffix (the submission or the scaffold may have extra
+        parent folders). None if there is no scaffold baseline or the file is not part of it.
+        """
+        if self.analysis_scaffold_path is None:
+            return None
+        if self._scaffold_baseline is None:
+            self._scaffold_baseline = {}
+            if os.path.isdir(self.analysis_scaffold_path):
+                index = FileIndex(self.analysis_scaffold_path, self.index_ignore_dirs)
+                for baseline in index.files():
+                    parts = tuple(os.path.relpath(baseline.path, index.root).split(os.sep))
+                    self._scaffold_baseline.setdefault(baseline.name, []).append((parts, baseline.path))
+
+        parts = tuple(os.path.relpath(entry.path, os.path.abspath(source_path)).split(os.sep))
+        for baseline_parts, baseline_path in self._scaffold_baseline.get(entry.name, []):
+            common = min(len(parts), len(baseline_parts))
+            if parts[-common:] == baseline_parts[-common:]:
+                return baseline_path
+        return None
 
+    def _scaffold_diff(self, baseline_path: str, file_path: str, code: str) -> Optional[str]:
+        """
+        Unified diff of a file against its scaffold version. Returns an empty string if the file is unchanged, and
+        None if the changes are too large for the diff to be useful (see analysis_scaffold_max_diff_ratio).
+        """
+        try:
+            with open(baseline_path, 'r', encoding='utf-8', errors='ignore') as f:
+                baseline = f.read()
+        except OSError as e:
+            logger.warning(f"Cannot read scaffold file {baseline_path}: {e}")
+            return None
+        if baseline == code:
+            return ''
+        diff = ''.join(difflib.unified_diff(baseline.splitlines(keepends=True), code.splitlines(keepends=True),
+                                            fromfile=f"scaffold/{os.path.basename(baseline_path)}", tofile=file_path))
+        if len(diff) > self.analysis_scaffold_max_diff_ratio * len(code):
+            return None
+        return diff
 
-            req_response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": role, "content": prompt},
-                ],
-                temperature=0.5
-            )
+    @staticmethod
+    def _is_test_source(relative_path: str) -> bool:
+        parts = relative_path.split(os.sep)
+        if any(part.lower() in TEST_SOURCE_DIRS for part in parts[:-1]):
+            return True
+        return TEST_SOURCE_REGEX.match(os.path.splitext(parts[-1])[0]) is not None
 
-            response = {
-                "success": len(req_response.choices) > 0,
-                "duration": 0.0,
-                "message": json.loads(req_response.choices[0].message.content.replace('```json', '').replace('```', ''))['feedback'],
-                "extra_info": json.loads(req_response.choices[0].message.content.replace('```json', '').replace('```', ''))
-            }
+    def _rank_source_files(self, entries: list[FileEntry], source_path: str) -> list[FileEntry]:
+        """
+        Sort the source files by relevance for the analysis: non-scaffold first, then main sources before tests,
+        then smaller files. Files with the same rank keep the index order.
+        """
+        scaffold = self._get_scaffold_files()
+        source_path = os.path.abspath(source_path)
+        return sorted(entries, key=lambda entry: (
+            (entry.name, entry.size) in scaffold,
+            self._is_test_source(os.path.relpath(entry.path, source_path)),
+            entry.size,
+        ))
+
+    def _reset_source_extraction(self):
+        self._source_extraction = {'files': [], 'omitted': [], 'scaffold_unchanged': [], 'scaffold_diffs': [],
+                                   'chars': 0}
+
+    def _get_source_extraction(self) -> dict:
+        """
+        Summary of the last source code extraction: files included, files left out, scaffold files left out because
+        they are unchanged, files extracted as a diff and characters extracted.
+        """
+        return dict(self._source_extraction)
 
-        else:
-            raise NotImplementedError(f"Unknown analysis engine: {self.analysis_engine}")
+    def _perform_analysis(self, prompt, model, role: str = 'user') -> dict:
+        engine = get_engine(self.analysis_engine, self.analysis_engine_options)
+        return engine.analyze(prompt, model, role, temperature=self.analysis_temperature)
 
+    def _request_analysis(self, prompt, model, role: str = 'user') -> dict:
+        """
+        Send an analysis request, respecting the concurrency and rate limits of the engine. Responses are taken
+        from the analysis cache when it is enabled.
+        """
+        cache = None
+        if self.analysis_cache_file is not None:
+            cache = get_analysis_cache(self.analysis_cache_file, self.analysis_cache_max_bytes)
+            key = analysis_cache_key(self.analysis_engine, model, role, prompt, self.analysis_temperature)
+            response = cache.get(key)
+            with self._analysis_cache_lock:
+                self._analysis_cache_stats['hits' if response is not None else 'misses'] += 1
+            if response is not None:
+                return response
+
+        limiter = get_engine_limiter(self.analysis_engine, self.analysis_concurrency, self.analysis_rate_limit)
+        with limiter.slot():
+            response = self._perform_analysis(prompt, model, role)
+        if cache is not None and response.get('success', False):
+            cache.put(key, response)
         return response
 
     def analyze_code(self, code: str | dict, model: str = 'codellama') -> dict:
@@ -340,28 +1236,38 @@ class RunSubmissionTest:
             )
         if isinstance(code, str):
             prompt += code
-            response = self._perform_analysis(prompt, model)
+            response = self._request_analysis(prompt, model)
             result = {
                 'message': response['message'],
                 'info': None,
+                'prompt_tokens': estimate_tokens(prompt),
             }
         elif isinstance(code, dict):
-            analysis = {}
+            module_prompts = {}
             for k, v in code.items():
                 if isinstance(prompt, dict):
                     k_prompt = prompt.get(k, prompt)
                 else:
                     k_prompt = prompt
-                k_prompt += v
-                k_response = self._perform_analysis(k_prompt, model)
-                analysis[k] = {
-                    'message': k_response['message'],
-                    'info': k_response,
-                }
+                module_prompts[k] = k_prompt + v
+
+            # Modules are sent concurrently, and merged in the original order
+            analysis = {}
+            max_workers = min(max(int(self.analysis_concurrency), 1), max(len(module_prompts), 1))
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {k: pool.submit(self._request_analysis, k_prompt, model)
+                           for k, k_prompt in module_prompts.items()}
+                for k, future in futures.items():
+                    k_response = future.result()
+                    analysis[k] = {
+                        'message': k_response['message'],
+                        'info': k_response,
+                    }
 
             result = {
                 'message': '',
-                'info': analysis
+                'info': analysis,
+                'prompt_tokens': {k: estimate_tokens(k_prompt) for k, k_prompt in module_prompts.items()},
             }
             for k, v in analysis.items():
                 result['message'] += f"{k}:\n\n {v['message']}\n\n"
@@ -370,12 +1276,13 @@ class RunSubmissionTest:
         return result
 
     def _find_first(self, base_path: str, filename: str) -> str | None:
-        for root, dirs, files in os.walk(base_path):
-            if filename in files:
-                return os.path.join(root, filename)
-        return None
+        return self._get_file_index(base_path).find_first(filename, base_path)
 
 class PythonSubmissionTest(RunSubmissionTest):
+    # The test command does not install the requirements, so the pip cache is only enabled with the
+    # "build_cache_kinds" option, for run commands or images that install them
+    BUILD_CACHE_KINDS = ()
+
     def __init__(self, submission_path: str, image: str = "python-grader:latest", max_time: int = 30,
                  config: Optional[dict] = None):
         if config is None:
@@ -449,6 +1356,13 @@ class PythonSubmissionTest(RunSubmissionTest):
         return root
 
 class CSubmissionTest(RunSubmissionTest):
+    # AddressSanitizer and valgrind need more memory than the program itself
+    DEFAULT_RESOURCES = {"cpus": 1, "memory": "2g", "pids_limit": 256}
+    # ccache is used as CMake compiler launcher, so it is only enabled with the "build_cache_kinds" option, for images
+    # that include it (e.g. the grader images)
+    BUILD_CACHE_KINDS = ()
+    GRADER_IMAGE_KIND = "c"
+
     def __init__(self, submission_path: str, image: str = "xbaro/gcc-gtest:latest", max_time: int = 30,
                  config: Optional[dict] = None):
         if config is None:
@@ -457,9 +1371,10 @@ class CSubmissionTest(RunSubmissionTest):
             }
         elif 'max_time' not in config:
             config['max_time'] = max_time
+        # The image option is kept, so derived grader images can be used
+        config.setdefault("image", image)
         config.update(
              {
-                "image": image,
                 "run_cmd": (
                     "mkdir -p /mnt/code/results && "
                     "mkdir -p build && cd build && "
@@ -513,7 +1428,10 @@ class CSubmissionTest(RunSubmissionTest):
                             continue
                     if not mod_found:
                         logger.error(f"Module {module} not found")
-            shutil.copytree(self.data_path, base_path, dirs_exist_ok=True)
+            stage_tree(self.data_path, base_path, self.staging_mode)
+            # The file is modified in place, so it can not share the content with the data_path version
+            detach_file(os.path.join(base_path, 'CMakeLists.txt'))
+            self._invalidate_file_index()
             teaching_utils.teaching_lib.text_utils.replace_file_keys(os.path.join(base_path, 'CMakeLists.txt'), dict, '$!-', '-!$')
 
     def _compute_working_directory(self):
@@ -580,6 +1498,11 @@ class CSubmissionTest(RunSubmissionTest):
 
 
 class JavaSubmissionTest(RunSubmissionTest):
+    DEFAULT_RESOURCES = {"cpus": 2, "memory": "2g", "pids_limit": 1024}
+    # Replaces the shared /tmp/maven_cache mount when the "build_cache" option is set
+    BUILD_CACHE_KINDS = ('maven',)
+    GRADER_IMAGE_KIND = "java"
+
     def __init__(self, submission_path: str, image: str = "maven:latest", max_time: int = 30,
                  config: Optional[dict] = None):
         if config is None:
@@ -591,7 +1514,7 @@ class JavaSubmissionTest(RunSubmissionTest):
             (
                 "if [ ! -f pom.xml ]; then echo 'No pom.xml found in working directory' >&2; exit 2; fi && "
                 "mkdir -p /mnt/code/results && "
-                "mvn clean org.jacoco:jacoco-maven-plugin:0.8.13:prepare-agent test org.jacoco:jacoco-maven-plugin:0.8.13:report checkstyle:checkstyle > /mnt/code/results/maven_output.log 2>&1 || "
+                f"mvn {MAVEN_TEST_GOALS} > /mnt/code/results/maven_output.log 2>&1 || "
                 "  { cat /mnt/code/results/maven_output.log >&2; exit 1; } && "
                 "find . -type d -name surefire-reports | while read dir; do "
                 "  MOD_NAME=$(basename $(dirname $(dirname \"$dir\"))); "
@@ -607,9 +1530,11 @@ class JavaSubmissionTest(RunSubmissionTest):
         config.setdefault("grading_file", None)
         config.setdefault("file_code_extensions", ['.java', ])
         config.setdefault("line_comment_symbol", "//")
-        config.setdefault("additional_mounts", ["/tmp/maven_cache:/root/.m2/repository"])
+        if config.get("build_cache") is None:
+            config.setdefault("additional_mounts", ["/tmp/maven_cache:/root/.m2/repository"])
         super().__init__(submission_path, config)
-        os.makedirs('/tmp/maven_cache', exist_ok=True)
+        if self.build_cache is None:
+            os.makedirs('/tmp/maven_cache', exist_ok=True)
         self.total_tests = 0
 
     @staticmethod
@@ -627,31 +1552,27 @@ class JavaSubmissionTest(RunSubmissionTest):
         extracted = True
         while extracted:
             extracted = False
-            for root, _, files in os.walk(code_root):
-                for file_name in files:
-                    lower_name = file_name.lower()
-                    if not lower_name.endswith(archive_extensions):
-                        continue
+            for entry in self._get_file_index(code_root).files(code_root):
+                if not entry.name.lower().endswith(archive_extensions):
+                    continue
 
-                    archive_path = os.path.join(root, file_name)
-                    extract_dir = self._archive_extract_dir(archive_path)
-                    if os.path.isdir(extract_dir) and os.listdir(extract_dir):
-                        continue
+                archive_path = entry.path
+                extract_dir = self._archive_extract_dir(archive_path)
+                if os.path.isdir(extract_dir) and os.listdir(extract_dir):
+                    continue
 
-                    os.makedirs(extract_dir, exist_ok=True)
-                    try:
-                        shutil.unpack_archive(archive_path, extract_dir)
-                        extracted = True
-                    except (shutil.ReadError, ValueError):
-                        logger.warning(f"Could not unpack nested archive: {archive_path}")
+                os.makedirs(extract_dir, exist_ok=True)
+                try:
+                    shutil.unpack_archive(archive_path, extract_dir)
+                    extracted = True
+                except (shutil.ReadError, ValueError):
+                    logger.warning(f"Could not unpack nested archive: {archive_path}")
+            if extracted:
+                self._invalidate_file_index()
 
     def _compute_working_directory(self):
         code_root = os.path.join(self.host_tmp, "code")
-        project_roots = []
-
-        for root, _, files in os.walk(code_root):
-            if 'pom.xml' in files:
-                project_roots.append(root)
+        project_roots = [os.path.dirname(path) for path in self._get_file_index(code_root).find_all('pom.xml')]
 
         if not project_roots:
             return None
@@ -771,12 +1692,50 @@ class JavaSubmissionTest(RunSubmissionTest):
                     }
 
 
+def _percentile(values: list[float], percent: float) -> float:
+    """
+    Percentile of a list of values, using linear interpolation between the closest ranks.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+# Usage values aggregated by CodeActivityTester.get_resource_summary
+RESOURCE_SUMMARY_KEYS = ('cpu_seconds', 'peak_memory_bytes', 'io_read_bytes', 'io_write_bytes', 'max_pids')
+# Margin over the peak memory of the previous run reserved in the resource budget
+RESOURCE_PROFILE_MARGIN = 1.25
+
+
+@dataclass
+class _TestRun:
+    store: Optional[ReportStore] = None
+    selected: list[Submission] = field(default_factory=list)
+    pending: list[Submission] = field(default_factory=list)
+    fingerprints: dict[str, Optional[str]] = field(default_factory=dict)
+    # Submissions with the same fingerprint as a pending one, by key of the pending submission
+    duplicates: dict[str, list[Submission]] = field(default_factory=dict)
+    reports: dict[str, ExecutionReport] = field(default_factory=dict)
+    # Duration and resource usage of the previous runs, by submission key
+    profiles: dict[str, dict] = field(default_factory=dict)
+
+
 class CodeActivityTester:
     def __init__(self, submissions: SubmissionSet, tester_class: str, options: Optional[dict] = None):
         self._submissions = submissions
         self._options = options
         self._tester_class = CodeActivityTester._get_class(tester_class)
         self._reports: dict[str, ExecutionReport] = {}
+        self._container_pool: Optional[ContainerPool] = None
+        self._container_lifecycle: Optional[ContainerLifecycleManager] = None
+        self._resource_budget: Optional[ResourceBudget] = None
+        self._resource_profiles: dict[str, dict] = {}
+        self._fingerprint_memo: Optional[dict] = None
+        self._analysis_executor: Optional[ThreadPoolExecutor] = None
+        self._artifact_proxy: Optional[ArtifactProxy] = None
+        self._artifact_proxy_stats: Optional[dict] = None
 
     @staticmethod
     def _get_class(class_name: str) -> type:
@@ -787,12 +1746,112 @@ class CodeActivityTester:
             m = getattr(m, comp)
         return m
 
+    def _create_tester(self, submission: Submission) -> RunSubmissionTest:
+        # Each tester gets its own copy of the options, as testers update them and may run concurrently
+        config = dict(self._options) if self._options is not None else None
+        if self._container_pool is not None:
+            config["container_pool"] = self._container_pool
+        if self._container_lifecycle is not None:
+            config.setdefault("container_lifecycle", self._container_lifecycle)
+        if self._analysis_executor is not None:
+            config.setdefault("analysis_executor", self._analysis_executor)
+        if self._artifact_proxy is not None:
+            config.setdefault("artifact_proxy_settings", self._artifact_proxy.container_settings())
+        if self._fingerprint_memo is not None and config is not None:
+            config.setdefault("fingerprint_memo", self._fingerprint_memo)
+        return self._tester_class(submission.get_local_path(), config=config)
+
+    def _create_resource_budget(self, jobs: int, executor: Optional[Executor]) -> Optional[ResourceBudget]:
+        # The budget is shared by the threads of this process, so it is not used with process executors
+        if isinstance(executor, ProcessPoolExecutor) or (executor is None and (jobs is None or jobs <= 1)):
+            return None
+        capacity = (self._options or {}).get("resource_capacity") or {}
+        return ResourceBudget(cpus=capacity.get("cpus"), memory=capacity.get("memory"))
+
+    def _create_container_pool(self, jobs: int, executor: Optional[Executor]) -> Optional[ContainerPool]:
+        pool_option = self._options.get("container_pool") if self._options is not None else None
+        if not pool_option or isinstance(pool_option, ContainerPool):
+            return None
+        if isinstance(executor, ProcessPoolExecutor):
+            raise ValueError("Container pools can only be used with thread based executors")
+        size = pool_option if isinstance(pool_option, int) and not isinstance(pool_option, bool) else max(jobs or 1, 1)
+        return ContainerPool(
+            size=size,
+            workspace_basepath=self._options.get("host_tmp_basepath", "/tmp"),
+            container_mount=self._options.get("container_mount", "/mnt/code"),
+            pull_policy=self._options.get("docker_pull_policy", "never"),
+            labels=self._container_lifecycle.labels if self._container_lifecycle is not None else None,
+        )
+
+    def _create_artifact_proxy(self) -> Optional[ArtifactProxy]:
+        """
+        Start the local artifact proxy of the "artifact_proxy" option: a dict with the ArtifactProxy arguments
+        ("store_path", "host", "port", "offline", "upstreams") and "seeds", the folders of artifacts added to the
+        store by kind ("maven" or "pypi"). Seeds are not resolved from the scaffold project automatically: they are
+        prepared beforehand (see ArtifactProxy.seed).
+        """
+        proxy_option = self._options.get("artifact_proxy") if self._options is not None else None
+        if not proxy_option:
+            return None
+        proxy_option = dict(proxy_option)
+        seeds = proxy_option.pop("seeds", None) or {}
+        proxy = ArtifactProxy(**proxy_option)
+        for kind, seed_path in seeds.items():
+            proxy.seed(kind, seed_path)
+        proxy.start()
+        return proxy
+
+    def prepare_grader_image(self, **kwargs) -> str:
+        """
+        Build (or reuse) the assignment specific grader image of the tester options, and use it in the next runs.
+        Arguments are passed to grader_images.build_grader_image. The base image is kept in the "grader_base_image"
+        option, so the image can be prepared again after changes in the scaffold.
+
+        Returns:
+            str: Tag of the image.
+        """
+        kind = getattr(self._tester_class, "GRADER_IMAGE_KIND", None)
+        if kind is None:
+            raise ValueError(f"Grader images are not available for {self._tester_class.__name__}")
+        if (self._options or {}).get("data_path") is not None:
+            # The scaffold is staged by a tester, as the submissions
+            scaffold_tester = self._tester_class(self._options["data_path"], config=dict(self._options))
+            kwargs.setdefault("stage_scaffold", scaffold_tester.stage_grader_scaffold)
+        overrides = build_grader_image(self._options or {}, kind, **kwargs)
+        self._options = dict(self._options or {})
+        self._options.update(overrides)
+        return overrides["image"]
+
+    def _create_analysis_executor(self, jobs: int, executor: Optional[Executor]) -> Optional[ThreadPoolExecutor]:
+        # Testers in other processes can not use this pool, so they start their own analysis threads
+        if self._options is None or not self._options.get("perform_analysis", True):
+            return None
+        if isinstance(executor, ProcessPoolExecutor):
+            return None
+        workers = self._options.get("analysis_workers") or max(jobs or 1, 1)
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+
+    def get_submission_fingerprint(self, submission: Submission) -> Optional[str]:
+        """
+        Get the content based cache key for a submission, or None if it cannot be computed.
+        """
+        try:
+            return self._create_tester(submission).get_fingerprint()
+        except Exception as e:
+            logger.warning(f"Cannot compute fingerprint for submission {submission.get_key()}: {e}")
+            return None
+
     def run_submission_tests(self, submission: Submission) -> ExecutionReport:
         logger.info(f"Testing {submission}")
 
         try:
-            sub_test = self._tester_class(submission.get_local_path(), config=self._options)
-            report = sub_test.run()
+            sub_test = self._create_tester(submission)
+            if self._resource_budget is not None:
+                resources = self._reserved_resources(submission, sub_test.get_resources())
+                with self._resource_budget.reserve(resources["cpus"], resources["memory"]):
+                    report = sub_test.run()
+            else:
+                report = sub_test.run()
             report.submission = submission
         except Exception as e:
             logger.error(e)
@@ -801,37 +1860,520 @@ class CodeActivityTester:
 
         return report
 
-
-    def run_tests(self, start: int = 0, limit: int = None, cache_file: str = None ):
-        cache = {}
-        if cache_file is not None and os.path.exists(cache_file):
-            logger.info(f"Loading cached results from {cache_file}")
-            cache = pickle.load(open(cache_file, "rb"))
-
-        self._reports = {}
-        i = 0
-        for submission in self._submissions:
+    def _reserved_resources(self, submission: Submission, declared: dict) -> dict:
+        """
+        Resources reserved in the budget for a submission. The declared memory is reduced to the peak of its previous
+        run (with a margin), unless that run was killed for lack of memory. CPUs are time shared, so the declared
+        value is kept.
+        """
+        profile = self._resource_profiles.get(submission.get_key())
+        if not profile or profile.get('oom_killed') or not profile.get('peak_memory_bytes'):
+            return declared
+        reserved = dict(declared)
+        if declared["memory"] is not None:
+            reserved["memory"] = min(declared["memory"], int(profile['peak_memory_bytes'] * RESOURCE_PROFILE_MARGIN))
+        return reserved
+
+    def _select_submissions(self, start: int = 0, limit: int = None) -> list[Submission]:
+        selected = []
+        for i, submission in enumerate(self._submissions):
             if i < start:
                 logger.debug("Skipped submission %d", i)
-                i += 1
                 continue
-            i += 1
-            if limit is not None and i > limit:
+            if limit is not None and i >= limit:
                 logger.debug("Breaking test at submission %d", i)
                 break
-            if submission.get_key() in cache:
-                logger.info(f"Found cached result for submission {submission.get_key()}")
-                report = cache[submission.get_key()]
+            selected.append(submission)
+        return selected
+
+    def _run_pending(self, pending: list[Submission], jobs: int = 1, executor: Optional[Executor] = None):
+        """
+        Run the tests of the given submissions, yielding (submission, report) pairs as they finish.
+
+        Args:
+            pending (list[Submission]): Submissions to be tested.
+            jobs (int): Number of submissions tested concurrently when no executor is given.
+            executor (Executor): Optional executor used to run the tests. It is not shut down after the run.
+        """
+        if executor is None and (jobs is None or jobs <= 1):
+            for submission in pending:
+                yield submission, self.run_submission_tests(submission)
+            return
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="submission_test")
+        try:
+            futures = {executor.submit(self.run_submission_tests, submission): submission for submission in pending}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def run_tests(self, start: int = 0, limit: int = None, cache_file: str = None, jobs: int = 1,
+                  executor: Optional[Executor] = None):
+        """
+        Run the tests for the submissions in the range [start, limit).
+
+        Args:
+            start (int): Index of the first submission to test.
+            limit (int): Index of the first submission not to be tested. None to test until the end.
+            cache_file (str): Optional report store (SQLite) used to save and reuse the reports. Each report is saved as
+                soon as it is available, so an interrupted run can be resumed. Reports are keyed by the submission
+                fingerprint, so only submissions whose content, tester or configuration changed are tested again.
+            jobs (int): Number of submissions tested in parallel. Ignored when an executor is given.
+            executor (Executor): Optional executor (threads or processes) used to run the submission tests.
+
+        The "container_pool" option (True, or the number of containers) runs the submissions on a pool of warm
+        containers that is kept during the run. By default, the pool has one container per job.
+
+        Parallel runs only start a submission when the resources declared by its tester (see the "resources" option)
+        fit in the "resource_capacity" option ({"cpus": ..., "memory": ...}), which defaults to this machine.
+
+        Submissions with the same fingerprint (identical content and configuration) are tested once, and the report is
+        copied to all of them, unless the "deduplicate_submissions" option is False.
+
+        Parallel runs start the submissions with the longest expected duration first (from the durations saved in the
+        report store, or estimated from the submission size), unless the "schedule_longest_first" option is False.
+
+        The code analysis of each submission runs on a separate thread pool while its tests are executed. The pool has
+        one thread per job, or the number given in the "analysis_workers" option.
+
+        Containers still running at the end of the run are removed. Containers left by previous runs on this host
+        whose process is no longer alive are removed at the start, unless the "reap_orphan_containers" option is False.
+        """
+        run = self._start_run(start, limit, cache_file, jobs, executor)
+        try:
+            self._resource_budget = self._create_resource_budget(jobs, executor)
+            for submission, report in self._run_pending(run.pending, jobs, executor):
+                self._record_report(run, submission, report)
+        finally:
+            self._finish_run(run)
+
+    async def run_tests_async(self, start: int = 0, limit: int = None, cache_file: str = None, jobs: int = 4):
+        """
+        Asynchronous version of run_tests, using RunSubmissionTest.run_async. At most `jobs` submissions are tested
+        concurrently, within the "resource_capacity" budget. Cancelling the task stops the running containers, and the
+        finished reports are kept.
+        """
+        # The run bookkeeping (fingerprints, report store, container cleanup) blocks, so it runs in worker threads
+        run = await asyncio.to_thread(self._start_run, start, limit, cache_file, jobs)
+        try:
+            self._resource_budget = self._create_resource_budget(jobs, None)
+            async for submission, report in self._run_pending_async(run.pending, jobs):
+                await asyncio.to_thread(self._record_report, run, submission, report)
+        finally:
+            await asyncio.shield(asyncio.to_thread(self._finish_run, run))
+
+    async def iter_reports_async(self, start: int = 0, limit: int = None, jobs: int = 4):
+        """
+        Test the submissions in the range [start, limit) asynchronously, yielding each ExecutionReport as soon as it
+        is available (including the reports of deduplicated submissions). Reports are neither cached nor stored in
+        the tester.
+        """
+        run = await asyncio.to_thread(self._start_run, start, limit, None, jobs)
+        try:
+            self._resource_budget = self._create_resource_budget(jobs, None)
+            async for submission, report in self._run_pending_async(run.pending, jobs):
+                await asyncio.to_thread(self._record_report, run, submission, report)
+                yield report
+                for duplicate in run.duplicates.get(submission.get_key(), []):
+                    yield run.reports[duplicate.get_key()]
+        finally:
+            await asyncio.shield(asyncio.to_thread(self._finish_run, run, False))
+
+    async def run_submission_tests_async(self, submission: Submission) -> ExecutionReport:
+        logger.info(f"Testing {submission}")
+
+        try:
+            sub_test = self._create_tester(submission)
+            if self._resource_budget is not None:
+                resources = self._reserved_resources(submission, sub_test.get_resources())
+                async with self._resource_budget.reserve_async(resources["cpus"], resources["memory"]):
+                    report = await sub_test.run_async()
+            else:
+                report = await sub_test.run_async()
+            report.submission = submission
+        except Exception as e:
+            logger.error(e)
+            report = ExecutionReport(return_code=-1, results_path=None, success=False, stderr=str(e), stdout='',
+                                     timeout=False)
+
+        return report
+
+    async def _run_pending_async(self, pending: list[Submission], jobs: int = 4):
+        semaphore = asyncio.Semaphore(max(jobs or 1, 1))
+
+        async def run_bounded(submission: Submission):
+            async with semaphore:
+                return submission, await self.run_submission_tests_async(submission)
+
+        tasks = [asyncio.create_task(run_bounded(submission)) for submission in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run_tests_distributed(self, queue_path: str, start: int = 0, limit: int = None, cache_file: str = None,
+                              local_workers: int = 0, lease_seconds: float = 600, poll_interval: float = 1.0,
+                              timeout: Optional[float] = None):
+        """
+        Run the tests of the submissions in the range [start, limit) on workers that share a folder (see WorkQueue).
+
+        This process acts as coordinator: it queues the submissions that are not cached, collects the reports
+        published by the workers and keeps them as run_tests does. Workers are started on any host with access to the
+        queue and to the submissions with run_queue_worker (or "python -m teaching_utils.teaching_lib.code_tester
+        QUEUE_PATH"). Jobs of workers that stop renewing their lease are queued again.
+
+        Args:
+            queue_path (str): Shared folder of the work queue.
+            start (int): Index of the first submission to test.
+            limit (int): Index of the first submission not to be tested. None to test until the end.
+            cache_file (str): Optional report store, as in run_tests.
+            local_workers (int): Number of worker processes started on this host.
+            lease_seconds (float): Time without renewal after which a job is given to another worker.
+            poll_interval (float): Seconds between checks of the queue.
+            timeout (float): Maximum seconds waiting for the reports. None to wait until all are available.
+        """
+        # The queue is consumed in parallel, so the jobs are scheduled as in parallel runs. The tests are executed by
+        # the workers, which create their own run resources.
+        run = self._start_run(start, limit, cache_file, jobs=max(local_workers, 2), run_resources=False)
+        queue = WorkQueue(queue_path, lease_seconds)
+        run_id = uuid.uuid4().hex
+        workers = []
+        try:
+            queue.create({
+                'run_id': run_id,
+                'coordinator': socket.gethostname(),
+                'tester_class': f"{self._tester_class.__module__}.{self._tester_class.__qualname__}",
+                'options': self._options,
+                'lease_seconds': lease_seconds,
+            })
+            jobs = {}
+            for index, submission in enumerate(run.pending):
+                job_id = WorkQueue.job_id(index, submission.get_key())
+                queue.put(job_id, {'run_id': run_id, 'submission': submission})
+                jobs[job_id] = submission
+            logger.info(f"Queued {len(jobs)} submissions on {queue_path}")
+
+            context = multiprocessing.get_context("spawn")
+            for i in range(local_workers):
+                worker = context.Process(target=run_queue_worker, args=(queue_path,),
+                                         kwargs={'worker_id': f"{socket.gethostname()}_{i}",
+                                                 'poll_interval': poll_interval})
+                worker.start()
+                workers.append(worker)
+
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while jobs:
+                for job_id in queue.result_ids():
+                    submission = jobs.pop(job_id, None)
+                    if submission is None:
+                        continue
+                    report = queue.get_result(job_id)
+                    queue.discard(job_id)
+                    report.submission = submission
+                    self._record_report(run, submission, report)
+                if not jobs:
+                    break
+                queue.heartbeat()
+                queue.requeue_expired()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{len(jobs)} submissions not finished after {timeout}s: {queue.count()}")
+                time.sleep(poll_interval)
+        finally:
+            if os.path.isdir(queue_path):
+                queue.close()
+            for worker in workers:
+                worker.join(timeout=poll_interval * 10)
+                if worker.is_alive():
+                    worker.terminate()
+            self._finish_run(run)
+
+    def _start_run(self, start: int, limit: Optional[int], cache_file: Optional[str], jobs: int = 1,
+                   executor: Optional[Executor] = None, run_resources: bool = True) -> "_TestRun":
+        """
+        Prepare a test run: open the report store, create the run resources and find the submissions to be tested.
+        The resources used to execute the tests (container pool and cleanup, analysis threads and artifact proxy) are
+        not created when run_resources is False, as when the tests are executed by the workers of a distributed run.
+        """
+        run = _TestRun()
+        if cache_file is not None:
+            logger.info(f"Using cached results from {cache_file}")
+            run.store = ReportStore(cache_file)
+        try:
+            cached_keys = run.store.keys() if run.store is not None else set()
+            run.profiles = run.store.get_profiles() if run.store is not None else {}
+            if self._options is None or self._options.get("resource_profiles", True):
+                self._resource_profiles = run.profiles
+            # Image digests and folder hashes are resolved again in each run, as images may be rebuilt meanwhile
+            self._fingerprint_memo = {}
+            if run_resources:
+                if self._options is not None:
+                    self._container_lifecycle = ContainerLifecycleManager()
+                    if self._options.get("reap_orphan_containers", True):
+                        ContainerLifecycleManager.reap_orphans()
+                self._container_pool = self._create_container_pool(jobs, executor)
+                self._analysis_executor = self._create_analysis_executor(jobs, executor)
+                self._artifact_proxy = self._create_artifact_proxy()
+            run.selected = self._select_submissions(start, limit)
+            deduplicate = self._options is None or self._options.get("deduplicate_submissions", True)
+            primaries: dict[str, Submission] = {}
+            for submission in run.selected:
+                fingerprint = self.get_submission_fingerprint(submission)
+                run.fingerprints[submission.get_key()] = fingerprint
+                report = run.store.get(fingerprint) if fingerprint in cached_keys else None
+                if report is None and run.store is not None and fingerprint is not None:
+                    report = run.store.get_legacy(submission.get_key())
+                    if report is not None:
+                        # Reports of legacy caches were reused by submission key, regardless of the content
+                        logger.info(f"Using the legacy cached result of submission {submission.get_key()}")
+                        run.store.adopt_legacy(submission.get_key(), fingerprint, report)
+                if report is not None:
+                    logger.info(f"Found cached result for submission {submission.get_key()}")
+                    report = report.clone()
+                    report.submission = submission
+                    run.reports[submission.get_key()] = report
+                    logger.info("Submission %s: %s", submission.get_key(), str(report))
+                elif deduplicate and fingerprint is not None and fingerprint in primaries:
+                    # Identical content and configuration: reuse the report of the first submission
+                    primary = primaries[fingerprint]
+                    logger.info(f"Submission {submission.get_key()} is identical to {primary.get_key()}")
+                    run.duplicates.setdefault(primary.get_key(), []).append(submission)
+                else:
+                    if fingerprint is not None:
+                        primaries[fingerprint] = submission
+                    run.pending.append(submission)
+            if run.duplicates:
+                logger.info(f"Deduplicated {sum(len(d) for d in run.duplicates.values())} submissions")
+            parallel = executor is not None or (jobs is not None and jobs > 1)
+            if parallel and len(run.pending) > 1 and (self._options is None or
+                                                      self._options.get("schedule_longest_first", True)):
+                run.pending = self._schedule_longest_first(run)
+        except BaseException:
+            self._finish_run(run, keep_reports=False)
+            raise
+        return run
+
+    def _schedule_longest_first(self, run: "_TestRun") -> list[Submission]:
+        """
+        Order the pending submissions by expected duration, longest first, so slow submissions do not start at the
+        end of a parallel run. The expected duration is the one of the previous run (from the report store), or is
+        estimated from the size of the submission, scaled with the durations of the known submissions. Submissions
+        killed for lack of memory stopped early, so they are expected to last as the slowest known submission.
+        """
+        history = {key: profile['seconds'] for key, profile in run.profiles.items() if profile['seconds'] is not None}
+        slowest = max(history.values(), default=0.0)
+        sizes = {}
+        for submission in run.pending:
+            path = submission.get_local_path()
+            sizes[submission.get_key()] = sum(entry.size for entry in FileIndex(path).files()) if os.path.isdir(path) else 0
+
+        known = [key for key in sizes if key in history]
+        known_size = sum(sizes[key] for key in known)
+        seconds_per_byte = sum(history[key] for key in known) / known_size if known_size > 0 else None
+
+        estimates = {}
+        for key, size in sizes.items():
+            if run.profiles.get(key, {}).get('oom_killed'):
+                estimates[key] = (max(history.get(key, 0.0), slowest), 'oom')
+            elif key in history:
+                estimates[key] = (history[key], 'history')
+            elif seconds_per_byte is not None:
+                estimates[key] = (size * seconds_per_byte, 'size')
             else:
-                report = self.run_submission_tests(submission)
-                cache[submission.get_key()] = report
-                if cache_file is not None:
-                    with open(cache_file, "wb") as f:
-                        pickle.dump(cache, f)
+                # Without history, only the order matters: use the size as the estimate
+                estimates[key] = (float(size), 'size')
+
+        scheduled = sorted(run.pending, key=lambda submission: estimates[submission.get_key()][0], reverse=True)
+        logger.info(f"Scheduling {len(scheduled)} submissions longest first ({len(known)} with duration history)")
+        for submission in scheduled:
+            estimate, source = estimates[submission.get_key()]
+            unit = 'bytes' if source == 'size' and seconds_per_byte is None else 's'
+            logger.debug(f"Scheduled {submission.get_key()}: expected {estimate:.2f} {unit} ({source})")
+        return scheduled
+
+    def _record_report(self, run: "_TestRun", submission: Submission, report: ExecutionReport):
+        fingerprint = run.fingerprints[submission.get_key()]
+        report.metadata['fingerprint'] = fingerprint
+        run.reports[submission.get_key()] = report
+        duplicates = run.duplicates.get(submission.get_key(), [])
+        if duplicates:
+            report.metadata['deduplication'] = {
+                'source': submission.get_key(),
+                'submissions': [submission.get_key()] + [duplicate.get_key() for duplicate in duplicates],
+            }
+        if run.store is not None and fingerprint is not None:
+            run.store.put(fingerprint, report)
+        duration = report.metadata.get('timings', {}).get('total')
+        if run.store is not None and duration is not None:
+            run.store.put_duration(submission.get_key(), duration, report.metadata.get('resources'))
+        logger.info("Submission %s: %s", submission.get_key(), str(report))
+
+        for duplicate in duplicates:
+            duplicate_report = report.clone()
+            duplicate_report.submission = duplicate
+            run.reports[duplicate.get_key()] = duplicate_report
+            logger.info("Submission %s (deduplicated): %s", duplicate.get_key(), str(duplicate_report))
+
+    def _finish_run(self, run: "_TestRun", keep_reports: bool = True):
+        if self._container_pool is not None:
+            self._container_pool.close()
+            self._container_pool = None
+        if self._container_lifecycle is not None:
+            self._container_lifecycle.cleanup()
+            self._container_lifecycle = None
+        if self._analysis_executor is not None:
+            self._analysis_executor.shutdown(wait=False, cancel_futures=True)
+            self._analysis_executor = None
+        if self._artifact_proxy is not None:
+            self._artifact_proxy.stop()
+            self._artifact_proxy_stats = self._artifact_proxy.stats()
+            self._artifact_proxy = None
+        self._resource_budget = None
+        self._resource_profiles = {}
+        self._fingerprint_memo = None
+        if run.store is not None:
+            run.store.close()
+
+        if keep_reports:
+            # Keep the reports in submission order, regardless of the order they finished
+            self._reports = {}
+            for submission in run.selected:
+                if submission.get_key() in run.reports:
+                    self._reports[submission.get_key()] = run.reports[submission.get_key()]
+
+    def get_timing_summary(self, num_slowest: int = 10) -> dict:
+        """
+        Aggregate the phase timings of the reports.
 
-            self._reports[submission.get_key()] = report
-            logger.info("Submission %s: %s", submission.get_key(), str(report))
+        Args:
+            num_slowest (int): Number of slowest submissions to include.
 
+        Returns:
+            dict: Statistics (count, total, mean, p50, p95 and max seconds) for each phase, and the slowest
+                submissions with their phase timings.
+        """
+        phases: dict[str, list[float]] = {}
+        totals = []
+        for key, report in self._reports.items():
+            timings = report.metadata.get('timings')
+            if not timings:
+                continue
+            for phase, seconds in timings.items():
+                phases.setdefault(phase, []).append(seconds)
+            totals.append((timings.get('total', 0.0), key, timings))
+
+        summary = {'phases': {}, 'slowest': []}
+        for phase, values in phases.items():
+            summary['phases'][phase] = {
+                'count': len(values),
+                'total': round(sum(values), 3),
+                'mean': round(sum(values) / len(values), 3),
+                'p50': round(_percentile(values, 50), 3),
+                'p95': round(_percentile(values, 95), 3),
+                'max': round(max(values), 3),
+            }
+        for total, key, timings in sorted(totals, key=lambda item: item[0], reverse=True)[:num_slowest]:
+            summary['slowest'].append({
+                'submission': key,
+                'total': round(total, 3),
+                'timings': {phase: round(seconds, 3) for phase, seconds in timings.items()},
+            })
+        return summary
+
+    def get_resource_summary(self, num_top: int = 10) -> dict:
+        """
+        Aggregate the resource usage of the containers of the reports.
+
+        Args:
+            num_top (int): Number of submissions with the highest CPU time and peak memory to include.
+
+        Returns:
+            dict: Statistics (count, total, mean, p50, p95 and max) of each usage value, the submissions killed for
+                lack of memory, and the submissions with the highest CPU time and peak memory.
+        """
+        values: dict[str, list[float]] = {}
+        usages = []
+        oom_killed = []
+        for key, report in self._reports.items():
+            resources = report.metadata.get('resources')
+            if not resources:
+                continue
+            for name in RESOURCE_SUMMARY_KEYS:
+                if resources.get(name) is not None:
+                    values.setdefault(name, []).append(resources[name])
+            usages.append((key, resources))
+            if resources.get('oom_killed'):
+                oom_killed.append(key)
+
+        summary = {'usage': {}, 'oom_killed': oom_killed, 'top_cpu': [], 'top_memory': []}
+        for name, name_values in values.items():
+            summary['usage'][name] = {
+                'count': len(name_values),
+                'total': round(sum(name_values), 3),
+                'mean': round(sum(name_values) / len(name_values), 3),
+                'p50': round(_percentile(name_values, 50), 3),
+                'p95': round(_percentile(name_values, 95), 3),
+                'max': round(max(name_values), 3),
+            }
+        for top, name in (('top_cpu', 'cpu_seconds'), ('top_memory', 'peak_memory_bytes')):
+            ranked = sorted(usages, key=lambda item: item[1].get(name) or 0, reverse=True)[:num_top]
+            summary[top] = [{'submission': key, name: resources.get(name)} for key, resources in ranked]
+        return summary
+
+    def get_analysis_cache_stats(self) -> dict:
+        """
+        Analysis cache hits and misses of the reports.
+        """
+        stats = {'hits': 0, 'misses': 0}
+        for report in self._reports.values():
+            cache = report.metadata.get('analysis', {}).get('cache') or {}
+            for key in stats:
+                stats[key] += cache.get(key, 0)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total > 0 else None
+        return stats
+
+    def get_artifact_proxy_stats(self) -> Optional[dict]:
+        """
+        Requests served by the artifact proxy in the last run, or None if it was not used.
+        """
+        if self._artifact_proxy is not None:
+            return self._artifact_proxy.stats()
+        return self._artifact_proxy_stats
+
+    def get_build_cache_stats(self) -> dict:
+        """
+        Build cache hits, misses and merged files of the reports, by kind of cache. The hit rate is None for caches
+        that do not report their hits.
+        """
+        stats = {}
+        for report in self._reports.values():
+            for kind, cache in (report.metadata.get('build_cache') or {}).items():
+                totals = stats.setdefault(kind, {'jobs': 0, 'hits': None, 'misses': 0, 'merged_files': 0,
+                                                 'merged_bytes': 0})
+                totals['jobs'] += 1
+                if cache.get('hits') is not None:
+                    totals['hits'] = (totals['hits'] or 0) + cache['hits']
+                for key in ('misses', 'merged_files', 'merged_bytes'):
+                    totals[key] += cache.get(key) or 0
+        for totals in stats.values():
+            total = (totals['hits'] or 0) + totals['misses']
+            totals['hit_rate'] = totals['hits'] / total if totals['hits'] is not None and total > 0 else None
+        return stats
+
+    def export_timings(self, out_file: str, override=False, num_slowest: int = 10):
+        if os.path.exists(out_file) and not override:
+            raise FileExistsError(f"Output file {out_file} already exists. Use override=True to overwrite.")
+        if os.path.dirname(out_file):
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        with open(out_file, 'w') as fout:
+            json.dump(self.get_timing_summary(num_slowest), fout, indent=4)
 
     def export_results(self, out_file: str, remove_groups: list[str] = None, format: str = 'csv', override=False):
         if os.path.exists(out_file) and not override:
@@ -963,3 +2505,75 @@ class CodeActivityTester:
             feedback.append(f"Code Analysis: {report.analysis}")
         return "\n".join(feedback).replace("\"", "'")
 
+
+def run_queue_worker(queue_path: str, worker_id: Optional[str] = None, max_jobs: Optional[int] = None,
+                     poll_interval: float = 1.0, idle_timeout: Optional[float] = None) -> int:
+    """
+    Consume the jobs of a work queue created by CodeActivityTester.run_tests_distributed, publishing a report for
+    each one. The worker stops when the queue is closed.
+
+    Args:
+        queue_path (str): Shared folder of the work queue.
+        worker_id (str): Name of the worker, used in the logs.
+        max_jobs (int): Maximum number of jobs to run. None for no limit.
+        poll_interval (float): Seconds between checks of the queue when there are no pending jobs.
+        idle_timeout (float): Stop after these seconds without jobs. None to wait until the queue is closed.
+
+    Returns:
+        int: Number of jobs run.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}_{os.getpid()}"
+    queue = WorkQueue(queue_path)
+    done = 0
+    tester = run = run_id = None
+    idle_since = time.monotonic()
+
+    def start_run(manifest: dict):
+        nonlocal tester, run, run_id
+        if tester is not None:
+            tester._finish_run(run, keep_reports=False)
+        queue.lease_seconds = manifest['lease_seconds']
+        tester = CodeActivityTester(SubmissionSet(), manifest['tester_class'], manifest['options'])
+        # Resources of this worker (container pool and cleanup, analysis threads and artifact proxy), kept while the
+        # queue is consumed. Jobs are run one at a time.
+        run = tester._start_run(0, None, None)
+        run_id = manifest['run_id']
+
+    try:
+        while max_jobs is None or done < max_jobs:
+            manifest = queue.load_manifest() if tester is None else None
+            if manifest is not None:
+                start_run(manifest)
+
+            claimed = queue.claim() if tester is not None else None
+            if claimed is None:
+                if queue.closed or (idle_timeout is not None and time.monotonic() - idle_since > idle_timeout):
+                    break
+                queue.requeue_expired()
+                time.sleep(poll_interval)
+                continue
+
+            job_id, job = claimed
+            if job.get('run_id') != run_id:
+                # The queue was created again by another run
+                manifest = queue.load_manifest()
+                if manifest is None or manifest['run_id'] != job.get('run_id'):
+                    continue
+                start_run(manifest)
+            logger.info(f"Worker {worker_id} running job {job_id}")
+            with queue.lease(job_id):
+                report = tester.run_submission_tests(job['submission'])
+            report.metadata['worker'] = worker_id
+            queue.complete(job_id, report)
+            done += 1
+            idle_since = time.monotonic()
+    finally:
+        if tester is not None:
+            tester._finish_run(run, keep_reports=False)
+    return done
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    run_queue_worker(sys.argv[1])
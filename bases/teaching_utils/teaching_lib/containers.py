@@ -0,0 +1,402 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import shlex
+import shutil
+import socket
+import subprocess
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MANAGED_LABEL = "teaching_utils.managed"
+HOST_LABEL = "teaching_utils.host"
+PID_LABEL = "teaching_utils.pid"
+RUN_LABEL = "teaching_utils.run"
+# Writable folders emptied when a pooled container is reset ($HOME is expanded in the container)
+POOL_SCRATCH_PATHS = ("/tmp", "/var/tmp", "/dev/shm", "$HOME")
+# Idle process of the pooled containers. As PID 1, it also reaps the processes killed on reset.
+POOL_IDLE_CMD = ["bash", "-c", "while :; do sleep 3600 & wait $!; done"]
+
+
+def label_args(labels: Optional[dict]) -> list[str]:
+    """
+    Docker command line arguments to set the given labels.
+    """
+    args = []
+    for key, value in (labels or {}).items():
+        args.extend(["--label", f"{key}={value}"])
+    return args
+
+
+def remove_container(name: str, timeout: int = 60) -> bool:
+    """
+    Kill and remove a container. Returns True if the container was removed.
+    """
+    try:
+        result = subprocess.run(["docker", "rm", "-f", name], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                timeout=timeout, text=True)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.error(f"Cannot remove container {name}: {e}")
+        return False
+    return result.returncode == 0
+
+
+def inspect_container_state(name: str, timeout: int = 60) -> Optional[dict]:
+    """
+    State of a container ("Status", "ExitCode", "OOMKilled", ...), or None if it can not be inspected.
+    """
+    try:
+        result = subprocess.run(["docker", "inspect", "--format", "{{json .State}}", name], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, timeout=timeout, text=True)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Cannot inspect container {name}: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+class ContainerLifecycleManager:
+    def __init__(self, run_id: Optional[str] = None):
+        """
+        Keep track of the containers started during a grading run, so they can be stopped and removed on timeouts,
+        errors and at the end of the run.
+
+        Containers are labelled with the run, host and process that started them. This allows removing orphan
+        containers left by runs that crashed or were killed (see reap_orphans).
+
+        Args:
+            run_id (str): Identifier of the run. A random one is used by default.
+        """
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._containers: set[str] = set()
+
+    def __getstate__(self):
+        # Managers are copied to worker processes, which track their own containers
+        return {'run_id': self.run_id}
+
+    def __setstate__(self, state):
+        self.__init__(state['run_id'])
+
+    @property
+    def labels(self) -> dict:
+        return {
+            MANAGED_LABEL: "true",
+            HOST_LABEL: socket.gethostname(),
+            PID_LABEL: str(os.getpid()),
+            RUN_LABEL: self.run_id,
+        }
+
+    def register(self, name: str):
+        with self._lock:
+            self._containers.add(name)
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._containers.discard(name)
+
+    def stop(self, name: str) -> bool:
+        """
+        Kill and remove a container of this run.
+        """
+        logger.info(f"Stopping container {name}")
+        removed = remove_container(name)
+        self.unregister(name)
+        return removed
+
+    def cleanup(self):
+        """
+        Remove all the containers of this run that are still registered.
+        """
+        with self._lock:
+            containers = list(self._containers)
+        for name in containers:
+            self.stop(name)
+
+    @staticmethod
+    def reap_orphans() -> list[str]:
+        """
+        Remove managed containers started on this host by processes that are no longer running.
+
+        Returns:
+            list[str]: Names of the removed containers.
+        """
+        try:
+            result = subprocess.run(
+                ["docker", "ps", "-a", "--filter", f"label={MANAGED_LABEL}=true", "--format",
+                 f'{{{{.Names}}}}\t{{{{.Label "{HOST_LABEL}"}}}}\t{{{{.Label "{PID_LABEL}"}}}}'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=60,
+                text=True
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"Cannot list containers to reap orphans: {e}")
+            return []
+        if result.returncode != 0:
+            logger.warning(f"Cannot list containers to reap orphans: {result.stderr.strip()}")
+            return []
+
+        hostname = socket.gethostname()
+        reaped = []
+        for line in result.stdout.splitlines():
+            parts = line.split('\t')
+            if len(parts) != 3 or parts[1] != hostname or not parts[2].isdigit():
+                continue
+            if _is_process_alive(int(parts[2])):
+                continue
+            logger.warning(f"Removing orphan container {parts[0]}")
+            if remove_container(parts[0]):
+                reaped.append(parts[0])
+        return reaped
+
+
+class PooledContainer:
+    def __init__(self, name: str, host_path: str, container_mount: str):
+        """
+        Long-lived container owned by a ContainerPool.
+
+        Args:
+            name (str): Name of the Docker container.
+            host_path (str): Host workspace of the container. Its "code" folder is mounted on container_mount.
+            container_mount (str): Path where the code is mounted inside the container.
+        """
+        self.name = name
+        self.host_path = host_path
+        self.container_mount = container_mount
+        self.healthy = True
+        self.jobs = 0
+        self.key = None
+
+
+class ContainerPool:
+    def __init__(self, size: int = 1, workspace_basepath: str = "/tmp", container_mount: str = "/mnt/code",
+                 pull_policy: Optional[str] = None, name_prefix: str = "tu_pool_", reset_timeout: int = 120,
+                 labels: Optional[dict] = None):
+        """
+        Pool of warm containers reused across submissions.
+
+        Containers are started on demand (at most `size` per image, mounts and run arguments) and kept alive with an
+        idle process. Submissions are executed with "docker exec", so the container start-up cost is paid once per
+        worker instead of once per submission. Before a container is given to the next job, all the processes of the
+        previous one are killed and the workspace and scratch folders (POOL_SCRATCH_PATHS) are emptied, keeping the
+        mounted volumes. Containers that cannot be reset are removed.
+
+        Args:
+            size (int): Maximum number of containers for each image, mounts and run arguments.
+            workspace_basepath (str): Host folder where container workspaces are created.
+            container_mount (str): Path where the workspace code folder is mounted inside the containers.
+            pull_policy (str): Docker pull policy used when starting containers.
+            name_prefix (str): Prefix for the container names.
+            reset_timeout (int): Timeout in seconds to reset a workspace.
+            labels (dict): Labels added to the containers (see ContainerLifecycleManager).
+        """
+        self.size = size
+        self.workspace_basepath = workspace_basepath
+        self.container_mount = container_mount
+        self.pull_policy = pull_policy
+        self.name_prefix = name_prefix
+        self.reset_timeout = reset_timeout
+        self.labels = labels
+        self._pool_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._idle: dict[tuple, queue.Queue] = {}
+        self._count: dict[tuple, int] = {}
+        self._containers: dict[str, PooledContainer] = {}
+        self._closed = False
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def acquire(self, image: str, mounts: Optional[list[str]] = None, run_args: Optional[list[str]] = None):
+        """
+        Get a container for the given image, extra mounts and run arguments, blocking until one is available.
+        The container is released at the end of the context.
+
+        Args:
+            image (str): Docker image of the container.
+            mounts (list[str]): Additional volume specifications ("host:container[:options]").
+            run_args (list[str]): Additional "docker run" arguments (e.g. resource limits).
+
+        Yields:
+            PooledContainer: Container with an empty workspace. Set healthy to False if it should not be reused.
+        """
+        container = self.get(image, mounts, run_args)
+        try:
+            yield container
+        finally:
+            self.release(container)
+
+    def get(self, image: str, mounts: Optional[list[str]] = None, run_args: Optional[list[str]] = None) -> PooledContainer:
+        """
+        Get a container, blocking until one is available. It must be given back with release. See acquire.
+        """
+        key = (image, tuple(mounts or []), tuple(run_args or []))
+        container = self._get_container(key)
+        container.key = key
+        return container
+
+    def release(self, container: PooledContainer):
+        """
+        Give back a container. Its workspace is reset, or it is removed if it is not healthy.
+        """
+        key = container.key
+        container.jobs += 1
+        if container.healthy and not self._closed and self._reset(container):
+            self._idle[key].put(container)
+        else:
+            self._remove(container)
+            with self._lock:
+                self._count[key] -= 1
+                # Let a waiting job start a new container
+                self._idle[key].put(None)
+
+    def _get_container(self, key: tuple) -> PooledContainer:
+        if self._closed:
+            raise RuntimeError("Container pool is closed")
+        with self._lock:
+            idle = self._idle.setdefault(key, queue.Queue())
+            can_start = idle.empty() and self._count.get(key, 0) < self.size
+            if can_start:
+                self._count[key] = self._count.get(key, 0) + 1
+        if can_start:
+            try:
+                return self._start_container(*key)
+            except Exception:
+                with self._lock:
+                    self._count[key] -= 1
+                raise
+
+        container = idle.get()
+        if container is None:
+            # A container was removed, so there is room to start a new one
+            return self._get_container(key)
+        return container
+
+    def _start_container(self, image: str, mounts: tuple, run_args: tuple) -> PooledContainer:
+        name = f"{self.name_prefix}{self._pool_id}_{next(self._sequence)}"
+        host_path = os.path.abspath(os.path.join(self.workspace_basepath, name))
+        os.makedirs(os.path.join(host_path, "code"), exist_ok=True)
+
+        docker_cmd = [
+            "docker", "run", "-d", "--name", name,
+            "-v", f"{os.path.join(host_path, 'code')}:{self.container_mount}",
+        ]
+        docker_cmd.extend(label_args(self.labels))
+        docker_cmd.extend(run_args)
+        if self.pull_policy is not None:
+            docker_cmd.extend(["--pull", self.pull_policy])
+        for mount in mounts:
+            docker_cmd.extend(["-v", mount])
+        docker_cmd.extend([image, *POOL_IDLE_CMD])
+
+        logger.debug(f"Starting pooled container {name}")
+        result = subprocess.run(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            shutil.rmtree(host_path, ignore_errors=True)
+            raise RuntimeError(f"Cannot start pooled container {name}: {result.stderr.strip()}")
+
+        container = PooledContainer(name, host_path, self.container_mount)
+        with self._lock:
+            self._containers[name] = container
+        return container
+
+    def exec_cmd(self, container: PooledContainer, work_path: str, cmd: str,
+                 environment: Optional[dict] = None) -> list[str]:
+        """
+        Build the command to run a shell command inside a pooled container.
+        """
+        env_args = []
+        for name, value in (environment or {}).items():
+            env_args.extend(["-e", f"{name}={value}"])
+        return ["docker", "exec", "-w", work_path, *env_args, container.name, "bash", "-c", cmd]
+
+    def _reset_script(self, container: PooledContainer) -> str:
+        """
+        Shell script that kills the processes left by a job and removes its files, keeping the mounted volumes.
+        """
+        mount_points = [self.container_mount]
+        for mount in (container.key[1] if container.key is not None else ()):
+            parts = mount.split(':')
+            if len(parts) > 1:
+                mount_points.append(parts[1].rstrip('/'))
+        keep = []
+        for mount_point in mount_points:
+            keep.extend(["!", "-path", mount_point, "!", "-path", f"{mount_point}/*"])
+            parent = os.path.dirname(mount_point)
+            while parent not in ("/", ""):
+                keep.extend(["!", "-path", parent])
+                parent = os.path.dirname(parent)
+        keep_args = " ".join(shlex.quote(arg) for arg in keep)
+        scratch_paths = " ".join(f'"{path}"' for path in POOL_SCRATCH_PATHS)
+        # kill -1 signals every process but PID 1 and the shell itself
+        return (
+            f"kill -9 -1 2>/dev/null; "
+            f"find {shlex.quote(self.container_mount)} -mindepth 1 -delete || exit 1; "
+            f"for dir in {scratch_paths}; do "
+            f"case \"$dir\" in /|'') continue;; esac; "
+            f"[ -d \"$dir\" ] || continue; "
+            f"find \"$dir\" -xdev -mindepth 1 {keep_args} -delete || exit 1; "
+            f"done"
+        )
+
+    def _reset(self, container: PooledContainer) -> bool:
+        # Run as root in the container, as processes and files may belong to any user
+        try:
+            result = subprocess.run(
+                ["docker", "exec", "-u", "0", container.name, "bash", "-c", self._reset_script(container)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=self.reset_timeout,
+                text=True
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Timeout resetting pooled container {container.name}")
+            return False
+        if result.returncode != 0:
+            logger.warning(f"Cannot reset pooled container {container.name}: {result.stderr.strip()}")
+            return False
+        return True
+
+    def _remove(self, container: PooledContainer):
+        logger.debug(f"Removing pooled container {container.name}")
+        remove_container(container.name)
+        shutil.rmtree(container.host_path, ignore_errors=True)
+        with self._lock:
+            self._containers.pop(container.name, None)
+
+    def close(self):
+        """
+        Remove all the containers of the pool.
+        """
+        self._closed = True
+        with self._lock:
+            containers = list(self._containers.values())
+        for container in containers:
+            self._remove(container)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
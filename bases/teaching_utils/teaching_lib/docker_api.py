@@ -0,0 +1,247 @@
+import http.client
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+
+# Requests that can be sent again when the connection is lost before the response, as they may have been processed
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+# Seconds before checking again a socket where the API was not available
+UNAVAILABLE_RETRY_SECONDS = 30
+
+# Stream identifiers of the multiplexed log frames
+STDOUT_STREAM = 1
+STDERR_STREAM = 2
+
+
+class DockerAPIError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        """
+        HTTP connection over a unix socket.
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerClient:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, api_version: str = API_VERSION, timeout: float = 60):
+        """
+        Minimal client of the Docker Engine API over the local unix socket.
+
+        Short requests reuse a persistent connection (one per thread, as connections can not be shared), and
+        long-lived requests (wait, logs and stats streams) use their own connections.
+
+        Args:
+            socket_path (str): Path of the Docker daemon socket.
+            api_version (str): Version prefix of the API paths.
+            timeout (float): Timeout in seconds of the short requests.
+        """
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _url(self, path: str, params: Optional[dict] = None) -> str:
+        url = f"/{self.api_version}{path}"
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        return url
+
+    def _connection(self) -> UnixHTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        elif connection.sock is not None and select.select([connection.sock], [], [], 0)[0]:
+            # An idle connection is only readable if the daemon closed it: reconnect before sending the request
+            connection.close()
+        return connection
+
+    @staticmethod
+    def _send(connection: UnixHTTPConnection, method: str, url: str, body: Optional[dict]):
+        headers = {"Host": "docker"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers["Content-Type"] = "application/json"
+        connection.request(method, url, body=data, headers=headers)
+        return connection.getresponse()
+
+    @staticmethod
+    def _check(response: http.client.HTTPResponse, data: bytes):
+        if response.status >= 400:
+            try:
+                message = json.loads(data).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', errors='replace')
+            raise DockerAPIError(response.status, message)
+
+    def _request(self, method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None):
+        """
+        Send a short request on the persistent connection of this thread and return the decoded JSON response.
+        """
+        url = self._url(path, params)
+        connection = self._connection()
+        try:
+            response = self._send(connection, method, url, body)
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # The connection was lost: retry once on a new one, unless the request may have been processed
+            connection.close()
+            if method not in IDEMPOTENT_METHODS:
+                raise
+            response = self._send(connection, method, url, body)
+        data = response.read()
+        self._check(response, data)
+        return json.loads(data) if data else None
+
+    def _stream(self, method: str, path: str, params: Optional[dict] = None, body: Optional[dict] = None,
+                timeout: Optional[float] = None) -> tuple[UnixHTTPConnection, http.client.HTTPResponse]:
+        """
+        Send a long-lived request on a new connection. The caller must close the connection.
+        """
+        connection = UnixHTTPConnection(self.socket_path, timeout)
+        try:
+            response = self._send(connection, method, self._url(path, params), body)
+            if response.status >= 400:
+                self._check(response, response.read())
+        except BaseException:
+            connection.close()
+            raise
+        return connection, response
+
+    def ping(self) -> bool:
+        try:
+            connection, response = self._stream("GET", "/_ping", timeout=self.timeout)
+        except (OSError, http.client.HTTPException, DockerAPIError):
+            return False
+        connection.close()
+        return response.status == 200
+
+    def pull_image(self, image: str):
+        name, tag = image, "latest"
+        if ':' in image.rsplit('/', 1)[-1]:
+            name, tag = image.rsplit(':', 1)
+        connection, response = self._stream("POST", "/images/create", {"fromImage": name, "tag": tag})
+        try:
+            # Progress messages, until the pull finishes
+            for line in response:
+                message = json.loads(line)
+                if 'error' in message:
+                    raise DockerAPIError(500, message['error'])
+        finally:
+            connection.close()
+
+    def create_container(self, name: str, config: dict) -> str:
+        return self._request("POST", "/containers/create", {"name": name}, config)['Id']
+
+    def start_container(self, container_id: str):
+        self._request("POST", f"/containers/{container_id}/start")
+
+    def wait_container(self, container_id: str, timeout: Optional[float] = None) -> int:
+        """
+        Wait until a container stops and return its exit code. Raises TimeoutError after timeout seconds.
+        """
+        try:
+            connection, response = self._stream("POST", f"/containers/{container_id}/wait", timeout=timeout)
+            try:
+                result = json.loads(response.read())
+            finally:
+                connection.close()
+        except socket.timeout as e:
+            raise TimeoutError(f"Container {container_id} did not finish in {timeout}s") from e
+        return result['StatusCode']
+
+    def kill_container(self, container_id: str):
+        self._request("POST", f"/containers/{container_id}/kill")
+
+    def remove_container(self, container_id: str, force: bool = True):
+        self._request("DELETE", f"/containers/{container_id}", {"force": "1" if force else "0", "v": "1"})
+
+    def inspect_container(self, container_id: str) -> dict:
+        return self._request("GET", f"/containers/{container_id}/json")
+
+    def logs(self, container_id: str, follow: bool = True) -> Iterator[tuple[int, bytes]]:
+        """
+        Stream the output of a container (created without TTY), demultiplexed.
+
+        Yields:
+            tuple[int, bytes]: Stream identifier (STDOUT_STREAM or STDERR_STREAM) and data.
+        """
+        connection, response = self._stream("GET", f"/containers/{container_id}/logs",
+                                             {"follow": int(follow), "stdout": 1, "stderr": 1})
+        try:
+            while True:
+                header = response.read(8)
+                if len(header) < 8:
+                    return
+                stream, size = struct.unpack('>BxxxL', header)
+                yield stream, response.read(size)
+        finally:
+            connection.close()
+
+    def stats(self, container_id: str) -> Iterator[dict]:
+        """
+        Stream the resource usage samples of a container (about one per second) until it stops.
+        """
+        connection, response = self._stream("GET", f"/containers/{container_id}/stats", {"stream": 1})
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+
+_CLIENTS: dict[str, DockerClient] = {}
+# Time (monotonic) when the API was found not available on each socket
+_UNAVAILABLE: dict[str, float] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_docker_client(socket_path: Optional[str] = None) -> Optional[DockerClient]:
+    """
+    Client shared by all the testers of this process, or None if the Docker API is not reachable on the socket.
+    Unreachable sockets are checked again after UNAVAILABLE_RETRY_SECONDS, so a daemon started later is used.
+    """
+    socket_path = socket_path or DEFAULT_SOCKET
+    with _CLIENTS_LOCK:
+        if socket_path in _CLIENTS:
+            return _CLIENTS[socket_path]
+        failed = _UNAVAILABLE.get(socket_path)
+        if failed is not None and time.monotonic() - failed < UNAVAILABLE_RETRY_SECONDS:
+            return None
+        client = DockerClient(socket_path)
+        if not os.path.exists(socket_path) or not client.ping():
+            logger.warning(f"Docker API not available on {socket_path}")
+            _UNAVAILABLE[socket_path] = time.monotonic()
+            return None
+        _UNAVAILABLE.pop(socket_path, None)
+        _CLIENTS[socket_path] = client
+        return client
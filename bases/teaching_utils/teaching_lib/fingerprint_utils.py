@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_data(value: Any) -> str:
+    """
+    Compute a stable hash for a JSON serializable value. Dictionary keys are sorted, and values that cannot be
+    serialized are converted to strings.
+    """
+    data = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def hash_file(file_path: str, digest=None):
+    """
+    Update the given digest (or a new sha256 digest) with the content of a file, reading it in chunks.
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+def hash_tree(path: Optional[str]) -> Optional[str]:
+    """
+    Compute a content hash of a file or a folder. The hash depends on the relative paths and the content of all the
+    files, but not on the location of the tree or the file timestamps, so two identical submissions have the same hash.
+
+    Args:
+        path (str): File or folder to hash.
+
+    Returns:
+        str: Hexadecimal sha256 digest, or None if path is None or does not exist.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        return hash_file(path, digest).hexdigest()
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            rel_path = os.path.relpath(file_path, path).replace(os.sep, '/')
+            digest.update(rel_path.encode('utf-8', errors='surrogateescape'))
+            digest.update(b'\0')
+            try:
+                hash_file(file_path, digest)
+            except OSError as e:
+                logger.warning(f"Could not hash {file_path}: {e}")
+                digest.update(b'<unreadable>')
+            digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def get_image_digest(image: Optional[str]) -> Optional[str]:
+    """
+    Get the identifier of a local Docker image, which changes every time the image is rebuilt or pulled. It is not
+    cached, so callers resolve it once per run.
+
+    Returns:
+        str: The image id, or None if the image is not available locally or Docker cannot be executed.
+    """
+    if image is None:
+        return None
+    try:
+        result = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=30,
+            text=True
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not inspect docker image {image}: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
@@ -0,0 +1,208 @@
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+from typing import Callable, Optional
+
+from .fingerprint_utils import get_image_digest, hash_data, hash_tree
+from .staging import stage_tree
+
+logger = logging.getLogger(__name__)
+
+GRADER_IMAGE_REPOSITORY = "teaching-utils/grader"
+# Folder of the Dockerfile of the C base image in the repository (not available in installed packages)
+GCC_GTEST_CONTEXT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "resources", "docker",
+                                                 "gcc-gtest"))
+DEFAULT_BASE_IMAGES = {
+    "c": "xbaro/gcc-gtest:latest",
+    "java": "maven:latest",
+}
+# Maven goals of the Java tests, also run on the scaffold to resolve their plugins
+MAVEN_TEST_GOALS = (
+    "clean org.jacoco:jacoco-maven-plugin:0.8.13:prepare-agent test org.jacoco:jacoco-maven-plugin:0.8.13:report "
+    "checkstyle:checkstyle"
+)
+
+# Read-only build caches of the grader images, by kind of tester and of build cache (see build_cache.CACHE_KINDS)
+IMAGE_BUILD_CACHES = {
+    "c": {"ccache": ["/opt/grader/ccache"]},
+    "java": {"maven": ["/opt/grader/m2"]},
+}
+
+# The warm-up builds the scaffold as the tests build the submissions: the code staged by the tester (see
+# RunSubmissionTest.stage_grader_scaffold) is built in the working directory under the code mount, with the scaffold
+# on the data mount, so the compiler cache entries of the test harness match. They are written to a flat file
+# storage, which the containers read as read-only remote storage (ccache 4.8+), as the "ccache" build cache.
+C_DOCKERFILE = """FROM {base_image}
+
+RUN apt-get update && \\
+    apt-get install -y --no-install-recommends ccache && \\
+    apt-get clean && rm -rf /var/lib/apt/lists/*
+
+ENV CCACHE_DIR=/root/.ccache \\
+    CCACHE_REMOTE_STORAGE="file:/opt/grader/ccache|read-only|layout=flat" \\
+    CCACHE_BASEDIR={container_mount} \\
+    CCACHE_NOHASHDIR=1 \\
+    CCACHE_SLOPPINESS=include_file_mtime,include_file_ctime,time_macros \\
+    CMAKE_C_COMPILER_LAUNCHER=ccache \\
+    CMAKE_CXX_COMPILER_LAUNCHER=ccache
+
+COPY scaffold /opt/grader/scaffold
+COPY code /opt/grader/code
+
+RUN export CCACHE_REMOTE_STORAGE="file:/opt/grader/ccache|layout=flat" CCACHE_REMOTE_ONLY=true && \\
+    mkdir -p {container_mount} {data_mount} /opt/grader/ccache && \\
+    cp -r /opt/grader/code/. {container_mount}/ && cp -r /opt/grader/scaffold/. {data_mount}/ && \\
+    cd {work_path} && mkdir -p build && cd build && \\
+    {{ cmake .. && make -k -j"$(nproc)" || {{ echo "The scaffold does not build" >&2; {on_error}; }}; }} && \\
+    cd / && rm -rf {container_mount} {data_mount} /opt/grader/code && chmod -R a+rX /opt/grader/ccache
+"""
+
+# Dependencies are resolved into a read-only tail repository, so the mounted local repository stays usable
+JAVA_DOCKERFILE = """FROM {base_image}
+
+COPY scaffold /opt/grader/scaffold
+COPY code /opt/grader/code
+
+RUN mkdir -p {container_mount} {data_mount} && \\
+    cp -r /opt/grader/code/. {container_mount}/ && cp -r /opt/grader/scaffold/. {data_mount}/ && \\
+    cd {work_path} && \\
+    {{ {{ mvn -B -q -Dmaven.repo.local=/opt/grader/m2 dependency:go-offline && \\
+         mvn -B -q -Dmaven.repo.local=/opt/grader/m2 -Dmaven.test.failure.ignore=true {goals}; }} || \\
+       {{ echo "The scaffold does not build" >&2; {on_error}; }}; }} && \\
+    cd / && rm -rf {container_mount} {data_mount} /opt/grader/code
+
+ENV MAVEN_OPTS="-Dmaven.repo.local.tail=/opt/grader/m2"
+"""
+
+DOCKERFILES = {
+    "c": C_DOCKERFILE,
+    "java": JAVA_DOCKERFILE,
+}
+
+
+def grader_image_dockerfile(kind: str, base_image: str, work_path: str = "/mnt/code",
+                            container_mount: str = "/mnt/code", data_mount: str = "/mnt/data",
+                            strict: bool = True) -> str:
+    """
+    Dockerfile of a grader image. The build context has the scaffold ("scaffold") and the scaffold staged by the tester
+    ("code"), which is built in work_path.
+    """
+    if kind not in DOCKERFILES:
+        raise ValueError(f"Grader images are not available for {kind} testers")
+    return DOCKERFILES[kind].format(base_image=base_image, goals=MAVEN_TEST_GOALS, work_path=work_path,
+                                    container_mount=container_mount, data_mount=data_mount,
+                                    on_error="exit 1" if strict else "true")
+
+
+def grader_image_tag(dockerfile: str, base_image: str, data_path: str,
+                     repository: str = GRADER_IMAGE_REPOSITORY) -> str:
+    """
+    Tag of a grader image. It depends on the Dockerfile, the base image and the content of the scaffold, so any change
+    gives a new image.
+    """
+    content_hash = hash_data({
+        "dockerfile": dockerfile,
+        "base_image": base_image,
+        "base_image_digest": get_image_digest(base_image),
+        "scaffold": hash_tree(data_path),
+    })
+    return f"{repository}:{content_hash[:16]}"
+
+
+def _image_exists(image: str) -> bool:
+    return get_image_digest(image) is not None
+
+
+def _docker_build(tag: str, context_path: str, timeout: Optional[float]):
+    logger.info(f"Building image {tag} from {context_path}")
+    result = subprocess.run(["docker", "build", "-t", tag, context_path], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"Cannot build image {tag}: {result.stdout[-2000:]}")
+
+
+def build_grader_image(assignment_config: dict, kind: str, base_context: Optional[str] = None,
+                       repository: str = GRADER_IMAGE_REPOSITORY, force: bool = False,
+                       timeout: Optional[float] = 3600,
+                       stage_scaffold: Optional[Callable[[str], Optional[str]]] = None,
+                       strict_warmup: bool = True) -> dict:
+    """
+    Build an assignment specific grader image: the tester image with the scaffold (from the "data_path" option)
+    baked in and its build warmed up, so the tests of every submission start from a warm image.
+
+    - "c": ccache is installed and used as compiler launcher, and the scaffold is built, so the test harness objects
+      are compiler cache hits. The "ccache" build cache can be enabled with the "build_cache_kinds" option.
+    - "java": the dependencies and plugins of the scaffold are resolved into a repository used as Maven tail
+      repository.
+
+    The scaffold is staged and built as the tester does with the submissions (see stage_scaffold), and the image
+    build fails if the warm-up fails, unless strict_warmup is False.
+
+    The caches of the image are read-only, and the build caches of the testers read them after their shared cache
+    (the "image_build_caches" option).
+
+    Args:
+        assignment_config (dict): Tester options. The base image is the "grader_base_image" option (set when the
+            options already use a grader image), the "image" option, or the default of the kind.
+        kind (str): Kind of tester ("c" or "java"), see RunSubmissionTest.GRADER_IMAGE_KIND.
+        base_context (str): Folder used to build the base image if it is not available. For the default "c" base
+            image, the gcc-gtest Dockerfile folder of the repository, if found.
+        repository (str): Repository of the image tag.
+        force (bool): Build the image even if it already exists.
+        timeout (float): Timeout in seconds of each docker build.
+        stage_scaffold (Callable): Stages the scaffold into the "code" folder of the given folder as the code of a
+            submission, and returns the working directory of the tests relative to it (None for its root). See
+            RunSubmissionTest.stage_grader_scaffold. By default, the scaffold is copied as is.
+        strict_warmup (bool): Fail if the scaffold does not build. Set to False for scaffolds that only build with the
+            code of the submissions: the parts that build are still cached.
+
+    Returns:
+        dict: Options to update the tester options with, to use the image.
+    """
+    data_path = assignment_config.get("data_path")
+    if data_path is None or not os.path.isdir(data_path):
+        raise ValueError("Grader images require the scaffold folder in the data_path option")
+    base_image = (assignment_config.get("grader_base_image") or assignment_config.get("image") or
+                  DEFAULT_BASE_IMAGES.get(kind))
+    if kind not in DOCKERFILES:
+        raise ValueError(f"Grader images are not available for {kind} testers")
+    container_mount = assignment_config.get("container_mount", "/mnt/code")
+    data_mount = assignment_config.get("data_mount", "/mnt/data")
+
+    if base_context is None and base_image == DEFAULT_BASE_IMAGES["c"] and os.path.isdir(GCC_GTEST_CONTEXT):
+        base_context = GCC_GTEST_CONTEXT
+    if base_context is not None and not _image_exists(base_image):
+        _docker_build(base_image, base_context, timeout)
+
+    context_path = tempfile.mkdtemp(prefix="grader_image_")
+    try:
+        stage_tree(data_path, os.path.join(context_path, "scaffold"), 'auto')
+        work_dir = None
+        if stage_scaffold is not None:
+            work_dir = stage_scaffold(context_path)
+        else:
+            stage_tree(data_path, os.path.join(context_path, "code"), 'auto')
+        work_path = container_mount
+        if work_dir is not None and work_dir != '.':
+            work_path = posixpath.join(container_mount, work_dir.replace(os.sep, '/'))
+        dockerfile = grader_image_dockerfile(kind, base_image, work_path, container_mount, data_mount, strict_warmup)
+
+        tag = grader_image_tag(dockerfile, base_image, data_path, repository)
+        if force or not _image_exists(tag):
+            with open(os.path.join(context_path, "Dockerfile"), 'w') as f:
+                f.write(dockerfile)
+            _docker_build(tag, context_path, timeout)
+        else:
+            logger.info(f"Using existing grader image {tag}")
+    finally:
+        shutil.rmtree(context_path, ignore_errors=True)
+
+    return {
+        "image": tag,
+        "docker_pull_policy": "never",
+        "image_build_caches": IMAGE_BUILD_CACHES[kind],
+        "grader_base_image": base_image,
+    }
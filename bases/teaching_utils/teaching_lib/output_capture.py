@@ -0,0 +1,131 @@
+import collections
+import logging
+import os
+import threading
+from typing import IO, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BoundedOutput:
+    def __init__(self, log_file: Optional[str] = None, max_log_bytes: Optional[int] = None,
+                 head_bytes: int = 10000, tail_bytes: int = 10000):
+        """
+        Capture a process output stream with bounded memory and disk usage.
+
+        The output is streamed to a log file (up to max_log_bytes), and only the first head_bytes and the last
+        tail_bytes are kept in memory to build an excerpt for the reports.
+
+        Args:
+            log_file (str): File where the output is written. None to keep only the excerpt.
+            max_log_bytes (int): Maximum number of bytes written to the log file. None for no limit.
+            head_bytes (int): Number of bytes kept from the beginning of the output.
+            tail_bytes (int): Number of bytes kept from the end of the output.
+        """
+        self.log_file = log_file
+        self.max_log_bytes = max_log_bytes
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total_bytes = 0
+        self.log_bytes = 0
+        self._head = bytearray()
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self._thread: Optional[threading.Thread] = None
+        self._fout = None
+        self._stopped = False
+        if log_file is not None:
+            if os.path.dirname(log_file):
+                os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            self._fout = open(log_file, 'wb')
+
+    def feed(self, chunk: bytes):
+        if not chunk or self._stopped:
+            return
+        self.total_bytes += len(chunk)
+
+        if self._fout is not None:
+            allowed = len(chunk) if self.max_log_bytes is None else max(self.max_log_bytes - self.log_bytes, 0)
+            if allowed > 0:
+                try:
+                    self._fout.write(chunk[:allowed])
+                    self.log_bytes += min(allowed, len(chunk))
+                except ValueError:
+                    # The log was closed while the stream was still being captured
+                    pass
+
+        if len(self._head) < self.head_bytes:
+            self._head.extend(chunk[:self.head_bytes - len(self._head)])
+
+        self._tail.append(chunk[-self.tail_bytes:] if self.tail_bytes > 0 else b'')
+        self._tail_size += len(self._tail[-1])
+        while self._tail and self._tail_size - len(self._tail[0]) >= self.tail_bytes:
+            self._tail_size -= len(self._tail.popleft())
+
+    def drain(self, stream: IO[bytes]):
+        """
+        Read a binary stream until its end.
+        """
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            self.feed(chunk)
+
+    async def drain_async(self, stream):
+        """
+        Read an asyncio stream until its end.
+        """
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.feed(chunk)
+
+    def start(self, stream: IO[bytes]) -> threading.Thread:
+        """
+        Drain a stream in a background thread.
+        """
+        self._thread = threading.Thread(target=self.drain, args=(stream,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def close(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # The stream is still open (e.g. inherited by an orphan process). Stop capturing it.
+                logger.warning(f"Output stream still open after {timeout}s, capture stopped")
+                self._stopped = True
+        if self._fout is not None:
+            self._fout.close()
+            self._fout = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > self.head_bytes + self.tail_bytes
+
+    def excerpt(self) -> str:
+        """
+        Output text, with the middle part omitted if it exceeds the head and tail limits.
+        """
+        tail = b''.join(self._tail)
+        if not self.truncated:
+            data = bytes(self._head) + tail[len(tail) - (self.total_bytes - len(self._head)):]
+            return data.decode('utf-8', errors='replace')
+
+        omitted = self.total_bytes - len(self._head) - self.tail_bytes
+        marker = f"\n\n[... {omitted} bytes omitted"
+        if self.log_file is not None:
+            marker += f", full output in {self.log_file}"
+        marker += " ...]\n\n"
+        return (bytes(self._head).decode('utf-8', errors='replace') + marker +
+                tail[-self.tail_bytes:].decode('utf-8', errors='replace'))
+
+    def info(self) -> dict:
+        return {
+            'log_file': self.log_file,
+            'total_bytes': self.total_bytes,
+            'log_bytes': self.log_bytes,
+            'log_truncated': self.log_bytes < self.total_bytes,
+            'excerpt_truncated': self.truncated,
+        }
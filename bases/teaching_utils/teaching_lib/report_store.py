@@ -0,0 +1,210 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .test_utils import ExecutionReport
+
+logger = logging.getLogger(__name__)
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+# Resource usage saved with the durations, and their column types
+PROFILE_COLUMNS = {
+    'cpu_seconds': 'REAL',
+    'peak_memory_bytes': 'INTEGER',
+    'io_read_bytes': 'INTEGER',
+    'io_write_bytes': 'INTEGER',
+    'oom_killed': 'INTEGER',
+}
+
+
+class ReportStore:
+    def __init__(self, path: str):
+        """
+        Crash-safe store of execution reports backed by SQLite.
+
+        Each report is written as an independent record as soon as it is available, so an interrupted run keeps all
+        the finished reports and can be resumed. Reports are only loaded when requested.
+
+        Args:
+            path (str): Path to the database file. A legacy pickle cache found on this path is imported: its reports
+                are kept by submission key (see get_legacy) until they are adopted with a fingerprint.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        legacy_cache = self._take_legacy_cache(path)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                "  fingerprint TEXT PRIMARY KEY,"
+                "  submission_key TEXT,"
+                "  created REAL,"
+                "  report BLOB"
+                ")"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS durations ("
+                "  submission_key TEXT PRIMARY KEY,"
+                "  seconds REAL,"
+                "  updated REAL"
+                ")"
+            )
+            # Reports of legacy pickle caches, which were keyed by submission
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS legacy_reports ("
+                "  submission_key TEXT PRIMARY KEY,"
+                "  report BLOB"
+                ")"
+            )
+            # Resource usage columns, added to stores created before they existed
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(durations)")}
+            for column, column_type in PROFILE_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE durations ADD COLUMN {column} {column_type}")
+
+        if legacy_cache:
+            logger.info(f"Importing {len(legacy_cache)} reports from legacy cache {path}")
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO legacy_reports (submission_key, report) VALUES (?, ?)",
+                    [(key, pickle.dumps(report)) for key, report in legacy_cache.items()]
+                )
+
+    @staticmethod
+    def _take_legacy_cache(path: str) -> Optional[dict]:
+        """
+        Load a pickle cache written by older versions, and move it away so the database can be created on its path.
+        """
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as f:
+            if f.read(len(SQLITE_HEADER)) == SQLITE_HEADER:
+                return None
+        try:
+            with open(path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            raise ValueError(f"File {path} is neither a report store nor a legacy cache: {e}")
+        os.replace(path, path + '.legacy')
+        logger.warning(f"Legacy cache moved to {path}.legacy")
+        return cache if isinstance(cache, dict) else None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def keys(self) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT fingerprint FROM reports").fetchall()
+        return {row[0] for row in rows}
+
+    def __contains__(self, fingerprint: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM reports WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def get(self, fingerprint: str) -> Optional[ExecutionReport]:
+        with self._lock:
+            row = self._conn.execute("SELECT report FROM reports WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Discarding unreadable report {fingerprint}: {e}")
+            return None
+
+    def put(self, fingerprint: str, report: ExecutionReport):
+        submission_key = report.submission.get_key() if getattr(report, 'submission', None) is not None else None
+        data = pickle.dumps(report)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (fingerprint, submission_key, created, report) VALUES (?, ?, ?, ?)",
+                (fingerprint, submission_key, time.time(), data)
+            )
+
+    def remove(self, fingerprint: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM reports WHERE fingerprint = ?", (fingerprint,))
+
+    def get_legacy(self, submission_key: str) -> Optional[ExecutionReport]:
+        """
+        Report of a submission imported from a legacy pickle cache, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT report FROM legacy_reports WHERE submission_key = ?",
+                                     (submission_key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Discarding unreadable legacy report {submission_key}: {e}")
+            return None
+
+    def adopt_legacy(self, submission_key: str, fingerprint: str, report: ExecutionReport):
+        """
+        Store a legacy report with the fingerprint of its submission, so the next runs find it as any other report.
+        """
+        self.put(fingerprint, report)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM legacy_reports WHERE submission_key = ?", (submission_key,))
+
+    def put_duration(self, submission_key: str, seconds: float, resources: Optional[dict] = None):
+        """
+        Save the last test duration and resource usage (the "resources" metadata of the report) of a submission,
+        used to schedule the next runs.
+        """
+        resources = resources or {}
+        values = [resources.get(column) for column in PROFILE_COLUMNS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO durations (submission_key, seconds, updated, {', '.join(PROFILE_COLUMNS)}) "
+                f"VALUES (?, ?, ?{', ?' * len(PROFILE_COLUMNS)})",
+                (submission_key, seconds, time.time(), *values)
+            )
+
+    def get_durations(self) -> dict[str, float]:
+        with self._lock:
+            rows = self._conn.execute("SELECT submission_key, seconds FROM durations").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def get_profiles(self) -> dict[str, dict]:
+        """
+        Last duration and resource usage of each submission. Usage values are None if they were not collected.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT submission_key, seconds, {', '.join(PROFILE_COLUMNS)} FROM durations"
+            ).fetchall()
+        profiles = {}
+        for row in rows:
+            profile = {'seconds': row[1]}
+            profile.update(zip(PROFILE_COLUMNS, row[2:]))
+            if profile['oom_killed'] is not None:
+                profile['oom_killed'] = bool(profile['oom_killed'])
+            profiles[row[0]] = profile
+        return profiles
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
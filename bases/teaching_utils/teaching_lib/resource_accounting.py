@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Exit code of a process killed with SIGKILL, as the kernel OOM killer does
+SIGKILL_EXIT_CODE = 137
+
+
+def find_container_cgroup(container_id: str, cgroup_root: str = CGROUP_ROOT) -> Optional[str]:
+    """
+    Path of the cgroup (v2) of a Docker container, for the systemd and cgroupfs drivers.
+    """
+    for path in (os.path.join(cgroup_root, "system.slice", f"docker-{container_id}.scope"),
+                 os.path.join(cgroup_root, "docker", container_id)):
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def _read_keyed(path: str) -> dict[str, int]:
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1].isdigit():
+                    values[parts[0]] = int(parts[1])
+    except OSError:
+        pass
+    return values
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, 'r') as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def read_cgroup_usage(cgroup_path: str) -> Optional[dict]:
+    """
+    Resource usage of a cgroup v2: CPU time, peak memory, I/O bytes, processes and OOM kills. None if it can not be
+    read.
+    """
+    cpu = _read_keyed(os.path.join(cgroup_path, "cpu.stat"))
+    if 'usage_usec' not in cpu:
+        return None
+    peak = _read_int(os.path.join(cgroup_path, "memory.peak"))
+    if peak is None:
+        # Kernels before 5.19 do not have memory.peak
+        peak = _read_int(os.path.join(cgroup_path, "memory.current"))
+
+    io_read = io_write = 0
+    try:
+        with open(os.path.join(cgroup_path, "io.stat"), 'r') as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        io_read += int(value)
+                    elif key == 'wbytes':
+                        io_write += int(value)
+    except (OSError, ValueError):
+        pass
+
+    pids = _read_int(os.path.join(cgroup_path, "pids.peak"))
+    if pids is None:
+        pids = _read_int(os.path.join(cgroup_path, "pids.current"))
+    events = _read_keyed(os.path.join(cgroup_path, "memory.events"))
+    return {
+        'cpu_seconds': cpu['usage_usec'] / 1e6,
+        'peak_memory_bytes': peak,
+        'io_read_bytes': io_read,
+        'io_write_bytes': io_write,
+        'max_pids': pids,
+        'oom_killed': events.get('oom_kill', 0) > 0,
+    }
+
+
+def usage_from_api_stats(sample: dict) -> Optional[dict]:
+    """
+    Resource usage from a Docker Engine API stats sample, with the same keys as read_cgroup_usage. None for the empty
+    samples of stopped containers.
+    """
+    memory_stats = sample.get('memory_stats') or {}
+    cpu = (sample.get('cpu_stats') or {}).get('cpu_usage', {}).get('total_usage')
+    memory = memory_stats.get('max_usage') or memory_stats.get('usage')
+    if not cpu and not memory:
+        return None
+    io_read = io_write = 0
+    for entry in (sample.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+        if entry.get('op', '').lower() == 'read':
+            io_read += entry.get('value', 0)
+        elif entry.get('op', '').lower() == 'write':
+            io_write += entry.get('value', 0)
+    return {
+        'cpu_seconds': (cpu or 0) / 1e9,
+        'peak_memory_bytes': memory,
+        'io_read_bytes': io_read,
+        'io_write_bytes': io_write,
+        'max_pids': (sample.get('pids_stats') or {}).get('current'),
+        'oom_killed': False,
+    }
+
+
+class ResourceUsage:
+    def __init__(self, source: str, memory_limit: Optional[int] = None):
+        """
+        Accumulate the resource usage samples of a container. Counters only grow, so every value keeps its maximum.
+
+        Args:
+            source (str): Origin of the samples ("cgroup" or "api").
+            memory_limit (int): Memory limit of the container, used to detect OOM kills when the cgroup can not tell.
+        """
+        self.source = source
+        self.memory_limit = memory_limit
+        self.samples = 0
+        self.oom_killed = False
+        self._usage: dict = {}
+        self._lock = threading.Lock()
+
+    def add(self, usage: Optional[dict]):
+        if usage is None:
+            return
+        with self._lock:
+            self.samples += 1
+            for key, value in usage.items():
+                if key != 'oom_killed' and value is not None:
+                    self._usage[key] = max(self._usage.get(key, 0), value)
+            self.oom_killed = self.oom_killed or usage.get('oom_killed', False)
+
+    def result(self, return_code: Optional[int] = None) -> Optional[dict]:
+        """
+        Usage of the container, or None if there are no samples (and it is not known to be killed for lack of
+        memory).
+        """
+        with self._lock:
+            if self.samples == 0 and not self.oom_killed:
+                return None
+            result = dict(self._usage)
+            oom_killed = self.oom_killed
+        if not oom_killed and return_code == SIGKILL_EXIT_CODE and self.memory_limit:
+            # The last samples may be lost when the container is removed: killed near the limit means OOM
+            oom_killed = (result.get('peak_memory_bytes') or 0) >= 0.95 * self.memory_limit
+        result['oom_killed'] = oom_killed
+        result['samples'] = self.samples
+        result['source'] = self.source
+        return result
+
+
+class CgroupSampler:
+    # Seconds between checks of the cidfile, shorter than the interval so short containers are not missed
+    DISCOVERY_INTERVAL = 0.02
+
+    def __init__(self, cidfile: str, memory_limit: Optional[int] = None, interval: float = 0.5,
+                 cgroup_root: str = CGROUP_ROOT):
+        """
+        Sample the cgroup of a container started with "docker run --cidfile" until stopped. A last sample is taken
+        when stopped, so containers that are not removed yet (started without "--rm") report their final usage.
+
+        Args:
+            cidfile (str): File where Docker writes the container id.
+            memory_limit (int): Memory limit of the container (see ResourceUsage).
+            interval (float): Seconds between samples.
+            cgroup_root (str): Mount point of the cgroup v2 hierarchy.
+        """
+        self.cidfile = cidfile
+        self.interval = interval
+        self.cgroup_root = cgroup_root
+        self.usage = ResourceUsage("cgroup", memory_limit)
+        self._cgroup_path: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _find_cgroup(self) -> Optional[str]:
+        if self._cgroup_path is None:
+            container_id = None
+            try:
+                with open(self.cidfile, 'r') as f:
+                    container_id = f.read().strip()
+            except OSError:
+                pass
+            if container_id:
+                self._cgroup_path = find_container_cgroup(container_id, self.cgroup_root)
+        return self._cgroup_path
+
+    def _run(self):
+        while not self._stop.is_set():
+            cgroup_path = self._find_cgroup()
+            if cgroup_path is not None:
+                self.usage.add(read_cgroup_usage(cgroup_path))
+            self._stop.wait(self.interval if cgroup_path is not None else min(self.DISCOVERY_INTERVAL, self.interval))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        cgroup_path = self._find_cgroup()
+        if cgroup_path is not None:
+            self.usage.add(read_cgroup_usage(cgroup_path))
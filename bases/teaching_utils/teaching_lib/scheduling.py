@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_memory(value: Union[str, int, float, None]) -> Optional[int]:
+    """
+    Convert a Docker style memory size ("512m", "2g", 1073741824) to bytes.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)i?b?\s*', str(value).lower())
+    if match is None:
+        raise ValueError(f"Invalid memory size: {value}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def system_capacity() -> dict:
+    """
+    CPUs and physical memory (bytes) of this machine. Memory is None if it can not be determined.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        memory = None
+    return {'cpus': cpus, 'memory': memory}
+
+
+class ResourceBudget:
+    def __init__(self, cpus: Optional[float] = None, memory: Union[str, int, None] = None):
+        """
+        Shared CPU and memory budget for the jobs running concurrently.
+
+        Each job reserves the resources it declares before starting, and waits until they are available, so the
+        running jobs never exceed the capacity. Requests larger than the capacity are reduced to the capacity.
+
+        Args:
+            cpus (float): Available CPUs. Defaults to the CPUs of this machine.
+            memory (str | int): Available memory. Defaults to the physical memory of this machine.
+        """
+        capacity = system_capacity()
+        self.cpus = float(cpus) if cpus is not None else float(capacity['cpus'])
+        self.memory = parse_memory(memory) if memory is not None else capacity['memory']
+        self._used_cpus = 0.0
+        self._used_memory = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, cpus: float, memory: int) -> bool:
+        if self._used_cpus > 0 and self._used_cpus + cpus > self.cpus:
+            return False
+        if self.memory is not None and self._used_memory > 0 and self._used_memory + memory > self.memory:
+            return False
+        return True
+
+    def _request(self, cpus: Optional[float], memory: Union[str, int, None]) -> tuple[float, int]:
+        cpus = min(float(cpus) if cpus is not None else 1.0, self.cpus)
+        memory = parse_memory(memory) or 0
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return cpus, memory
+
+    def _acquire(self, cpus: float, memory: int):
+        with self._condition:
+            if not self._fits(cpus, memory):
+                logger.debug(f"Waiting for resources: {cpus} CPUs, {memory} bytes")
+            self._condition.wait_for(lambda: self._fits(cpus, memory))
+            self._used_cpus += cpus
+            self._used_memory += memory
+
+    def _release(self, cpus: float, memory: int):
+        with self._condition:
+            self._used_cpus -= cpus
+            self._used_memory -= memory
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, cpus: Optional[float] = None, memory: Union[str, int, None] = None):
+        """
+        Reserve resources for a job, blocking until they are available.
+
+        Args:
+            cpus (float): CPUs used by the job. None counts as one CPU.
+            memory (str | int): Memory used by the job. None counts as no memory.
+        """
+        cpus, memory = self._request(cpus, memory)
+        self._acquire(cpus, memory)
+        try:
+            yield
+        finally:
+            self._release(cpus, memory)
+
+    @asynccontextmanager
+    async def reserve_async(self, cpus: Optional[float] = None, memory: Union[str, int, None] = None):
+        """
+        Asynchronous version of reserve: the wait runs in a worker thread, so the event loop is not blocked.
+        """
+        cpus, memory = self._request(cpus, memory)
+        acquire = asyncio.ensure_future(asyncio.to_thread(self._acquire, cpus, memory))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # The thread keeps waiting: give the resources back as soon as it gets them
+            acquire.add_done_callback(lambda _: self._release(cpus, memory))
+            raise
+        try:
+            yield
+        finally:
+            self._release(cpus, memory)
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        """
+        Space requests evenly so they do not exceed a rate.
+
+        Args:
+            rate (float): Maximum number of requests per second.
+        """
+        if rate <= 0:
+            raise ValueError(f"Invalid rate: {rate}")
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a new request can be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class EngineLimiter:
+    def __init__(self, concurrency: int = 1, rate_limit: Optional[float] = None):
+        """
+        Limit the requests sent to an analysis engine: at most `concurrency` requests at the same time, and at most
+        `rate_limit` requests per second.
+
+        Args:
+            concurrency (int): Maximum number of concurrent requests.
+            rate_limit (float): Maximum number of requests per second. None for no limit.
+        """
+        self.concurrency = max(int(concurrency), 1)
+        self.rate_limit = rate_limit
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    @contextmanager
+    def slot(self):
+        """
+        Wait for a free slot (and the rate limit) and keep it during the context.
+        """
+        with self._semaphore:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            yield
+
+
+_ENGINE_LIMITERS: dict[tuple, EngineLimiter] = {}
+_ENGINE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_engine_limiter(engine: str, concurrency: int = 1, rate_limit: Optional[float] = None) -> EngineLimiter:
+    """
+    Limiter shared by all the testers of this process that use the same engine and limits.
+    """
+    key = (engine, concurrency, rate_limit)
+    with _ENGINE_LIMITERS_LOCK:
+        if key not in _ENGINE_LIMITERS:
+            _ENGINE_LIMITERS[key] = EngineLimiter(concurrency, rate_limit)
+        return _ENGINE_LIMITERS[key]
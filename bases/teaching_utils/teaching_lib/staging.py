@@ -0,0 +1,250 @@
+import errno
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Linux ioctl to share the extents of a file (copy-on-write clone) on filesystems like Btrfs or XFS
+FICLONE = 0x40049409
+
+STAGING_MODES = ('copy', 'reflink', 'hardlink', 'auto')
+
+# Errors meaning that a link or clone is not possible between the given paths, so the file must be copied
+_FALLBACK_ERRORS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK,
+                    errno.ENOSYS}
+
+
+def reflink_file(src: str, dst: str):
+    """
+    Create dst as a copy-on-write clone of src. Raises OSError if the filesystem does not support it.
+    """
+    import fcntl
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def stage_file(src: str, dst: str, mode: str = 'copy', methods: list[str] = None) -> str:
+    """
+    Place a file on dst without duplicating its content when possible.
+
+    An existing dst is unlinked first, so a linked file is never written through.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination file.
+        mode (str): Staging mode. One of "copy", "reflink", "hardlink" or "auto" (reflink or copy).
+        methods (list[str]): Methods to try in order. Methods that fail are removed, so they are not retried for
+            the rest of the tree. Computed from mode if not given.
+
+    Returns:
+        str: The method used ("reflink", "hardlink" or "copy").
+    """
+    if methods is None:
+        methods = _staging_methods(mode)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    for method in list(methods):
+        try:
+            if method == 'reflink':
+                reflink_file(src, dst)
+            elif method == 'hardlink':
+                os.link(src, dst)
+            return method
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRORS:
+                raise
+            logger.debug(f"Staging method {method} not available for {dst}: {e}")
+            methods.remove(method)
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def _staging_methods(mode: str) -> list[str]:
+    if mode not in STAGING_MODES:
+        raise ValueError(f"Unknown staging mode: {mode}")
+    if mode == 'auto':
+        return ['reflink']
+    if mode == 'copy':
+        return []
+    return [mode]
+
+
+def _link_target(link: str, src_root: str) -> Optional[str]:
+    """
+    Target of a symbolic link relative to the folder of the link, or None if it is broken or resolves outside
+    src_root (the real path of the staged folder).
+    """
+    target = os.path.realpath(link)
+    if not os.path.exists(target) or os.path.commonpath([target, src_root]) != src_root:
+        return None
+    return os.path.relpath(target, os.path.realpath(os.path.dirname(link)))
+
+
+def _stage_link(link: str, dst: str, src_root: str) -> bool:
+    """
+    Recreate a symbolic link of the staged folder. Links that resolve outside it are skipped, so a submission can
+    not stage (or hardlink, and then modify) host files.
+    """
+    target = _link_target(link, src_root)
+    if target is None:
+        logger.warning(f"Skipping link {link}: it is broken or points outside the staged folder")
+        return False
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    elif os.path.lexists(dst):
+        os.unlink(dst)
+    os.symlink(target, dst)
+    return True
+
+
+def stage_tree(src: str, dst: str, mode: str = 'copy') -> dict[str, int]:
+    """
+    Stage a folder into dst, merging with any existing content (like shutil.copytree with dirs_exist_ok=True).
+
+    With "reflink" mode files are cloned (copy-on-write), so the staged copy is writable and uses no extra space.
+    With "hardlink" mode files share the inode with the source: it does not use extra space, but a command that
+    modifies a staged file in place also modifies the source. Files are copied when the requested method is not
+    available (e.g. different filesystems). Symbolic links are recreated as relative links when they point inside
+    src, and skipped otherwise.
+
+    Args:
+        src (str): Source folder.
+        dst (str): Destination folder.
+        mode (str): Staging mode. One of "copy", "reflink", "hardlink" or "auto" (reflink or copy).
+
+    Returns:
+        dict[str, int]: Number of files staged with each method, and number of links recreated ("symlink").
+    """
+    methods = _staging_methods(mode)
+    stats = {'reflink': 0, 'hardlink': 0, 'copy': 0, 'symlink': 0}
+    src_root = os.path.realpath(src)
+    os.makedirs(dst, exist_ok=True)
+    for root, dirs, files in os.walk(src):
+        dst_root = os.path.join(dst, os.path.relpath(root, src))
+        for folder in dirs:
+            src_folder = os.path.join(root, folder)
+            if os.path.islink(src_folder):
+                # Not followed by os.walk
+                stats['symlink'] += _stage_link(src_folder, os.path.join(dst_root, folder), src_root)
+            else:
+                os.makedirs(os.path.join(dst_root, folder), exist_ok=True)
+        for file in files:
+            src_file = os.path.join(root, file)
+            if os.path.islink(src_file):
+                stats['symlink'] += _stage_link(src_file, os.path.join(dst_root, file), src_root)
+                continue
+            method = stage_file(src_file, os.path.join(dst_root, file), mode, methods)
+            stats[method] += 1
+    shutil.copystat(src, dst)
+    return stats
+
+
+def detach_file(path: str):
+    """
+    Make sure that a staged file does not share its inode with other files, so it can be modified in place.
+    """
+    if not os.path.exists(path) or os.stat(path).st_nlink <= 1:
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.detach_')
+    os.close(fd)
+    try:
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class FileEntry(NamedTuple):
+    path: str
+    name: str
+    extension: str
+    size: int
+
+
+class FileIndex:
+    DEFAULT_IGNORE_DIRS = ('.git', 'node_modules', '__pycache__', '.idea')
+
+    def __init__(self, root: str, ignore_dirs: Optional[Iterable[str]] = DEFAULT_IGNORE_DIRS):
+        """
+        Index of the files in a folder, built with a single walk of the tree.
+
+        Files are kept in the same order os.walk would visit them, so lookups return the same results as a walk.
+
+        Args:
+            root (str): Folder to index.
+            ignore_dirs (Iterable[str]): Names of folders that are not indexed.
+        """
+        self.root = os.path.abspath(root)
+        self.ignore_dirs = set(ignore_dirs or [])
+        self._files: list[FileEntry] = []
+        self._by_name: dict[str, list[FileEntry]] = {}
+        self.refresh()
+
+    def refresh(self):
+        self._files = []
+        self._by_name = {}
+        self._scan(self.root)
+
+    def _scan(self, folder: str):
+        dirs = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink() and entry.name not in self.ignore_dirs:
+                                dirs.append(entry.path)
+                            continue
+                        size = entry.stat().st_size
+                    except OSError:
+                        size = 0
+                    file_entry = FileEntry(entry.path, entry.name, os.path.splitext(entry.name)[1].lower(), size)
+                    self._files.append(file_entry)
+                    self._by_name.setdefault(entry.name, []).append(file_entry)
+        except OSError as e:
+            logger.warning(f"Cannot index {folder}: {e}")
+        for sub_folder in dirs:
+            self._scan(sub_folder)
+
+    def covers(self, path: str) -> bool:
+        """
+        Check if a path is inside the indexed folder.
+        """
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(os.path.join(self.root, ''))
+
+    def _under(self, entries: list[FileEntry], base_path: Optional[str]) -> list[FileEntry]:
+        if base_path is None or os.path.abspath(base_path) == self.root:
+            return entries
+        prefix = os.path.join(os.path.abspath(base_path), '')
+        return [entry for entry in entries if entry.path.startswith(prefix)]
+
+    def find_all(self, filename: str, base_path: Optional[str] = None) -> list[str]:
+        return [entry.path for entry in self._under(self._by_name.get(filename, []), base_path)]
+
+    def find_first(self, filename: str, base_path: Optional[str] = None) -> Optional[str]:
+        paths = self.find_all(filename, base_path)
+        return paths[0] if paths else None
+
+    def files(self, base_path: Optional[str] = None, extensions: Optional[Iterable[str]] = None) -> list[FileEntry]:
+        """
+        Indexed files inside base_path (all by default), optionally filtered by the end of their names.
+        """
+        entries = self._under(self._files, base_path)
+        if extensions is not None:
+            extensions = tuple(extensions)
+            entries = [entry for entry in entries if entry.name.endswith(extensions)]
+        return entries
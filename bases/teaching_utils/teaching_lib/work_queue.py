@@ -0,0 +1,238 @@
+import logging
+import os
+import pickle
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.pkl"
+CLOSED_FILE = "closed"
+HEARTBEAT_FILE = "heartbeat"
+
+
+class WorkQueue:
+    def __init__(self, path: str, lease_seconds: float = 600):
+        """
+        Work queue stored as files on a shared folder (e.g. an NFS mount), so workers on several hosts can consume it.
+
+        Jobs are files that move between the "pending" and "claimed" folders with atomic renames, so each job is
+        claimed by a single worker. A claimed job is leased: the worker renews the lease (the modification time of the
+        claimed file) while it runs, and jobs whose lease expired (e.g. the worker host crashed) are moved back to
+        pending. Results are written to the "results" folder, also with atomic renames.
+
+        Ages are measured with the clock of the shared storage (see storage_time), not with the clocks of the hosts,
+        so clock skew between hosts does not expire leases early or keep them forever. The coordinator renews a
+        heartbeat file while the run is active, so a queue left by a crashed coordinator can be replaced.
+
+        Args:
+            path (str): Shared folder of the queue.
+            lease_seconds (float): Time without renewal after which a claimed job is given to another worker.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._pending = os.path.join(path, "pending")
+        self._claimed = os.path.join(path, "claimed")
+        self._results = os.path.join(path, "results")
+
+    @staticmethod
+    def job_id(index: int, key: str) -> str:
+        # The index keeps the order of the jobs when they are claimed
+        return f"{index:06d}_{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}"
+
+    def create(self, manifest: dict, force: bool = False):
+        """
+        Initialize the queue with the manifest of the run. A queue left by a previous run is removed if it is closed,
+        its coordinator stopped renewing the heartbeat for lease_seconds (e.g. it crashed), or force is True.
+        """
+        if os.path.exists(os.path.join(self.path, MANIFEST_FILE)):
+            if not (force or self.closed or self.stale):
+                raise RuntimeError(f"Work queue {self.path} is in use by another run")
+            if not self.closed:
+                previous = self.load_manifest() or {}
+                logger.warning(f"Replacing work queue {self.path} of run {previous.get('run_id')}: it was not closed")
+            shutil.rmtree(self.path)
+        for folder in (self._pending, self._claimed, self._results):
+            os.makedirs(folder, exist_ok=True)
+        self._write(os.path.join(self.path, MANIFEST_FILE), manifest)
+        self.heartbeat()
+
+    def storage_time(self) -> float:
+        """
+        Current time of the shared storage. Setting the modification time to "now" uses the clock of the file server
+        on network filesystems, as the renewals of the leases do.
+        """
+        probe_path = os.path.join(self.path, f".clock_{socket.gethostname()}_{os.getpid()}")
+        with open(probe_path, 'a'):
+            pass
+        os.utime(probe_path)
+        return os.stat(probe_path).st_mtime
+
+    def heartbeat(self):
+        """
+        Signal that the coordinator of the run is alive.
+        """
+        heartbeat_path = os.path.join(self.path, HEARTBEAT_FILE)
+        with open(heartbeat_path, 'a'):
+            pass
+        os.utime(heartbeat_path)
+
+    @property
+    def stale(self) -> bool:
+        """
+        Check if the coordinator stopped renewing the heartbeat for lease_seconds.
+        """
+        try:
+            heartbeat = os.stat(os.path.join(self.path, HEARTBEAT_FILE)).st_mtime
+        except FileNotFoundError:
+            # Queue of a version without heartbeat, or not fully created
+            heartbeat = os.stat(os.path.join(self.path, MANIFEST_FILE)).st_mtime
+        return self.storage_time() - heartbeat >= self.lease_seconds
+
+    def load_manifest(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path: str, value: Any):
+        # Written to a temporary file and renamed, so readers never see partial files
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp_{uuid.uuid4().hex}")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _names(folder: str) -> list[str]:
+        try:
+            return sorted(name for name in os.listdir(folder) if not name.startswith('.'))
+        except FileNotFoundError:
+            return []
+
+    def put(self, job_id: str, job: Any):
+        self._write(os.path.join(self._pending, job_id), job)
+
+    def claim(self) -> Optional[tuple[str, Any]]:
+        """
+        Claim the first pending job.
+
+        Returns:
+            tuple[str, Any]: The job identifier and the job, or None if there are no pending jobs.
+        """
+        for job_id in self._names(self._pending):
+            claimed_path = os.path.join(self._claimed, job_id)
+            try:
+                os.rename(os.path.join(self._pending, job_id), claimed_path)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            try:
+                # Renames keep the modification time, so the lease starts now
+                os.utime(claimed_path)
+                with open(claimed_path, 'rb') as f:
+                    return job_id, pickle.load(f)
+            except FileNotFoundError:
+                # Queued again before the lease was started
+                continue
+        return None
+
+    def renew(self, job_id: str) -> bool:
+        """
+        Renew the lease of a claimed job. Returns False if the job is no longer claimed (its lease expired).
+        """
+        try:
+            os.utime(os.path.join(self._claimed, job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def lease(self, job_id: str):
+        """
+        Keep renewing the lease of a claimed job during the context.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(job_id):
+                    logger.warning(f"Lease of job {job_id} lost")
+                    return
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, job_id: str, result: Any):
+        self._write(os.path.join(self._results, job_id), result)
+        try:
+            os.remove(os.path.join(self._claimed, job_id))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, job_id: str):
+        """
+        Remove a job that may have been queued again after its result was published.
+        """
+        for folder in (self._pending, self._claimed):
+            try:
+                os.remove(os.path.join(folder, job_id))
+            except FileNotFoundError:
+                pass
+
+    def requeue_expired(self) -> list[str]:
+        """
+        Move the claimed jobs whose lease expired back to pending.
+        """
+        requeued = []
+        now = self.storage_time()
+        for job_id in self._names(self._claimed):
+            claimed_path = os.path.join(self._claimed, job_id)
+            try:
+                if now - os.stat(claimed_path).st_mtime < self.lease_seconds:
+                    continue
+                os.rename(claimed_path, os.path.join(self._pending, job_id))
+            except FileNotFoundError:
+                continue
+            logger.warning(f"Lease of job {job_id} expired, queued again")
+            requeued.append(job_id)
+        return requeued
+
+    def result_ids(self) -> list[str]:
+        return self._names(self._results)
+
+    def get_result(self, job_id: str) -> Any:
+        with open(os.path.join(self._results, job_id), 'rb') as f:
+            return pickle.load(f)
+
+    def count(self) -> dict[str, int]:
+        return {
+            'pending': len(self._names(self._pending)),
+            'claimed': len(self._names(self._claimed)),
+            'results': len(self._names(self._results)),
+        }
+
+    def close(self):
+        """
+        Mark the queue as finished, so idle workers stop.
+        """
+        with open(os.path.join(self.path, CLOSED_FILE), 'w') as f:
+            f.write(f"{socket.gethostname()} {time.time()}\n")
+
+    @property
+    def closed(self) -> bool:
+        return os.path.exists(os.path.join(self.path, CLOSED_FILE))
@@ -0,0 +1,29 @@
+import time
+
+from teaching_utils.teaching_lib.analysis_cache import AnalysisCache, analysis_cache_key
+
+
+def test_cache_hits_and_misses(tmp_path):
+    key = analysis_cache_key('ollama', 'codellama', 'user', 'prompt', 0.5)
+    assert key != analysis_cache_key('ollama', 'codellama', 'user', 'prompt', 0.7)
+
+    with AnalysisCache(str(tmp_path / 'analysis.db')) as cache:
+        assert cache.get(key) is None
+        cache.put(key, {'success': True, 'message': 'ok'})
+    with AnalysisCache(str(tmp_path / 'analysis.db')) as cache:
+        assert cache.get(key) == {'success': True, 'message': 'ok'}
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    with AnalysisCache(str(tmp_path / 'analysis.db'), max_bytes=None) as cache:
+        for key in ('a', 'b', 'c'):
+            cache.put(key, {'message': 'x' * 1000})
+            time.sleep(0.01)
+        cache.get('a')
+        cache.max_bytes = 2500
+        cache.put('d', {'message': 'x' * 1000})
+
+        assert cache.get('b') is None and cache.get('c') is None
+        assert cache.get('a') is not None and cache.get('d') is not None
+        assert cache.stats()['evictions'] == 2
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from teaching_utils.teaching_lib import analysis_engines
+from teaching_utils.teaching_lib.analysis_engines import (AnalysisEngine, get_engine, get_engine_class, replay_key,
+                                                           OllamaEngine)
+
+
+class _EchoEngine(AnalysisEngine):
+    def analyze(self, prompt, model, role='user', temperature=None):
+        return {'success': True, 'duration': 0.1, 'message': f"{model}: {prompt.upper()}"}
+
+
+@pytest.fixture
+def echo_engine(monkeypatch):
+    monkeypatch.setitem(analysis_engines._ENGINE_CLASSES, 'test-echo', _EchoEngine)
+    monkeypatch.setattr(analysis_engines, '_ENGINES', {})
+    return 'test-echo'
+
+
+def test_registry_aliases_and_shared_instances():
+    assert get_engine_class('ollama') is OllamaEngine
+    assert get_engine_class('codellama') is OllamaEngine
+    assert get_engine('replay', {'latency': 0.0}) is get_engine('replay', {'latency': 0.0})
+    assert get_engine('replay', {'latency': 0.0}) is not get_engine('replay', {'latency': 0.01})
+
+
+def test_replay_engine_returns_recorded_responses():
+    recorded = {'success': True, 'message': 'Good job'}
+    engine = get_engine('replay', {'responses': {replay_key('gpt', 'user', 'prompt'): recorded},
+                                   'latency': 0.02, 'latency_jitter': 0.01})
+
+    start = time.monotonic()
+    assert engine.analyze('prompt', 'gpt') == recorded
+    assert time.monotonic() - start >= 0.01
+    assert engine.analyze('other', 'gpt') == engine.analyze('other', 'gpt')
+
+
+def test_recorded_responses_are_replayed(tmp_path, echo_engine):
+    responses_file = str(tmp_path / 'responses.jsonl')
+    recorder = get_engine('record', {'engine': echo_engine, 'responses_file': responses_file})
+    recorded = recorder.analyze('first prompt', 'gpt')
+    # A second recorder (e.g. in another process) appends to the same file
+    get_engine('record', {'engine': echo_engine, 'responses_file': responses_file, 'engine_options': {}}).analyze(
+        'second prompt', 'gpt', role='system')
+    with open(responses_file, 'a') as f:
+        f.write('{"key": "interrupted')
+
+    replay = get_engine('replay', {'responses_file': responses_file, 'strict': True})
+    assert replay.analyze('first prompt', 'gpt') == recorded == {'success': True, 'duration': 0.1,
+                                                                 'message': 'gpt: FIRST PROMPT'}
+    assert replay.analyze('second prompt', 'gpt', role='system')['message'] == 'gpt: SECOND PROMPT'
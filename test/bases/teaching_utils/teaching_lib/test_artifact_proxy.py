@@ -0,0 +1,94 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from teaching_utils.teaching_lib.artifact_proxy import ArtifactProxy
+
+UPSTREAM_FILES = {
+    '/maven2/org/lib/1.0/lib-1.0.jar': b'jar content',
+    '/simple/demo-pkg/': b'<a href="https://files.example/packages/ab/demo_pkg-1.0-py3-none-any.whl#sha256=0">'
+                         b'demo_pkg-1.0-py3-none-any.whl</a>',
+}
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        _UpstreamHandler.requests.append(self.path)
+        data = UPSTREAM_FILES.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _UpstreamHandler.requests = []
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _get(proxy: ArtifactProxy, path: str) -> bytes:
+    with urllib.request.urlopen(f"http://127.0.0.1:{proxy.port}{path}", timeout=10) as response:
+        return response.read()
+
+
+def test_artifacts_are_read_through_and_stored(tmp_path, upstream):
+    upstreams = {'maven': f"{upstream}/maven2", 'pypi': f"{upstream}/simple",
+                 'pypi_files': "https://files.example/packages"}
+    with ArtifactProxy(str(tmp_path / 'store'), host='127.0.0.1', upstreams=upstreams) as proxy:
+        assert _get(proxy, '/maven2/org/lib/1.0/lib-1.0.jar') == b'jar content'
+        assert _get(proxy, '/maven2/org/lib/1.0/lib-1.0.jar') == b'jar content'
+        index = _get(proxy, '/pypi/simple/Demo_Pkg/')
+        with pytest.raises(urllib.error.HTTPError):
+            _get(proxy, '/maven2/org/missing/1.0/missing-1.0.pom')
+        stats = proxy.stats()
+
+    assert _UpstreamHandler.requests.count('/maven2/org/lib/1.0/lib-1.0.jar') == 1
+    assert b'href="../../packages/ab/demo_pkg-1.0-py3-none-any.whl#sha256=0"' in index
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['not_found'] == 1
+    assert 'host.docker.internal:' in (tmp_path / 'store' / 'settings.xml').read_text()
+
+
+def test_offline_proxy_serves_seeded_packages(tmp_path):
+    (tmp_path / 'wheels').mkdir()
+    (tmp_path / 'wheels' / 'demo_pkg-1.0-py3-none-any.whl').write_bytes(b'wheel')
+    (tmp_path / 'wheels' / 'other-2.0.tar.gz').write_bytes(b'sdist')
+
+    with ArtifactProxy(str(tmp_path / 'store'), host='127.0.0.1', offline=True) as proxy:
+        proxy.seed('pypi', str(tmp_path / 'wheels'))
+        index = _get(proxy, '/pypi/simple/demo-pkg/').decode()
+        assert _get(proxy, '/pypi/packages/local/demo_pkg-1.0-py3-none-any.whl') == b'wheel'
+        with pytest.raises(urllib.error.HTTPError):
+            _get(proxy, '/maven2/org/lib/1.0/lib-1.0.jar')
+        settings = proxy.container_settings()
+
+    assert '../../packages/local/demo_pkg-1.0-py3-none-any.whl' in index and 'other' not in index
+    assert settings['extra_hosts'] == ['host.docker.internal:host-gateway']
+    assert settings['environment']['PIP_INDEX_URL'].endswith('/pypi/simple/')
+
+
+def test_proxy_listens_on_the_docker_bridge_by_default(tmp_path, monkeypatch):
+    from teaching_utils.teaching_lib import artifact_proxy
+
+    gateways = iter(['127.0.0.1', None])
+    monkeypatch.setattr(artifact_proxy, 'docker_bridge_gateway', lambda network='bridge': next(gateways))
+    for _ in range(2):
+        with ArtifactProxy(str(tmp_path / 'store'), offline=True) as proxy:
+            # Stands for the bridge gateway, or the fallback when it is not found: never all the interfaces
+            assert proxy._server.server_address[0] == '127.0.0.1'
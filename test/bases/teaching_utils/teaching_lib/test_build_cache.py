@@ -0,0 +1,138 @@
+import os
+
+from teaching_utils.teaching_lib.build_cache import BuildCacheManager
+from teaching_utils.teaching_lib.code_tester import CSubmissionTest, JavaSubmissionTest, PythonSubmissionTest
+
+
+def test_overlays_are_merged_into_the_base(tmp_path):
+    seed = tmp_path / 'seed' / 'org' / 'lib' / '1.0'
+    seed.mkdir(parents=True)
+    (seed / 'lib-1.0.jar').write_text('seeded')
+    manager = BuildCacheManager(str(tmp_path / 'cache'), seeds={'maven': str(tmp_path / 'seed')})
+
+    first = manager.open('job_1', ['maven', 'ccache'])
+    second = manager.open('job_2', ['maven'])
+    assert f"{manager.base_path('maven')}:/mnt/cache/maven:ro" in first.mounts()
+    assert f"{manager.base_path('ccache')}:/mnt/cache/ccache:ro" in first.mounts()
+    # A downloaded artifact, a temporary resolver file and a compiler cache entry with its stats log
+    downloaded = os.path.join(first.overlay_path('maven'), 'org', 'other', '2.0')
+    os.makedirs(downloaded)
+    with open(os.path.join(downloaded, 'other-2.0.jar'), 'w') as f:
+        f.write('downloaded')
+    with open(os.path.join(downloaded, 'other-2.0.jar.lastUpdated'), 'w') as f:
+        f.write('')
+    os.makedirs(os.path.join(first.overlay_path('ccache'), 'a', 'b'))
+    with open(os.path.join(first.overlay_path('ccache'), 'a', 'b', 'cdefR'), 'w') as f:
+        f.write('object')
+    with open(os.path.join(first.overlay_path('ccache'), 'stats.log'), 'w') as f:
+        f.write('# /mnt/code/main.c\ncache_miss\n# /mnt/code/lib.c\ndirect_cache_hit\n')
+
+    stats = first.close()
+    second.close()
+
+    assert stats['maven'] == {'hits': None, 'misses': 1, 'merged_files': 1, 'merged_bytes': 10}
+    assert stats['ccache']['hits'] == 1 and stats['ccache']['misses'] == 1
+    base = manager.base_path('maven')
+    assert sorted(os.listdir(os.path.join(base, 'org'))) == ['lib', 'other']
+    assert not os.path.exists(os.path.join(base, 'org', 'other', '2.0', 'other-2.0.jar.lastUpdated'))
+    assert os.listdir(os.path.join(str(tmp_path / 'cache'), 'overlays')) == []
+    assert manager.stats()['maven']['jobs'] == 2
+
+    # Compiler cache entries are merged with the layout of the read-only remote storage, and overlays start empty
+    assert os.listdir(manager.base_path('ccache')) == ['abcdef']
+    third = manager.open('job_3', ['ccache'])
+    assert os.listdir(third.overlay_path('ccache')) == []
+    third.close()
+
+
+def _merge_jar(manager: BuildCacheManager, name: str, age: float = 0):
+    session = manager.open(f'job_{name}', ['maven'])
+    folder = os.path.join(session.overlay_path('maven'), 'org', name)
+    os.makedirs(folder)
+    with open(os.path.join(folder, f'{name}.jar'), 'w') as f:
+        f.write('x' * 10)
+    session.close()
+    path = os.path.join(manager.base_path('maven'), 'org', name, f'{name}.jar')
+    os.utime(path, (os.path.getmtime(path) - age, os.path.getmtime(path) - age))
+
+
+def test_base_caches_evict_the_least_recently_used_files(tmp_path):
+    manager = BuildCacheManager(str(tmp_path / 'cache'), max_bytes={'maven': 35})
+    _merge_jar(manager, 'used', age=400)
+    _merge_jar(manager, 'old', age=300)
+    _merge_jar(manager, 'new', age=100)
+    # Found in the base again, so it becomes the most recently used file
+    _merge_jar(manager, 'used')
+    _merge_jar(manager, 'extra')
+
+    base = os.path.join(manager.base_path('maven'), 'org')
+    assert os.listdir(os.path.join(base, 'old')) == []
+    assert all(os.listdir(os.path.join(base, name)) for name in ('used', 'new', 'extra'))
+    assert manager.stats()['maven']['evicted_files'] == 1
+
+
+def test_pip_downloads_are_captured_and_counted(tmp_path):
+    (tmp_path / 'wheels').mkdir()
+    (tmp_path / 'wheels' / 'cached-1.0-py3-none-any.whl').write_text('cached')
+    manager = BuildCacheManager(str(tmp_path / 'cache'), seeds={'pip': str(tmp_path / 'wheels')})
+    session = manager.open('job', ['pip'])
+    assert 'pip download' in session.setup_command()
+    # Packages saved by "pip download", copied from the base or downloaded, and the HTTP cache of pip
+    downloads = os.path.join(session.overlay_path('pip'), 'downloads')
+    os.makedirs(downloads)
+    for name in ('cached-1.0-py3-none-any.whl', 'fresh-2.0.tar.gz'):
+        with open(os.path.join(downloads, name), 'w') as f:
+            f.write(name)
+    os.makedirs(os.path.join(session.overlay_path('pip'), 'http-v2', 'a'))
+    with open(os.path.join(session.overlay_path('pip'), 'http-v2', 'a', 'entry.body'), 'w') as f:
+        f.write('body')
+
+    stats = session.close()
+
+    assert stats['pip']['hits'] == 1 and stats['pip']['misses'] == 1 and stats['pip']['merged_files'] == 1
+    assert sorted(os.listdir(manager.base_path('pip'))) == ['cached-1.0-py3-none-any.whl', 'fresh-2.0.tar.gz']
+
+    (tmp_path / 'submission').mkdir()
+    tester = PythonSubmissionTest(str(tmp_path / 'submission'), config={
+        'build_cache': manager, 'build_cache_kinds': ['pip'], 'host_tmp': str(tmp_path / 'tmp'),
+        'perform_analysis': False})
+    tester._prepare_environment()
+    cmd = tester._prepare_container_command()
+    tester._cleanup_environment()
+    assert cmd[-1].startswith('if [ -f requirements.txt ]; then pip download') and cmd[-1].endswith(tester.run_cmd)
+
+
+def test_java_build_cache_replaces_the_shared_maven_mount(tmp_path):
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'pom.xml').write_text('<project/>')
+    tester = JavaSubmissionTest(str(tmp_path / 'submission'), config={
+        'build_cache': str(tmp_path / 'cache'), 'host_tmp': str(tmp_path / 'tmp'), 'perform_analysis': False,
+        'environment': {'TZ': 'UTC'}})
+
+    tester._prepare_environment()
+    cmd = tester._prepare_container_command()
+    tester._cleanup_environment()
+
+    mounts = [cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-v']
+    assert not any(mount.startswith('/tmp/maven_cache') for mount in mounts)
+    assert any(mount.endswith(':/root/.m2/repository') for mount in mounts)
+    assert 'MAVEN_OPTS=-Dmaven.repo.local.tail=/mnt/cache/maven' in cmd and 'TZ=UTC' in cmd
+    assert os.listdir(tmp_path / 'cache' / 'overlays') == []
+
+
+def test_c_build_cache_keeps_the_default_image_compiler(tmp_path):
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'CMakeLists.txt').write_text('project(demo C)')
+    config = {'build_cache': str(tmp_path / 'cache'), 'host_tmp': str(tmp_path / 'tmp'), 'perform_analysis': False}
+    tester = CSubmissionTest(str(tmp_path / 'submission'), config=dict(config))
+    opted_in = CSubmissionTest(str(tmp_path / 'submission'), config=dict(config, build_cache_kinds=['ccache']))
+
+    tester._prepare_environment()
+    cmd = tester._prepare_container_command()
+    tester._cleanup_environment()
+
+    # ccache is not in every C image, so it is only used when requested
+    assert tester.image == 'xbaro/gcc-gtest:latest'
+    assert not any(arg.startswith('CMAKE_C_COMPILER_LAUNCHER=') for arg in cmd)
+    assert not any(arg.endswith(':/root/.ccache') for arg in cmd)
+    assert opted_in.build_cache_kinds == ['ccache']
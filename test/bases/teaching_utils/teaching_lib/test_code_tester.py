@@ -0,0 +1,515 @@
+import asyncio
+import os
+import pickle
+import random
+import socket
+import time
+
+from teaching_utils.teaching_lib import code_tester
+from teaching_utils.teaching_lib.code_tester import CodeActivityTester
+from teaching_utils.teaching_lib.fingerprint_utils import hash_tree
+from teaching_utils.teaching_lib.report_store import ReportStore
+from teaching_utils.teaching_lib.submissions import Submission, SubmissionSet
+from teaching_utils.teaching_lib.test_utils import ExecutionReport
+
+
+class FakeSubmissionTest:
+    executions = 0
+
+    def __init__(self, submission_path: str, config: dict = None):
+        self.submission_path = submission_path
+
+    def get_resources(self) -> dict:
+        return {"cpus": 1, "memory": None, "pids_limit": None}
+
+    def get_fingerprint(self) -> str:
+        return hash_tree(self.submission_path)
+
+    def run(self) -> ExecutionReport:
+        FakeSubmissionTest.executions += 1
+        time.sleep(random.uniform(0.0, 0.02))
+        return ExecutionReport(success=True, stdout=self.submission_path, stderr='', return_code=0, timeout=False,
+                               results_path=None)
+
+    async def run_async(self) -> ExecutionReport:
+        await asyncio.sleep(random.uniform(0.0, 0.02))
+        return self.run()
+
+
+def _create_tester(num_submissions: int, base_path: str = '/tmp') -> CodeActivityTester:
+    submissions = SubmissionSet()
+    for i in range(num_submissions):
+        submissions.add_submission(Submission(f'sub_{i:02d}', os.path.join(base_path, f'sub_{i:02d}')))
+    tester = CodeActivityTester(submissions, 'teaching_utils.teaching_lib.code_tester.RunSubmissionTest', options={})
+    tester._tester_class = FakeSubmissionTest
+    return tester
+
+
+def test_parallel_run_keeps_submission_order():
+    tester = _create_tester(12)
+    tester.run_tests(start=2, limit=10, jobs=4)
+
+    assert list(tester._reports.keys()) == [f'sub_{i:02d}' for i in range(2, 10)]
+    for key, report in tester._reports.items():
+        assert report.stdout == f'/tmp/{key}'
+        assert report.submission.get_key() == key
+
+
+def test_cache_is_keyed_by_submission_content(tmp_path):
+    for i in range(3):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'main.py').write_text(f'print({i})')
+    cache_file = str(tmp_path / 'cache.pkl')
+
+    FakeSubmissionTest.executions = 0
+    _create_tester(3, str(tmp_path)).run_tests(cache_file=cache_file)
+    assert FakeSubmissionTest.executions == 3
+
+    (tmp_path / 'sub_01' / 'main.py').write_text('print("changed")')
+    tester = _create_tester(3, str(tmp_path))
+    tester.run_tests(cache_file=cache_file)
+    assert FakeSubmissionTest.executions == 4
+    assert tester._reports['sub_00'].submission.get_key() == 'sub_00'
+
+
+def test_timing_summary():
+    tester = _create_tester(3)
+    for i, (key, total) in enumerate([('a', 4.0), ('b', 1.0), ('c', 2.0)]):
+        report = FakeSubmissionTest(key).run()
+        report.metadata['timings'] = {'staging': 0.5 * i, 'total': total}
+        tester._reports[key] = report
+
+    summary = tester.get_timing_summary(num_slowest=2)
+
+    assert summary['phases']['total']['p50'] == 2.0
+    assert summary['phases']['staging']['max'] == 1.0
+    assert [item['submission'] for item in summary['slowest']] == ['a', 'c']
+
+
+def test_resource_summary_and_profiles():
+    tester = _create_tester(3)
+    for key, cpu, memory, oom in [('a', 4.0, 300, False), ('b', 1.0, 1000, True), ('c', 2.0, 100, False)]:
+        report = FakeSubmissionTest(key).run()
+        report.metadata['resources'] = {'cpu_seconds': cpu, 'peak_memory_bytes': memory, 'oom_killed': oom}
+        tester._reports[key] = report
+
+    summary = tester.get_resource_summary(num_top=1)
+
+    assert summary['usage']['cpu_seconds']['total'] == 7.0
+    assert summary['oom_killed'] == ['b']
+    assert summary['top_cpu'] == [{'submission': 'a', 'cpu_seconds': 4.0}]
+    assert summary['top_memory'][0]['submission'] == 'b'
+
+    # The budget reserves the peak of the previous run, unless it was killed for lack of memory
+    tester._resource_profiles = {'sub_00': {'peak_memory_bytes': 400, 'oom_killed': False},
+                                 'sub_01': {'peak_memory_bytes': 400, 'oom_killed': True}}
+    declared = {'cpus': 1, 'memory': 1000, 'pids_limit': None}
+    assert tester._reserved_resources(Submission('sub_00', '/tmp/sub_00'), declared)['memory'] == 500
+    assert tester._reserved_resources(Submission('sub_01', '/tmp/sub_01'), declared)['memory'] == 1000
+
+
+def test_async_run_keeps_submission_order():
+    tester = _create_tester(10)
+    asyncio.run(tester.run_tests_async(start=1, limit=9, jobs=3))
+
+    assert list(tester._reports.keys()) == [f'sub_{i:02d}' for i in range(1, 9)]
+
+
+def test_identical_submissions_are_tested_once(tmp_path):
+    for i in range(4):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'main.py').write_text('print("team")' if i < 3 else 'print("other")')
+
+    FakeSubmissionTest.executions = 0
+    tester = _create_tester(4, str(tmp_path))
+    tester.run_tests(jobs=2)
+
+    assert FakeSubmissionTest.executions == 2
+    assert [report.submission.get_key() for report in tester._reports.values()] == [f'sub_{i:02d}' for i in range(4)]
+    assert tester._reports['sub_02'].metadata['deduplication']['source'] == 'sub_00'
+    assert 'deduplication' not in tester._reports['sub_03'].metadata
+
+
+def test_source_extraction_ranks_and_records_omitted(tmp_path):
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    data_path = tmp_path / 'data'
+    submission_path = tmp_path / 'submission'
+    os.makedirs(data_path)
+    os.makedirs(submission_path / 'tests')
+    (data_path / 'utils.py').write_text('x' * 30)
+    (submission_path / 'utils.py').write_text('x' * 30)
+    (submission_path / 'main.py').write_text('m' * 40)
+    (submission_path / 'tests' / 'test_main.py').write_text('t' * 20)
+    (submission_path / 'big.py').write_text('b' * 500)
+
+    tester = RunSubmissionTest(str(submission_path), {'data_path': str(data_path), 'host_tmp': str(tmp_path / 'tmp')})
+    code = tester._extract_source_code(100)
+    extraction = tester._get_source_extraction()
+
+    assert [os.path.basename(path) for path in extraction['files']] == ['main.py', 'test_main.py', 'utils.py']
+    assert [os.path.basename(path) for path in extraction['omitted']] == ['big.py']
+    assert extraction['chars'] == 90
+    assert code.index('main.py') < code.index('test_main.py')
+
+
+def test_module_analysis_is_concurrent_and_ordered(tmp_path):
+    import threading
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    class SlowAnalysisTest(RunSubmissionTest):
+        active = 0
+        max_active = 0
+        lock = threading.Lock()
+
+        def _perform_analysis(self, prompt, model, role: str = 'user') -> dict:
+            with self.lock:
+                SlowAnalysisTest.active += 1
+                SlowAnalysisTest.max_active = max(SlowAnalysisTest.max_active, SlowAnalysisTest.active)
+            time.sleep(0.05 if prompt.endswith('1') else 0.01)
+            with self.lock:
+                SlowAnalysisTest.active -= 1
+            return {'success': True, 'message': prompt}
+
+    tester = SlowAnalysisTest(str(tmp_path), {'analysis_custom_prompt': {'Exercici1': 'A:', 'Exercici2': 'B:', 'Exercici3': 'C:'},
+                                              'analysis_engine': 'fake_concurrent', 'analysis_concurrency': 2})
+    result = tester.analyze_code({'Exercici1': '1', 'Exercici2': '2', 'Exercici3': '3'})
+
+    assert list(result['info']) == ['Exercici1', 'Exercici2', 'Exercici3']
+    assert result['info']['Exercici3']['message'].endswith('3')
+    assert result['message'].startswith('Exercici1:')
+    assert SlowAnalysisTest.max_active == 2
+
+
+def test_analysis_runs_while_tests_execute(tmp_path):
+    import threading
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+    from teaching_utils.teaching_lib.output_capture import BoundedOutput
+
+    process_started, analysis_started = threading.Event(), threading.Event()
+    overlaps = {}
+
+    class PipelinedTest(RunSubmissionTest):
+        def _run_process(self, cmd: list[str]) -> int:
+            self._stdout, self._stderr = BoundedOutput(), BoundedOutput()
+            process_started.set()
+            # Only set while the process runs if the analysis does not wait for it
+            overlaps['process'] = analysis_started.wait(5)
+            return 0
+
+        def _perform_analysis(self, prompt, model, role: str = 'user') -> dict:
+            analysis_started.set()
+            overlaps['analysis'] = process_started.wait(5)
+            return {'success': True, 'message': 'analysis'}
+
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'main.py').write_text('print(1)')
+    tester = PipelinedTest(str(tmp_path / 'submission'), {'run_cmd': 'true', 'result_path': '/mnt/code/results',
+                                                          'host_tmp_basepath': str(tmp_path), 'output_log_path': None})
+    report = tester.run()
+
+    assert report.analysis == 'analysis'
+    assert report.metadata['analysis']['extraction']['files'][0].endswith('main.py')
+    assert overlaps == {'process': True, 'analysis': True}
+
+
+def test_environment_is_cleaned_when_the_run_fails(tmp_path):
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    class FailingTest(RunSubmissionTest):
+        def _prepare_code_execution(self):
+            raise RuntimeError("broken scaffold")
+
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'main.py').write_text('print(1)')
+    tester = FailingTest(str(tmp_path / 'submission'), {'run_cmd': 'true', 'host_tmp_basepath': str(tmp_path / 'tmp'),
+                                                        'output_log_path': None})
+    for run in (tester.run, lambda: asyncio.run(tester.run_async())):
+        try:
+            run()
+        except RuntimeError:
+            pass
+        else:
+            assert False, "The run did not fail"
+        assert os.listdir(tmp_path / 'tmp') == []
+
+
+def _create_sleeping_test(tmp_path, max_time: float):
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    class SleepingTest(RunSubmissionTest):
+        stopped = 0
+
+        def _prepare_container_command(self) -> list[str]:
+            super()._prepare_container_command()
+            # Stands for the docker client of a container that does not finish
+            return ['sleep', '30']
+
+        def _stop_container(self):
+            SleepingTest.stopped += 1
+
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'main.py').write_text('print(1)')
+    return SleepingTest(str(tmp_path / 'submission'), {'run_cmd': 'true', 'result_path': '/mnt/code/results',
+                                                       'max_time': max_time,
+                                                       'host_tmp_basepath': str(tmp_path / 'tmp'),
+                                                       'resource_accounting': False})
+
+
+def test_async_run_timeout_stops_the_container(tmp_path):
+    tester = _create_sleeping_test(tmp_path, max_time=0.2)
+    start = time.monotonic()
+    report = asyncio.run(tester.run_async())
+
+    assert report.timeout and not report.success
+    assert type(tester).stopped == 1
+    assert time.monotonic() - start < 10
+    assert os.listdir(tmp_path / 'tmp') == []
+
+
+def test_async_run_cancellation_stops_the_container(tmp_path):
+    tester = _create_sleeping_test(tmp_path, max_time=30)
+
+    async def cancel_run():
+        task = asyncio.create_task(tester.run_async())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.monotonic()
+    assert asyncio.run(cancel_run())
+    assert type(tester).stopped == 1
+    assert time.monotonic() - start < 10
+    assert os.listdir(tmp_path / 'tmp') == []
+
+
+def test_accounted_containers_are_inspected_before_removal(tmp_path, monkeypatch):
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    calls = []
+    monkeypatch.setattr(code_tester, 'inspect_container_state',
+                        lambda name: calls.append(('inspect', name)) or {'OOMKilled': True})
+    monkeypatch.setattr(code_tester, 'remove_container', lambda name: calls.append(('remove', name)) or True)
+
+    class QuickTest(RunSubmissionTest):
+        def _prepare_container_command(self) -> list[str]:
+            self.docker_cmd = super()._prepare_container_command()
+            return ['true']
+
+    (tmp_path / 'submission').mkdir()
+    (tmp_path / 'submission' / 'main.py').write_text('print(1)')
+    tester = QuickTest(str(tmp_path / 'submission'), {'run_cmd': 'true', 'result_path': '/mnt/code/results',
+                                                      'host_tmp_basepath': str(tmp_path / 'tmp'),
+                                                      'container_name': 'tu_quick', 'perform_analysis': False})
+    report = tester.run()
+
+    assert '--rm' not in tester.docker_cmd and '--cidfile' in tester.docker_cmd
+    assert calls == [('inspect', 'tu_quick'), ('remove', 'tu_quick')]
+    assert report.metadata['resources']['oom_killed'] is True
+
+
+def test_source_extraction_skips_scaffold_and_sends_diffs(tmp_path):
+    from teaching_utils.teaching_lib.code_tester import RunSubmissionTest
+
+    scaffold_path = tmp_path / 'scaffold' / 'src'
+    submission_path = tmp_path / 'submission' / 'repo' / 'src'
+    os.makedirs(scaffold_path)
+    os.makedirs(submission_path)
+    base = ''.join(f'int f{i}() {{ return {i}; }}\n' for i in range(40))
+    (scaffold_path / 'Base.java').write_text(base)
+    (scaffold_path / 'Utils.java').write_text(base)
+    (submission_path / 'Base.java').write_text(base)
+    (submission_path / 'Utils.java').write_text(base.replace('return 7;', 'return 70;'))
+    (submission_path / 'Student.java').write_text('class Student {}')
+
+    tester = RunSubmissionTest(str(tmp_path / 'submission'), {'analysis_scaffold_path': str(tmp_path / 'scaffold'),
+                                                              'host_tmp': str(tmp_path / 'tmp')})
+    code = tester._extract_source_code(None)
+    extraction = tester._get_source_extraction()
+
+    assert [os.path.basename(path) for path in extraction['scaffold_unchanged']] == ['Base.java']
+    assert [os.path.basename(path) for path in extraction['scaffold_diffs']] == ['Utils.java']
+    assert '+int f7() { return 70; }' in code and 'f30' not in code
+    assert 'class Student {}' in code
+
+
+def test_longest_expected_jobs_are_scheduled_first(tmp_path):
+    from teaching_utils.teaching_lib.report_store import ReportStore
+
+    for i, size in enumerate([10, 300, 20, 100]):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'main.py').write_text('#' * size)
+    cache_file = str(tmp_path / 'cache.db')
+    with ReportStore(cache_file) as store:
+        store.put_duration('sub_00', 100.0)
+        store.put_duration('sub_01', 10.0)
+
+    tester = _create_tester(4, str(tmp_path))
+    run = tester._start_run(0, None, cache_file, jobs=2)
+    try:
+        # Known durations are used, and the others are estimated from their size
+        assert [submission.get_key() for submission in run.pending] == ['sub_00', 'sub_03', 'sub_01', 'sub_02']
+    finally:
+        tester._finish_run(run, keep_reports=False)
+
+
+def test_distributed_run_with_local_workers(tmp_path):
+    for i in range(6):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'main.py').write_text(f'print({i})')
+
+    submissions = SubmissionSet()
+    for i in range(6):
+        submissions.add_submission(Submission(f'sub_{i:02d}', str(tmp_path / f'sub_{i:02d}')))
+    # Workers import the tester class, so a library class is used (staging only, without Docker or analysis)
+    tester = CodeActivityTester(submissions, 'teaching_utils.teaching_lib.code_tester.RunSubmissionTest', options={
+        'run_tests': False, 'perform_analysis': False, 'result_path': '/mnt/code/results',
+        'host_tmp_basepath': str(tmp_path / 'tmp'),
+        'reap_orphan_containers': False})
+    tester.run_tests_distributed(str(tmp_path / 'queue'), local_workers=2, poll_interval=0.05, timeout=60)
+
+    assert list(tester._reports.keys()) == [f'sub_{i:02d}' for i in range(6)]
+    for key, report in tester._reports.items():
+        assert report.success
+        assert report.submission.get_key() == key
+    local_workers = {f"{socket.gethostname()}_{i}" for i in range(2)}
+    assert all(report.metadata['worker'] in local_workers for report in tester._reports.values())
+
+
+def test_work_queue_requeues_expired_leases(tmp_path):
+    from teaching_utils.teaching_lib.work_queue import WorkQueue
+
+    queue = WorkQueue(str(tmp_path / 'queue'), lease_seconds=0.05)
+    queue.create({'run_id': 'test'})
+    queue.put(WorkQueue.job_id(0, 'a'), 'job a')
+
+    job_id, job = queue.claim()
+    assert job == 'job a' and queue.claim() is None
+    time.sleep(0.1)
+    assert queue.requeue_expired() == [job_id]
+    assert queue.claim() == (job_id, 'job a')
+    queue.complete(job_id, 'report a')
+    assert queue.result_ids() == [job_id] and queue.get_result(job_id) == 'report a'
+
+
+def test_work_queue_leases_use_the_storage_clock(tmp_path, monkeypatch):
+    from teaching_utils.teaching_lib import work_queue
+    from teaching_utils.teaching_lib.work_queue import WorkQueue
+
+    queue = WorkQueue(str(tmp_path / 'queue'), lease_seconds=60)
+    queue.create({'run_id': 'test'})
+    queue.put(WorkQueue.job_id(0, 'a'), 'job a')
+    queue.claim()
+    # A host whose clock is ahead does not expire the lease
+    monkeypatch.setattr(work_queue.time, 'time', lambda: time.monotonic() + 3600)
+
+    assert queue.requeue_expired() == []
+
+
+def test_work_queue_replaces_queues_of_crashed_coordinators(tmp_path):
+    from teaching_utils.teaching_lib.work_queue import HEARTBEAT_FILE, WorkQueue
+
+    queue = WorkQueue(str(tmp_path / 'queue'), lease_seconds=60)
+    queue.create({'run_id': 'crashed'})
+    try:
+        queue.create({'run_id': 'next'})
+    except RuntimeError:
+        pass
+    else:
+        assert False, "An active queue was replaced"
+    queue.create({'run_id': 'forced'}, force=True)
+    assert queue.load_manifest()['run_id'] == 'forced'
+
+    heartbeat_path = tmp_path / 'queue' / HEARTBEAT_FILE
+    os.utime(heartbeat_path, (time.time() - 120, time.time() - 120))
+    queue.create({'run_id': 'next'})
+    assert queue.load_manifest()['run_id'] == 'next'
+
+
+def test_image_digest_and_data_hash_are_resolved_once_per_run(tmp_path, monkeypatch):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'test.py').write_text('assert True')
+    for i in range(3):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'main.py').write_text(f'print({i})')
+    calls = {'digest': 0, 'data': 0}
+
+    def get_image_digest(image):
+        calls['digest'] += 1
+        return current_digest
+
+    def hash_tree(path):
+        calls['data'] += path == str(tmp_path / 'data')
+        return original_hash_tree(path)
+
+    original_hash_tree = code_tester.hash_tree
+    monkeypatch.setattr(code_tester, 'get_image_digest', get_image_digest)
+    monkeypatch.setattr(code_tester, 'hash_tree', hash_tree)
+    submissions = SubmissionSet()
+    for i in range(3):
+        submissions.add_submission(Submission(f'sub_{i:02d}', str(tmp_path / f'sub_{i:02d}')))
+    tester = CodeActivityTester(submissions, 'teaching_utils.teaching_lib.code_tester.RunSubmissionTest', options={
+        'image': 'grader:latest', 'data_path': str(tmp_path / 'data'), 'perform_analysis': False})
+
+    fingerprints = []
+    for current_digest in ('sha256:old', 'sha256:new'):
+        run = tester._start_run(0, None, None)
+        fingerprints.append(run.fingerprints)
+        tester._finish_run(run, keep_reports=False)
+
+    # Resolved once in each run, so a rebuilt image gives new fingerprints
+    assert calls == {'digest': 2, 'data': 2}
+    assert fingerprints[0]['sub_00'] != fingerprints[1]['sub_00']
+
+
+def test_scaffold_hash_is_computed_once_per_run(tmp_path, monkeypatch):
+    (tmp_path / 'scaffold').mkdir()
+    (tmp_path / 'scaffold' / 'Base.java').write_text('class Base {}')
+    for i in range(3):
+        os.makedirs(tmp_path / f'sub_{i:02d}')
+        (tmp_path / f'sub_{i:02d}' / 'Main.java').write_text(f'class Main{i} {{}}')
+    scaffold_hashes = []
+    original_hash_tree = code_tester.hash_tree
+
+    def hash_tree(path):
+        if path == str(tmp_path / 'scaffold'):
+            scaffold_hashes.append(path)
+        return original_hash_tree(path)
+
+    monkeypatch.setattr(code_tester, 'hash_tree', hash_tree)
+    submissions = SubmissionSet()
+    for i in range(3):
+        submissions.add_submission(Submission(f'sub_{i:02d}', str(tmp_path / f'sub_{i:02d}')))
+    tester = CodeActivityTester(submissions, 'teaching_utils.teaching_lib.code_tester.RunSubmissionTest', options={
+        'run_tests': False, 'analysis_engine': 'replay', 'analysis_scaffold_path': str(tmp_path / 'scaffold')})
+
+    run = tester._start_run(0, None, None)
+    tester._finish_run(run, keep_reports=False)
+
+    assert len(run.fingerprints) == 3 and len(scaffold_hashes) == 1
+
+
+def test_legacy_pickle_cache_reports_are_reused(tmp_path):
+    for key in ('sub_00', 'sub_01'):
+        (tmp_path / key).mkdir()
+        (tmp_path / key / 'main.py').write_text(key)
+    path = str(tmp_path / 'cache.pkl')
+    with open(path, 'wb') as f:
+        pickle.dump({'sub_00': ExecutionReport(success=True, stdout='legacy', stderr='', return_code=0, timeout=False,
+                                               results_path=None)}, f)
+
+    FakeSubmissionTest.executions = 0
+    tester = _create_tester(2, str(tmp_path))
+    tester.run_tests(cache_file=path)
+
+    assert FakeSubmissionTest.executions == 1
+    assert tester._reports['sub_00'].stdout == 'legacy'
+    assert (tmp_path / 'cache.pkl.legacy').exists()
+    with ReportStore(path) as store:
+        # Adopted with the fingerprint of the submission
+        assert len(store) == 2 and store.get_legacy('sub_00') is None
+        assert store.get(hash_tree(str(tmp_path / 'sub_00'))).stdout == 'legacy'
@@ -0,0 +1,28 @@
+import os
+import subprocess
+
+from teaching_utils.teaching_lib import containers
+from teaching_utils.teaching_lib.containers import ContainerPool, PooledContainer
+
+
+def test_pool_reset_removes_job_files_and_keeps_mounts(tmp_path, monkeypatch):
+    home = tmp_path / 'home'
+    (home / '.cache' / 'job').mkdir(parents=True)
+    (home / '.bashrc').write_text('export LEAKED=1')
+    (home / '.m2' / 'repository' / 'org').mkdir(parents=True)
+    (home / '.m2' / 'repository' / 'org' / 'lib.jar').write_text('jar')
+    (tmp_path / 'code' / 'build').mkdir(parents=True)
+    (tmp_path / 'code' / 'build' / 'main.o').write_text('object')
+    monkeypatch.setattr(containers, 'POOL_SCRATCH_PATHS', ('$HOME',))
+    pool = ContainerPool(container_mount=str(tmp_path / 'code'))
+    container = PooledContainer('pooled', str(tmp_path), str(tmp_path / 'code'))
+    container.key = ('image', (f"/host/maven:{home / '.m2' / 'repository'}",), ())
+
+    script = pool._reset_script(container)
+    assert script.startswith('kill -9 -1 ')
+    # Run without killing the processes of the test
+    result = subprocess.run(['bash', '-c', script.replace('kill -9 -1', 'true', 1)], env={'HOME': str(home)})
+
+    assert result.returncode == 0
+    assert os.listdir(tmp_path / 'code') == []
+    assert os.listdir(home) == ['.m2'] and (home / '.m2' / 'repository' / 'org' / 'lib.jar').exists()
@@ -0,0 +1,113 @@
+import http.client
+import json
+import socketserver
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from teaching_utils.teaching_lib.docker_api import DockerClient, STDOUT_STREAM, STDERR_STREAM
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'docker'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if int(self.headers.get('Content-Length', 0)) > 0:
+            self.server.requests.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        if self.path.startswith('/v1.41/containers/create'):
+            self._send(201, json.dumps({'Id': 'abc'}).encode())
+        elif self.path == '/v1.41/containers/abc/wait':
+            self._send(200, json.dumps({'StatusCode': 3}).encode())
+        else:
+            self._send(204, b'')
+
+    def do_GET(self):
+        if self.path.startswith('/v1.41/containers/abc/logs'):
+            frames = struct.pack('>BxxxL', STDOUT_STREAM, 3) + b'out' + struct.pack('>BxxxL', STDERR_STREAM, 3) + b'err'
+            self._send(200, frames, 'application/vnd.docker.raw-stream')
+        else:
+            self._send(404, json.dumps({'message': 'not found'}).encode())
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def test_client_runs_container_over_unix_socket(tmp_path):
+    socket_path = str(tmp_path / 'docker.sock')
+    server = FakeDockerServer(socket_path, FakeDockerHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = DockerClient(socket_path)
+        container_id = client.create_container('tu_test', {'Image': 'python', 'Cmd': ['true']})
+        client.start_container(container_id)
+
+        assert container_id == 'abc'
+        assert server.requests == [{'Image': 'python', 'Cmd': ['true']}]
+        assert list(client.logs(container_id)) == [(STDOUT_STREAM, b'out'), (STDERR_STREAM, b'err')]
+        assert client.wait_container(container_id, timeout=5) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_lost_connections_only_retry_idempotent_requests(tmp_path, monkeypatch):
+    client = DockerClient(str(tmp_path / 'docker.sock'))
+    sent = []
+
+    def send(connection, method, url, body):
+        sent.append(method)
+        if len(sent) == 1:
+            raise http.client.RemoteDisconnected("closed")
+        return None
+
+    monkeypatch.setattr(DockerClient, '_send', staticmethod(send))
+    with pytest.raises(http.client.RemoteDisconnected):
+        client.start_container('abc')
+    assert sent == ['POST']
+
+    sent.clear()
+    monkeypatch.setattr(DockerClient, '_check', staticmethod(lambda response, data: None))
+
+    class Response:
+        def read(self):
+            return b'{}'
+
+    monkeypatch.setattr(DockerClient, '_send', staticmethod(lambda *args: send(*args) or Response()))
+    assert client.inspect_container('abc') == {}
+    assert sent == ['GET', 'GET']
+
+
+def test_unavailable_api_is_checked_again(tmp_path, monkeypatch):
+    from teaching_utils.teaching_lib import docker_api
+
+    socket_path = str(tmp_path / 'docker.sock')
+    assert docker_api.get_docker_client(socket_path) is None
+    server = FakeDockerServer(socket_path, FakeDockerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # Not checked again until the retry delay
+        assert docker_api.get_docker_client(socket_path) is None
+        monkeypatch.setattr(docker_api, 'UNAVAILABLE_RETRY_SECONDS', 0)
+        monkeypatch.setattr(DockerClient, 'ping', lambda self: True)
+        assert isinstance(docker_api.get_docker_client(socket_path), DockerClient)
+    finally:
+        server.shutdown()
+        server.server_close()
+        docker_api._CLIENTS.pop(socket_path, None)
@@ -0,0 +1,26 @@
+import os
+
+from teaching_utils.teaching_lib.staging import FileIndex
+
+
+def _write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_index_matches_walk_order(tmp_path):
+    _write(tmp_path / 'a' / 'src' / 'main.cpp', 'int main() {}')
+    _write(tmp_path / 'b' / 'src' / 'main.cpp')
+    _write(tmp_path / 'node_modules' / 'main.cpp')
+    _write(tmp_path / 'pom.xml', '<project/>')
+
+    index = FileIndex(str(tmp_path))
+
+    walked = [os.path.join(root, 'main.cpp') for root, dirs, files in os.walk(tmp_path)
+              if 'main.cpp' in files and 'node_modules' not in root]
+    assert index.find_all('main.cpp') == walked
+    assert index.find_first('main.cpp', str(tmp_path / 'b')) == str(tmp_path / 'b' / 'src' / 'main.cpp')
+    assert index.find_first('missing.c') is None
+    assert [entry.size for entry in index.files(extensions=['.xml'])] == [len('<project/>')]
+    assert index.covers(str(tmp_path / 'a')) and not index.covers(str(tmp_path) + '_other')
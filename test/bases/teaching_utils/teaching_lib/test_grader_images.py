@@ -0,0 +1,163 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from teaching_utils.teaching_lib import grader_images
+from teaching_utils.teaching_lib.build_cache import BuildCacheManager
+from teaching_utils.teaching_lib.code_tester import CodeActivityTester, CSubmissionTest
+from teaching_utils.teaching_lib.grader_images import (build_grader_image, grader_image_dockerfile, grader_image_tag,
+                                                        IMAGE_BUILD_CACHES, MAVEN_TEST_GOALS)
+from teaching_utils.teaching_lib.submissions import SubmissionSet
+
+
+def test_grader_image_tag_follows_the_scaffold(tmp_path):
+    (tmp_path / 'scaffold').mkdir()
+    (tmp_path / 'scaffold' / 'CMakeLists.txt').write_text('project(test)')
+    dockerfile = grader_image_dockerfile('c', 'gcc-test:latest')
+
+    tag = grader_image_tag(dockerfile, 'gcc-test:latest', str(tmp_path / 'scaffold'))
+    assert tag == grader_image_tag(dockerfile, 'gcc-test:latest', str(tmp_path / 'scaffold'))
+    (tmp_path / 'scaffold' / 'CMakeLists.txt').write_text('project(changed)')
+    assert tag != grader_image_tag(dockerfile, 'gcc-test:latest', str(tmp_path / 'scaffold'))
+
+    assert dockerfile.startswith('FROM gcc-test:latest') and 'CMAKE_CXX_COMPILER_LAUNCHER=ccache' in dockerfile
+    # Warm-up errors fail the build, unless it is not strict
+    assert '|| true' not in dockerfile and 'exit 1' in dockerfile
+    assert 'exit 1' not in grader_image_dockerfile('c', 'gcc-test:latest', strict=False)
+    java_dockerfile = grader_image_dockerfile('java', 'maven:latest')
+    assert MAVEN_TEST_GOALS in java_dockerfile and '|| true' not in java_dockerfile
+    with pytest.raises(ValueError):
+        grader_image_dockerfile('python', 'python:3')
+    with pytest.raises(ValueError):
+        build_grader_image({}, 'c')
+
+
+def test_c_tester_keeps_the_image_option():
+    assert CSubmissionTest('/tmp/x', config={'image': 'derived:1'}).image == 'derived:1'
+    assert CSubmissionTest('/tmp/x').image == 'xbaro/gcc-gtest:latest'
+
+
+def test_build_caches_keep_reading_the_image_caches(tmp_path):
+    session = BuildCacheManager(str(tmp_path / 'cache')).open('job', ['maven', 'ccache'])
+    environment = session.environment({**IMAGE_BUILD_CACHES['java'], **IMAGE_BUILD_CACHES['c']})
+    session.close()
+
+    assert environment['MAVEN_OPTS'] == '-Dmaven.repo.local.tail=/mnt/cache/maven,/opt/grader/m2'
+    assert environment['CCACHE_REMOTE_STORAGE'] == ('file:/mnt/cache/ccache|read-only|layout=flat '
+                                                    'file:/opt/grader/ccache|read-only|layout=flat')
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    images = set()
+    builds = []
+
+    def docker_build(tag, context_path, timeout):
+        builds.append((tag, context_path, sorted(os.listdir(context_path))))
+        images.add(tag)
+
+    monkeypatch.setattr(grader_images, '_docker_build', docker_build)
+    monkeypatch.setattr(grader_images, '_image_exists', lambda image: image in images)
+    return images, builds
+
+
+def test_grader_images_are_built_once_and_used_by_the_tester(tmp_path, fake_docker):
+    images, builds = fake_docker
+    (tmp_path / 'scaffold').mkdir()
+    (tmp_path / 'scaffold' / 'CMakeLists.txt').write_text('project(test)')
+    config = {'data_path': str(tmp_path / 'scaffold')}
+
+    options = build_grader_image(config, 'c')
+    # The default base image is built from the Dockerfile of the repository, wherever the process runs
+    assert builds[0] == ('xbaro/gcc-gtest:latest', grader_images.GCC_GTEST_CONTEXT, ['Dockerfile'])
+    assert builds[1][0] == options['image'] and builds[1][2] == ['Dockerfile', 'code', 'scaffold']
+    assert options['docker_pull_policy'] == 'never' and options['image_build_caches'] == IMAGE_BUILD_CACHES['c']
+    assert build_grader_image(config, 'c') == options and len(builds) == 2
+
+    # Custom base images are not built from the gcc-gtest Dockerfile
+    images.add('custom:1')
+    tester = CodeActivityTester(SubmissionSet(), 'teaching_utils.teaching_lib.code_tester.CSubmissionTest',
+                                options=dict(config, image='custom:1'))
+    tag = tester.prepare_grader_image()
+    assert len(builds) == 3 and builds[2][0] == tag != options['image']
+    assert 'FROM custom:1' in grader_image_dockerfile('c', 'custom:1')
+    assert tester._options['image'] == tag and tester._options['docker_pull_policy'] == 'never'
+    assert tester.prepare_grader_image() == tag and len(builds) == 3
+
+
+def test_grader_image_builds_the_scaffold_as_the_tester_stages_it(tmp_path, monkeypatch):
+    images = set()
+    contexts = []
+
+    def docker_build(tag, context_path, timeout):
+        with open(os.path.join(context_path, 'Dockerfile')) as f:
+            dockerfile = f.read()
+        with open(os.path.join(context_path, 'code', 'CMakeLists.txt')) as f:
+            contexts.append((dockerfile, f.read(), sorted(os.listdir(os.path.join(context_path, 'code')))))
+        images.add(tag)
+
+    monkeypatch.setattr(grader_images, '_docker_build', docker_build)
+    monkeypatch.setattr(grader_images, '_image_exists', lambda image: image in images or image == 'gcc:1')
+    scaffold = tmp_path / 'scaffold'
+    os.makedirs(scaffold / 'app_template')
+    os.makedirs(scaffold / 'tests')
+    (scaffold / 'CMakeLists.txt').write_text('add_subdirectory($!-APP_PATH-!$)\n# $!-RESULT_PATH-!$\n')
+    (scaffold / 'app_template' / 'main.cpp').write_text('int main() {}')
+    (scaffold / 'tests' / 'test.cpp').write_text('// harness')
+
+    tester = CodeActivityTester(SubmissionSet(), 'teaching_utils.teaching_lib.code_tester.CSubmissionTest', options={
+        'data_path': str(scaffold), 'image': 'gcc:1', 'multi_project': True, 'multi_project_structure': 'folder',
+        'multi_project_module_regex': {'app': '^app'}})
+    tester.prepare_grader_image()
+
+    dockerfile, cmake_lists, code_files = contexts[0]
+    # Module folders and keys are replaced as in the runs of the submissions
+    assert cmake_lists == 'add_subdirectory(app_template)\n# /mnt/code/results\n'
+    assert code_files == ['CMakeLists.txt', 'app_template', 'tests']
+    assert 'cd /mnt/code && mkdir -p build && cd build' in dockerfile
+    assert 'cp -r /opt/grader/scaffold/. /mnt/data/' in dockerfile
+
+
+def _docker_available() -> bool:
+    return shutil.which('docker') is not None and subprocess.run(['docker', 'info'], capture_output=True).returncode == 0
+
+
+@pytest.mark.skipif(not _docker_available(), reason="Docker is not available")
+def test_c_grader_image_gives_compiler_cache_hits(tmp_path):
+    scaffold = tmp_path / 'scaffold'
+    os.makedirs(scaffold / 'src')
+    (scaffold / 'CMakeLists.txt').write_text('cmake_minimum_required(VERSION 3.10)\nproject(warm CXX)\n'
+                                             'add_executable(harness src/main.cpp)\n')
+    (scaffold / 'src' / 'main.cpp').write_text('#include <iostream>\nint main() { std::cout << 1; }\n')
+    options = build_grader_image({'data_path': str(scaffold)}, 'c')
+
+    result = subprocess.run(
+        ['docker', 'run', '--rm', '-v', f'{scaffold}:/mnt/code', options['image'], 'bash', '-c',
+         'ccache --zero-stats > /dev/null && cd /tmp && cp -r /mnt/code project && cd project && mkdir build && '
+         'cd build && CCACHE_BASEDIR=/tmp/project cmake .. > /dev/null && make > /dev/null && ccache --print-stats'],
+        capture_output=True, text=True)
+    stats = dict(line.split('\t') for line in result.stdout.splitlines() if '\t' in line)
+    assert int(stats.get('remote_storage_hit', 0)) > 0, result.stderr
+
+
+@pytest.mark.skipif(not _docker_available(), reason="Docker is not available")
+def test_java_grader_image_builds_offline(tmp_path):
+    scaffold = tmp_path / 'scaffold'
+    os.makedirs(scaffold / 'src' / 'main' / 'java')
+    (scaffold / 'pom.xml').write_text(
+        '<project xmlns="http://maven.apache.org/POM/4.0.0"><modelVersion>4.0.0</modelVersion>'
+        '<groupId>warm</groupId><artifactId>warm</artifactId><version>1</version>'
+        '<properties><maven.compiler.release>17</maven.compiler.release></properties>'
+        '<dependencies><dependency><groupId>junit</groupId><artifactId>junit</artifactId><version>4.13.2</version>'
+        '<scope>test</scope></dependency></dependencies></project>')
+    (scaffold / 'src' / 'main' / 'java' / 'Main.java').write_text('class Main {}')
+    options = build_grader_image({'data_path': str(scaffold)}, 'java')
+
+    # Offline, every plugin and dependency is read from the repository of the image
+    result = subprocess.run(
+        ['docker', 'run', '--rm', '-v', f'{scaffold}:/mnt/code', '-w', '/tmp', options['image'], 'bash', '-c',
+         f'cp -r /mnt/code project && cd project && mvn -B -q -o {MAVEN_TEST_GOALS}'],
+        capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout[-2000:]
@@ -0,0 +1,24 @@
+import io
+
+from teaching_utils.teaching_lib.output_capture import BoundedOutput
+
+
+def test_output_is_bounded(tmp_path):
+    log_file = str(tmp_path / 'out.log')
+    output = BoundedOutput(log_file, max_log_bytes=1000, head_bytes=10, tail_bytes=5)
+    output.drain(io.BytesIO(b'HEAD567890' + b'x' * 5000 + b'TAIL!'))
+    output.close()
+
+    excerpt = output.excerpt()
+    assert excerpt.startswith('HEAD567890')
+    assert excerpt.endswith('TAIL!')
+    assert '5000 bytes omitted' in excerpt
+    assert output.info()['log_truncated']
+    assert len(open(log_file, 'rb').read()) == 1000
+
+
+def test_short_output_is_kept():
+    output = BoundedOutput(head_bytes=4, tail_bytes=4)
+    for chunk in (b'abc', b'def', b'gh'):
+        output.feed(chunk)
+    assert output.excerpt() == 'abcdefgh'
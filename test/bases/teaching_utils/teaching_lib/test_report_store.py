@@ -0,0 +1,31 @@
+from teaching_utils.teaching_lib.report_store import ReportStore
+from teaching_utils.teaching_lib.test_utils import ExecutionReport
+
+
+def _report(stdout: str) -> ExecutionReport:
+    return ExecutionReport(success=True, stdout=stdout, stderr='', return_code=0, timeout=False, results_path=None)
+
+
+def test_reports_survive_reopening(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    with ReportStore(path) as store:
+        store.put('a', _report('first'))
+        store.put('b', _report('second'))
+
+    with ReportStore(path) as store:
+        assert store.keys() == {'a', 'b'}
+        assert store.get('b').stdout == 'second'
+        assert store.get('missing') is None
+
+
+def test_durations_keep_resource_profiles(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    with ReportStore(path) as store:
+        store.put_duration('a', 12.5, {'cpu_seconds': 3.0, 'peak_memory_bytes': 1024, 'oom_killed': True})
+        store.put_duration('b', 4.0)
+
+    with ReportStore(path) as store:
+        profiles = store.get_profiles()
+        assert store.get_durations() == {'a': 12.5, 'b': 4.0}
+    assert profiles['a']['peak_memory_bytes'] == 1024 and profiles['a']['oom_killed'] is True
+    assert profiles['b']['cpu_seconds'] is None
@@ -0,0 +1,54 @@
+from teaching_utils.teaching_lib.resource_accounting import (find_container_cgroup, read_cgroup_usage,
+                                                             usage_from_api_stats, CgroupSampler, ResourceUsage)
+
+
+def test_cgroup_usage_is_read(tmp_path):
+    cgroup = tmp_path / 'system.slice' / 'docker-abc.scope'
+    cgroup.mkdir(parents=True)
+    (cgroup / 'cpu.stat').write_text('usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\n')
+    (cgroup / 'memory.peak').write_text('104857600\n')
+    (cgroup / 'io.stat').write_text('8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0\n'
+                                    '8:16 rbytes=1024 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n')
+    (cgroup / 'memory.events').write_text('low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n')
+
+    path = find_container_cgroup('abc', str(tmp_path))
+    usage = read_cgroup_usage(path)
+
+    assert path == str(cgroup)
+    assert usage['cpu_seconds'] == 2.5 and usage['peak_memory_bytes'] == 104857600
+    assert usage['io_read_bytes'] == 5120 and usage['io_write_bytes'] == 8192
+    assert usage['oom_killed'] is True
+    assert find_container_cgroup('missing', str(tmp_path)) is None
+
+
+def test_usage_keeps_maximum_and_detects_oom_kills():
+    usage = ResourceUsage('api', memory_limit=1000)
+    assert usage.result() is None
+
+    usage.add(usage_from_api_stats({'cpu_stats': {'cpu_usage': {'total_usage': 10 ** 9}},
+                                    'memory_stats': {'usage': 990}}))
+    usage.add(usage_from_api_stats({'cpu_stats': {'cpu_usage': {'total_usage': 2 * 10 ** 9}},
+                                    'memory_stats': {'usage': 500}}))
+    usage.add(usage_from_api_stats({'memory_stats': {}, 'cpu_stats': {}}))
+
+    result = usage.result(0)
+    assert result['samples'] == 2 and result['cpu_seconds'] == 2.0 and result['peak_memory_bytes'] == 990
+    assert result['oom_killed'] is False
+    # Killed near the memory limit
+    assert usage.result(137)['oom_killed'] is True
+
+
+def test_sampler_reads_the_final_usage_of_short_containers(tmp_path):
+    cgroup = tmp_path / 'system.slice' / 'docker-abc.scope'
+    cgroup.mkdir(parents=True)
+    (cgroup / 'cpu.stat').write_text('usage_usec 1000000\n')
+    (cgroup / 'memory.peak').write_text('2048\n')
+    (tmp_path / 'container.cid').write_text('abc')
+
+    sampler = CgroupSampler(str(tmp_path / 'container.cid'), interval=60, cgroup_root=str(tmp_path))
+    sampler.start()
+    (cgroup / 'cpu.stat').write_text('usage_usec 3000000\n')
+    sampler.stop()
+
+    result = sampler.usage.result(0)
+    assert result['cpu_seconds'] == 3.0 and result['peak_memory_bytes'] == 2048
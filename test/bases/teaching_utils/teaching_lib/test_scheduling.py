@@ -0,0 +1,68 @@
+import threading
+import time
+
+from teaching_utils.teaching_lib.scheduling import ResourceBudget, parse_memory
+
+
+def test_parse_memory():
+    assert parse_memory('512m') == 512 * 1024 ** 2
+    assert parse_memory('2g') == 2 * 1024 ** 3
+    assert parse_memory(1000) == 1000
+    assert parse_memory(None) is None
+
+
+def test_budget_limits_concurrent_jobs():
+    budget = ResourceBudget(cpus=4, memory='4g')
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job():
+        with budget.reserve(2, '1g'):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=job) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+
+
+def test_async_budget_limits_concurrent_jobs():
+    import asyncio
+
+    budget = ResourceBudget(cpus=4, memory='4g')
+    running = []
+    peak = []
+
+    async def job():
+        async with budget.reserve_async(2, '1g'):
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+
+    async def main():
+        await asyncio.gather(*(job() for _ in range(6)))
+
+    asyncio.run(main())
+
+    assert max(peak) == 2
+    assert budget._used_cpus == 0 and budget._used_memory == 0
+
+
+def test_rate_limiter_spaces_requests():
+    from teaching_utils.teaching_lib.scheduling import RateLimiter
+
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start >= 4 / 50 - 0.005
@@ -0,0 +1,44 @@
+import os
+
+from teaching_utils.teaching_lib.staging import stage_tree, detach_file
+
+
+def test_hardlink_staging_does_not_write_through(tmp_path):
+    src = tmp_path / 'src'
+    os.makedirs(src / 'pkg')
+    (src / 'pkg' / 'main.cpp').write_text('int main() {}')
+    (src / 'CMakeLists.txt').write_text('$!-SOURCE_PATH-!$')
+    dst = tmp_path / 'dst'
+    os.makedirs(dst)
+    (dst / 'CMakeLists.txt').write_text('previous')
+
+    stats = stage_tree(str(src), str(dst), 'hardlink')
+
+    assert stats['hardlink'] + stats['copy'] == 2
+    assert (dst / 'pkg' / 'main.cpp').read_text() == 'int main() {}'
+
+    detach_file(str(dst / 'CMakeLists.txt'))
+    (dst / 'CMakeLists.txt').write_text('replaced')
+    assert (src / 'CMakeLists.txt').read_text() == '$!-SOURCE_PATH-!$'
+
+
+def test_links_outside_the_submission_are_not_staged(tmp_path):
+    (tmp_path / 'host').mkdir()
+    (tmp_path / 'host' / 'id_rsa').write_text('secret')
+    src = tmp_path / 'src'
+    os.makedirs(src / 'pkg')
+    (src / 'pkg' / 'main.c').write_text('int main() {}')
+    os.symlink(tmp_path / 'host' / 'id_rsa', src / 'evil')
+    os.symlink(tmp_path / 'host', src / 'evil_dir')
+    os.symlink(src / 'pkg' / 'main.c', src / 'alias.c')
+    os.symlink('pkg', src / 'pkg_link')
+
+    for mode in ('hardlink', 'copy'):
+        dst = tmp_path / f'dst_{mode}'
+        stats = stage_tree(str(src), str(dst), mode)
+
+        assert not os.path.lexists(dst / 'evil') and not os.path.lexists(dst / 'evil_dir')
+        assert stats['symlink'] == 2
+        assert os.readlink(dst / 'alias.c') == os.path.join('pkg', 'main.c')
+        assert (dst / 'pkg_link' / 'main.c').read_text() == 'int main() {}'
+    assert (tmp_path / 'host' / 'id_rsa').stat().st_nlink == 1